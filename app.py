@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, Response
 import json
 import os
 from pathlib import Path
@@ -18,7 +18,127 @@ DEFAULT_CONFIG = {
     "api_config": {
         "base_url": "https://www.dmxapi.cn/v1",
         "api_key": "",
-        "model": "Doubao-1.5-pro-32k"
+        "model": "Doubao-1.5-pro-32k",
+        "endpoints": []
+    },
+    "performance_settings": {
+        "stream_responses": True,
+        "routing_mode": "two_stage",
+        "local_classifier": True,
+        "local_classifier_threshold": 0.9,
+        "response_cache": {
+            "enabled": True,
+            "cache_history_calls": False,
+            "max_entries": 2000,
+            "max_bytes": 20971520,
+            "stages": {}
+        },
+        "context_budget": {
+            "default_tokens": 3000,
+            "max_message_tokens": 800,
+            "stages": {"judge": 1500, "image": 2000}
+        },
+        "model_routing": {
+            "enabled": True,
+            "window": 50,
+            "probe_interval": 10,
+            "failure_penalty": 30.0,
+            "stages": {
+                "judge": {"model": None, "max_tokens": 100, "fallback": None, "p95_target": 3.0},
+                "match": {"model": None, "max_tokens": 500, "fallback": None, "p95_target": 5.0},
+                "generate": {"model": None, "max_tokens": 2000, "fallback": None, "p95_target": 30.0}
+            }
+        },
+        "resilience": {
+            "request_timeout": 60.0,
+            "connect_timeout": 5.0,
+            "max_retries": 1,
+            "hedging": True,
+            "hedge_kinds": ["stream"],
+            "hedge_quantile": 0.9,
+            "hedge_min_delay": 0.5,
+            "hedge_default_delay": 3.0,
+            "breaker_failures": 3,
+            "breaker_cooldown": 30.0
+        },
+        "tracing": {
+            "export": False,
+            "directory": "traces",
+            "max_files": 50
+        },
+        "traffic": {
+            "mode": "off",
+            "directory": "traffic",
+            "session_file": "",
+            "replay_speed": 1.0
+        },
+        "server": {
+            "host": "127.0.0.1",
+            "port": 8765,
+            "token": "",
+            "allowed_origins": [],
+            "send_audio": True,
+            "audio_chunk_size": 32768
+        },
+        "scheduler": {
+            "policy": "preempt",
+            "max_queue": 5,
+            "stage_reuse": True,
+            "reuse_ttl": 300.0
+        },
+        "rate_limit": {
+            "enabled": True,
+            "requests_per_second": 5.0,
+            "burst": 5,
+            "max_concurrent": 4,
+            "max_retries": 2,
+            "backoff_base": 1.0,
+            "backoff_max": 30.0,
+            "priorities": {"complete": "interactive", "stream": "interactive", "tts": "interactive",
+                           "image": "background"},
+            "endpoints": {}
+        },
+        "warmup": {
+            "enabled": True,
+            "ping": True,
+            "timeout": 10.0,
+            "min_interval": 15.0,
+            "keepalive_interval": 60.0,
+            "keepalive_max_idle": 1800.0
+        },
+        "tts_stream": {
+            "enabled": True,
+            "sample_rate": 24000,
+            "first_block": 0.3,
+            "block": 1.0,
+            "overlap": 0.1
+        },
+        "tts_pipeline": {
+            "enabled": True,
+            "min_text_chars": 40,
+            "min_sentence_chars": 8,
+            "lookahead": 1
+        },
+        "pitch_shift": {
+            "engine": "auto",
+            "n_steps": 4.1,
+            "short_clip_seconds": 3.0,
+            "short_engine": "numpy",
+            "long_engine": "rubberband"
+        },
+        "audio_cache": {
+            "enabled": True,
+            "max_entries": 5000,
+            "max_bytes": 209715200,
+            "raw": {
+                "max_entries": 5000,
+                "max_bytes": 209715200
+            }
+        },
+        "audio_variants": {
+            "rederive": True,
+            "rederive_max_clips": 200
+        }
     },
     "animation_settings": {
         "刚开启时": {
@@ -130,9 +250,11 @@ def load_config():
     return DEFAULT_CONFIG.copy()
 
 def save_config(config):
-    """保存配置文件"""
+    """保存配置文件，并立即重新加载（让同一进程中的流水线按新配置执行回调，如重新派生缓存音频）"""
     with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
         json.dump(config, f, ensure_ascii=False, indent=2)
+    from config_loader import reload_config
+    reload_config()
 
 def get_animation_folders():
     """获取pr目录下的动画文件夹"""
@@ -178,6 +300,8 @@ def save_config_api():
             config['background_story'] = data['background_story']
         if 'api_config' in data:
             config['api_config'].update(data['api_config'])
+        if 'performance_settings' in data:
+            config.setdefault('performance_settings', {}).update(data['performance_settings'])
         if 'animation_settings' in data:
             # 确保所有动画设置都包含完整的字段
             for scene_name, scene_config in data['animation_settings'].items():
@@ -297,6 +421,18 @@ def reload_config_api():
     except Exception as e:
         return jsonify({'success': False, 'message': f'重新加载配置失败：{str(e)}'})
 
+@app.route('/api/metrics')
+def metrics_api():
+    """运行指标：默认返回 JSON，?format=prometheus 时返回 Prometheus 文本格式"""
+    # 与女仆主程序同进程运行时才有请求相关的数据，单独运行 app.py 时只有进程指标
+    from metrics import metrics
+    try:
+        if request.args.get('format') == 'prometheus':
+            return Response(metrics.to_prometheus(), mimetype='text/plain; version=0.0.4')
+        return jsonify({'success': True, 'metrics': metrics.snapshot()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取运行指标失败：{str(e)}'}), 500
+
 @app.route('/api/get_animation_preview/<folder_name>')
 def get_animation_preview(folder_name):
     """获取动画预览"""
@@ -0,0 +1,253 @@
+"""
+语音合成的音频缓存
+音频按参数的哈希保存为 <目录>/<键>.wav，SQLite 索引（<目录>/index.sqlite3）记录每个文件的参数、大小和最近访问时间。
+分两层（见 audio_variants）：
+
+- raw_audio_cache（audio_cache/raw/）：接口返回的原始语音，按 (文本, 语气, 音色, 模型) 索引
+- audio_cache（audio_cache/）：在本地由原始语音派生的变调版本，按 (原始语音, 变调参数) 索引
+
+- 写入先写到临时文件再改名，进程中途退出不会留下半个 WAV 文件
+- 按条数和总字节数限制大小，超出时按最近访问时间淘汰（LRU），同时删除文件
+- 索引中没有记录的 WAV 文件（索引被删除、旧版本按文本 MD5 命名的缓存）在首次打开时补登记，参与淘汰；
+  旧版本的文件没有记录语气，不会被命中，之后按 LRU 逐渐淘汰
+
+命中率、条目数和占用字节数通过 metrics 输出。相关参数在 performance_settings.audio_cache 中配置，
+原始语音层的上限在其中的 raw 项里单独配置。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import soundfile as sf
+
+from metrics import metrics
+
+CACHE_DIR = "audio_cache"
+RAW_CACHE_DIR = os.path.join(CACHE_DIR, "raw")
+INDEX_FILE = "index.sqlite3"
+TEMP_SUFFIX = ".tmp"
+
+
+class AudioCache:
+    """带 SQLite 索引的音频文件缓存"""
+
+    def __init__(self, directory: str = CACHE_DIR, tier: str = None):
+        self.directory = directory
+        self.tier = tier
+        self._lock = threading.Lock()
+        self._conn = None
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "missing_files": 0,   # 索引中有记录但文件已被删除或读取失败
+        }
+
+    def _get_connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._conn = sqlite3.connect(os.path.join(self.directory, INDEX_FILE), check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS audio ("
+                "key TEXT PRIMARY KEY, params TEXT, sample_rate INTEGER, duration REAL, "
+                "size INTEGER, created_at REAL, last_access REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_audio_last_access ON audio(last_access)")
+            self._sweep(self._conn)
+            self._conn.commit()
+        return self._conn
+
+    def _sweep(self, conn: sqlite3.Connection):
+        """删除残留的临时文件，把索引中没有记录的 WAV 文件补登记到索引"""
+        known = {row[0] for row in conn.execute("SELECT key FROM audio")}
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(TEMP_SUFFIX):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            key, extension = os.path.splitext(name)
+            if extension != ".wav" or key in known:
+                continue
+            stat = os.stat(path)
+            conn.execute(
+                "INSERT INTO audio (key, params, sample_rate, duration, size, created_at, last_access) "
+                "VALUES (?, NULL, NULL, NULL, ?, ?, ?)",
+                (key, stat.st_size, stat.st_mtime, stat.st_mtime)
+            )
+
+    @staticmethod
+    def make_key(**params) -> str:
+        """根据全部合成参数（文本、语气、音色、模型、变调参数等）计算缓存键"""
+        payload = json.dumps(params, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_settings(self) -> dict:
+        """读取缓存配置（performance_settings.audio_cache，tier 对应的子项覆盖其中的上限）"""
+        try:
+            from config_loader import get_performance_config
+            settings = get_performance_config().get("audio_cache") or {}
+        except Exception:
+            return {}
+        if self.tier:
+            settings = {**settings, **(settings.get(self.tier) or {})}
+        return settings
+
+    @property
+    def enabled(self) -> bool:
+        return self.get_settings().get("enabled", True)
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.wav")
+
+    def get(self, key: str):
+        """
+        查询缓存
+
+        Returns:
+            命中时返回 (音频, 采样率)，未命中返回 None
+        """
+        if not self.enabled:
+            return None
+        path = self.path_for(key)
+        with self._lock:
+            conn = self._get_connection()
+            row = conn.execute("SELECT 1 FROM audio WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+        # 读文件时不持有锁；其间文件可能被其他线程的淘汰删除，读取失败按未命中处理
+        try:
+            audio = sf.read(path)
+        except Exception:
+            with self._lock:
+                conn.execute("DELETE FROM audio WHERE key = ?", (key,))
+                conn.commit()
+                self.stats["missing_files"] += 1
+                self.stats["misses"] += 1
+            return None
+        with self._lock:
+            conn.execute("UPDATE audio SET last_access = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            self.stats["hits"] += 1
+        print(f"使用缓存音频: {path}")
+        return audio
+
+    def contains(self, key: str) -> bool:
+        """索引中是否有该键（不计入命中率，不更新访问时间）"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            row = self._get_connection().execute("SELECT 1 FROM audio WHERE key = ?", (key,)).fetchone()
+        return row is not None and os.path.exists(self.path_for(key))
+
+    def read(self, key: str):
+        """读取音频但不计入命中率、不更新访问时间（后台任务使用），没有时返回 None"""
+        path = self.path_for(key)
+        if not self.contains(key):
+            return None
+        try:
+            return sf.read(path)
+        except Exception:
+            return None
+
+    def recent_keys(self, limit: int = None) -> list:
+        """按最近访问时间从新到旧列出键"""
+        with self._lock:
+            rows = self._get_connection().execute(
+                "SELECT key FROM audio ORDER BY last_access DESC LIMIT ?",
+                (-1 if limit is None else int(limit),)).fetchall()
+        return [row[0] for row in rows]
+
+    def put(self, key: str, y, sr: int, params: dict = None):
+        """写入缓存（先写临时文件再改名），并按配置的上限淘汰最久未访问的条目"""
+        if not self.enabled:
+            return
+        settings = self.get_settings()
+        max_entries = settings.get("max_entries", 5000)
+        max_bytes = settings.get("max_bytes", 200 * 1024 * 1024)
+
+        path = self.path_for(key)
+        with self._lock:
+            self._get_connection()
+        temp_path = f"{path}.{uuid.uuid4().hex}{TEMP_SUFFIX}"
+        try:
+            sf.write(temp_path, y, sr, format="WAV")
+            os.replace(temp_path, path)
+        except Exception as e:
+            print(f"缓存音频失败: {str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        now = time.time()
+
+        with self._lock:
+            conn = self._get_connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO audio (key, params, sample_rate, duration, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, json.dumps(params, ensure_ascii=False) if params else None, int(sr), len(y) / sr,
+                 os.path.getsize(path), now, now)
+            )
+            self.stats["stores"] += 1
+            self._evict(conn, max_entries, max_bytes)
+            conn.commit()
+        print(f"已缓存音频至: {path}")
+
+    def _evict(self, conn: sqlite3.Connection, max_entries: int, max_bytes: int):
+        """按最近访问时间淘汰，直到条数和总字节数都在上限内"""
+        count, total_size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM audio").fetchone()
+        while count > max_entries or total_size > max_bytes:
+            row = conn.execute("SELECT key, size FROM audio ORDER BY last_access ASC LIMIT 1").fetchone()
+            if row is None:
+                break
+            conn.execute("DELETE FROM audio WHERE key = ?", (row[0],))
+            try:
+                os.remove(self.path_for(row[0]))
+            except OSError:
+                pass
+            count -= 1
+            total_size -= row[1]
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        """清空缓存（删除所有音频文件）"""
+        with self._lock:
+            conn = self._get_connection()
+            for (key,) in conn.execute("SELECT key FROM audio").fetchall():
+                try:
+                    os.remove(self.path_for(key))
+                except OSError:
+                    pass
+            conn.execute("DELETE FROM audio")
+            conn.commit()
+
+    def get_stats(self) -> dict:
+        """获取命中率、条目数和占用字节数"""
+        with self._lock:
+            stats = dict(self.stats)
+            try:
+                count, total_size = self._get_connection().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM audio").fetchone()
+            except (sqlite3.Error, OSError):
+                count, total_size = 0, 0
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["entries"] = count
+        stats["bytes"] = total_size
+        return stats
+
+
+# 全局音频缓存实例：变调后的派生版本和接口返回的原始语音
+audio_cache = AudioCache()
+raw_audio_cache = AudioCache(RAW_CACHE_DIR, tier="raw")
+metrics.register_collector("audio_cache", audio_cache.get_stats)
+metrics.register_collector("raw_audio_cache", raw_audio_cache.get_stats)
@@ -0,0 +1,170 @@
+"""
+流式语音播放
+语音合成按 PCM 边下载边处理：收到的采样按块送入 StreamingPitchShifter 变调，每块处理完立即写入声卡输出流，
+第一块就绪就开始播放，不必等整段音频下载和变调结束。
+
+变调工具（rubberband 等）只能处理完整的一段音频，这里把输入切成块，每块前后各带 overlap 秒的上下文一起变调，
+再去掉上下文，相邻两块在交界处做一小段交叉淡化，消除分块处理的接缝。第一块用较短的 first_block 秒，
+让首音尽快出来，之后用较长的 block 秒，减少上下文带来的重复计算。
+
+相关参数在 performance_settings.tts_stream 中配置。
+"""
+
+import queue
+import threading
+
+import numpy as np
+import sounddevice as sd
+
+# 每次写入输出流的采样时长（秒）：写入之间检查是否已停止，取消时最多再播放这么长
+WRITE_SLICE = 0.05
+
+
+def get_settings() -> dict:
+    """读取流式语音配置（performance_settings.tts_stream）"""
+    try:
+        from config_loader import get_performance_config
+        return get_performance_config().get("tts_stream") or {}
+    except Exception:
+        return {}
+
+
+class StreamingPitchShifter:
+    """
+    分块变调：feed 送入新采样，返回已经可以播放的输出块；输入结束后调用 flush 取出剩余部分
+
+    Args:
+        shift: shift(y, sr) -> 变调后的音频，长度与输入相同
+        sample_rate: 采样率
+        first_block / block: 第一块和之后每块的时长（秒）
+        overlap: 每块前后附带的上下文时长（秒），交叉淡化长度为其一半
+    """
+
+    def __init__(self, shift, sample_rate: int, first_block: float = 0.3, block: float = 1.0,
+                 overlap: float = 0.1):
+        self._shift = shift
+        self.sample_rate = sample_rate
+        self._first_block = max(1, int(first_block * sample_rate))
+        self._block = max(1, int(block * sample_rate))
+        self._context = max(0, int(overlap * sample_rate))
+        self._fade = min(self._context // 2, self._first_block, self._block)
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self._offset = 0        # _buffer[0] 对应的输入采样序号
+        self._position = 0      # 下一个输出采样对应的输入采样序号
+        self._tail = None       # 上一块多算出的、与下一块开头交叉淡化的部分
+
+    def _block_length(self) -> int:
+        return self._first_block if self._position == 0 else self._block
+
+    @property
+    def _end(self) -> int:
+        return self._offset + len(self._buffer)
+
+    def feed(self, samples: np.ndarray) -> list:
+        self._buffer = np.concatenate([self._buffer, np.asarray(samples, dtype=np.float32)])
+        blocks = []
+        # 块后面的上下文也到齐了才处理
+        while self._end >= self._position + self._block_length() + self._context:
+            blocks.append(self._process(self._block_length(), final=False))
+        return blocks
+
+    def flush(self) -> list:
+        if self._end <= self._position:
+            return []
+        return [self._process(self._end - self._position, final=True)]
+
+    def _process(self, length: int, final: bool) -> np.ndarray:
+        start = max(self._offset, self._position - self._context)
+        stop = min(self._end, self._position + length + self._context)
+        window = self._buffer[start - self._offset:stop - self._offset]
+        shifted = np.asarray(self._shift(window, self.sample_rate), dtype=np.float32).reshape(-1)
+        if len(shifted) < len(window):
+            shifted = np.pad(shifted, (0, len(window) - len(shifted)))
+
+        begin = self._position - start
+        fade = 0 if final else min(self._fade, stop - self._position - length)
+        output = shifted[begin:begin + length + fade].copy()
+        if self._tail is not None:
+            size = min(len(self._tail), len(output))
+            weights = np.linspace(0.0, 1.0, size, endpoint=False, dtype=np.float32)
+            output[:size] = self._tail[:size] * (1 - weights) + output[:size] * weights
+        self._tail = output[length:] if fade else None
+
+        self._position += length
+        # 只保留下一块需要的上下文
+        keep_from = max(self._offset, self._position - self._context)
+        self._buffer = self._buffer[keep_from - self._offset:]
+        self._offset = keep_from
+        return output[:length]
+
+
+class AudioStreamPlayer:
+    """边收边播：后台线程把写入的音频块依次送进 sounddevice 输出流"""
+
+    def __init__(self, sample_rate: int):
+        self.sample_rate = sample_rate
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def write(self, block: np.ndarray) -> threading.Event:
+        """
+        加入一块音频（第一次写入时打开输出流开始播放）
+
+        Returns:
+            这一块全部送入输出流（或播放被停止）时置位的事件，可以用来控制提前写入多少
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="audio-stream")
+            self._thread.start()
+        written = threading.Event()
+        if self._stopped.is_set():
+            written.set()
+        else:
+            self._queue.put((block, written))
+        return written
+
+    def finish(self):
+        """所有音频块都已写入，播放完剩余部分后结束"""
+        self._queue.put(None)
+
+    def stop(self):
+        """立即停止播放，丢弃还没播放的部分"""
+        self._stopped.set()
+        self._queue.put(None)
+
+    def wait(self):
+        """等待播放结束"""
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        piece = max(1, int(WRITE_SLICE * self.sample_rate))
+        try:
+            with sd.OutputStream(samplerate=self.sample_rate, channels=1, dtype="float32") as stream:
+                while not self._stopped.is_set():
+                    entry = self._queue.get()
+                    if entry is None:
+                        break
+                    block, written = entry
+                    block = np.ascontiguousarray(block, dtype=np.float32).reshape(-1, 1)
+                    for offset in range(0, len(block), piece):
+                        if self._stopped.is_set():
+                            break
+                        stream.write(block[offset:offset + piece])
+                    written.set()
+                if self._stopped.is_set():
+                    # 不等缓冲区中的音频播完
+                    stream.abort()
+        except Exception as e:
+            print(f"流式播放失败: {e}")
+        finally:
+            # 没有播放的块也要通知等待方
+            self._stopped.set()
+            while True:
+                try:
+                    entry = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is not None:
+                    entry[1].set()
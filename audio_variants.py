@@ -0,0 +1,196 @@
+"""
+原始语音与派生版本
+接口返回的原始语音只下载一次，存入 raw_audio_cache；变调等处理在本地完成，结果作为派生版本存入 audio_cache，
+键由原始语音的键和派生参数（变调半音数、变调引擎配置）组成。修改变调参数后只需要从原始语音重新派生，
+不会再请求接口：
+
+- load：先查派生版本，没有则从原始语音即时派生（并写入缓存），都没有时返回 None，由调用方下载
+- store：下载后同时写入原始语音和派生版本
+- refresh：派生参数与上次不同（以及启动后第一次调用）时，在后台为最近使用的原始语音补齐当前参数的派生版本；
+  配置内容变化（设置页保存、手动修改配置文件）和连接预热时都会调用
+
+目前的派生处理只有变调；以后增加变速、音量归一化等处理时，把参数加到 derive_params 中即可让缓存区分。
+相关参数在 performance_settings.audio_variants 中配置。
+"""
+
+import threading
+
+from audio_cache import audio_cache, raw_audio_cache
+from config_loader import add_reload_listener
+from metrics import metrics
+from pitch_engine import choose_engine, engine_signature, get_pitch_steps, pitch_shift
+from tracing import span
+
+
+def get_settings() -> dict:
+    """读取派生版本配置（performance_settings.audio_variants）"""
+    try:
+        from config_loader import get_performance_config
+        return get_performance_config().get("audio_variants") or {}
+    except Exception:
+        return {}
+
+
+def derive_params() -> dict:
+    """当前配置下由原始语音得到派生版本的全部参数"""
+    return {
+        "n_steps": get_pitch_steps(),
+        "pitch_engine": engine_signature(),
+    }
+
+
+def variant_key(raw_key: str, params: dict) -> str:
+    return audio_cache.make_key(raw=raw_key, **params)
+
+
+def derive(y, sr: int, params: dict):
+    """按派生参数处理原始语音（耗时记录在 pitch_shift 阶段）"""
+    with span("pitch_shift"):
+        return pitch_shift(y, sr, params["n_steps"])
+
+
+def load(raw_params: dict, params: dict = None):
+    """
+    查询缓存：有派生版本直接返回，只有原始语音时在本地派生
+
+    Args:
+        raw_params: 决定原始语音的参数（文本、语气、音色、模型）
+        params: 派生参数，不传则按当前配置
+
+    Returns:
+        (派生后的音频, 采样率)；原始语音也没有缓存时返回 None
+    """
+    params = derive_params() if params is None else params
+    raw_key = raw_audio_cache.make_key(**raw_params)
+    key = variant_key(raw_key, params)
+    cached = audio_cache.get(key)
+    if cached is not None:
+        return cached
+    raw = raw_audio_cache.get(raw_key)
+    if raw is None:
+        return None
+    y, sr = raw
+    y = derive(y, sr, params)
+    metrics.inc("audio_variants_derived_total", source="raw_cache")
+    audio_cache.put(key, y, sr, {"raw": raw_key, **params})
+    return y, sr
+
+
+def store(raw_params: dict, raw_y, sr: int, params: dict = None, y=None, engine: str = None):
+    """
+    写入原始语音和派生版本
+
+    Args:
+        raw_y: 原始语音
+        y: 已经派生好的音频（例如流式播放时分块变调的结果），不传则在这里派生
+        engine: 得到 y 所用的变调引擎。与整段派生时会选用的引擎不同（流式分块用短音频的引擎，整段较长时
+                会用 long_engine）时不缓存 y，改为在后台从原始语音整段派生，保证同一个键下的音频一致
+
+    Returns:
+        派生后的音频（y 不缓存时原样返回 y）
+    """
+    params = derive_params() if params is None else params
+    raw_key = raw_audio_cache.make_key(**raw_params)
+    raw_audio_cache.put(raw_key, raw_y, sr, raw_params)
+    key = variant_key(raw_key, params)
+    if y is not None and engine is not None and engine != choose_engine(len(raw_y) / sr):
+        threading.Thread(target=_derive_and_store, args=(key, raw_key, raw_y, sr, params),
+                         daemon=True, name="audio-derive").start()
+        return y
+    if y is None:
+        y = derive(raw_y, sr, params)
+    audio_cache.put(key, y, sr, {"raw": raw_key, **params})
+    return y
+
+
+def _derive_and_store(key: str, raw_key: str, raw_y, sr: int, params: dict):
+    try:
+        audio_cache.put(key, derive(raw_y, sr, params), sr, {"raw": raw_key, **params})
+        metrics.inc("audio_variants_derived_total", source="stream")
+    except Exception as e:
+        print(f"⚠️ 派生缓存音频失败: {e}")
+
+
+class Rederiver:
+    """派生参数变化后，在后台为最近使用的原始语音补齐新参数的派生版本"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._params = None       # 最近一次开始补齐时的派生参数
+        self._thread = None
+        self.stats = {
+            "runs": 0,
+            "derived": 0,
+            "skipped": 0,         # 已有当前参数的派生版本
+            "errors": 0,
+        }
+
+    def refresh(self):
+        """派生参数与上次不同时开始后台补齐（已在进行时不重复启动，进行中的一轮会自己发现参数变化并重来）"""
+        settings = get_settings()
+        if not settings.get("rederive", True):
+            return
+        params = derive_params()
+        with self._lock:
+            if params == self._params or self._thread is not None:
+                return
+            self._params = params
+            self._thread = threading.Thread(target=self._run, args=(params, settings.get("rederive_max_clips", 200)),
+                                            daemon=True, name="audio-rederive")
+            self._thread.start()
+
+    def _run(self, params: dict, max_clips: int):
+        while True:
+            params = self._run_once(params, max_clips) or derive_params()
+            # 在锁内确认参数没有再变化后才结束，与 refresh 的检查互斥，不会漏掉结束前一刻的修改
+            with self._lock:
+                if params == self._params:
+                    self._thread = None
+                    return
+                self._params = params
+
+    def _run_once(self, params: dict, max_clips: int):
+        """
+        为最近使用的原始语音补齐 params 的派生版本
+
+        Returns:
+            运行期间参数又变了时返回新的参数（放弃本轮，按新参数重来），否则返回 None
+        """
+        self.stats["runs"] += 1
+        derived = 0
+        for raw_key in raw_audio_cache.recent_keys(max_clips):
+            current = derive_params()
+            if current != params:
+                return current
+            key = variant_key(raw_key, params)
+            if audio_cache.contains(key):
+                self.stats["skipped"] += 1
+                continue
+            raw = raw_audio_cache.read(raw_key)
+            if raw is None:
+                continue
+            try:
+                y, sr = raw
+                audio_cache.put(key, derive(y, sr, params), sr, {"raw": raw_key, **params})
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"⚠️ 重新派生缓存音频失败: {e}")
+                continue
+            derived += 1
+            self.stats["derived"] += 1
+            metrics.inc("audio_variants_derived_total", source="background")
+        if derived:
+            print(f"🎵 已按新的变调参数重新派生 {derived} 段缓存音频")
+        return None
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["running"] = self._thread is not None
+        return stats
+
+
+# 全局实例
+rederiver = Rederiver()
+metrics.register_collector("audio_variants", rederiver.get_stats)
+# 配置内容变化（设置页保存、手动修改）后检查变调参数是否变化
+add_reload_listener(rederiver.refresh)
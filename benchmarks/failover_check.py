@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多端点对冲 / 故障转移 / 熔断检查
+在本机启动几个 OpenAI 兼容的桩服务（慢速、正常、总是报错），
+分别验证对冲请求、失败后换端点和连续失败后的熔断行为，不需要真实的 API Key。
+
+用法（在项目根目录运行）：
+    python benchmarks/failover_check.py
+"""
+
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from endpoint_pool import Endpoint, EndpointPool  # noqa: E402
+from llm_client import client_manager  # noqa: E402
+
+SETTINGS = {
+    "hedging": True,
+    "hedge_kinds": ["complete", "stream"],
+    "hedge_default_delay": 0.3,
+    "breaker_failures": 2,
+    "breaker_cooldown": 60.0,
+}
+
+
+def make_handler(name: str, delay: float = 0.0, status: int = 200):
+    """构造一个桩服务：等待 delay 秒后返回固定内容，status 不为 200 时直接报错"""
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            time.sleep(delay)
+            if status != 200:
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(json.dumps({"error": {"message": f"{name} 故障"}}).encode("utf-8"))
+                return
+
+            content = f"来自 {name} 的回复"
+            if body.get("stream"):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                for piece in (content[:3], content[3:]):
+                    chunk = {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+                             "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+                return
+
+            payload = {"id": "stub", "object": "chat.completion", "created": 0, "model": "stub",
+                       "choices": [{"index": 0, "finish_reason": "stop",
+                                    "message": {"role": "assistant", "content": content}}]}
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return StubHandler
+
+
+def start_stub(name: str, **kwargs) -> Endpoint:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(name, **kwargs))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return Endpoint(name, f"http://127.0.0.1:{server.server_address[1]}/v1", "stub-key")
+
+
+def complete(pool: EndpointPool) -> str:
+    def attempt(endpoint, claim):
+        client = client_manager.get_client(endpoint.base_url, endpoint.api_key).with_options(max_retries=0)
+        response = client.chat.completions.create(model="stub", messages=[{"role": "user", "content": "hi"}])
+        claim()
+        return response.choices[0].message.content
+    return pool.run(attempt, kind="complete")
+
+
+def stream(pool: EndpointPool) -> str:
+    def attempt(endpoint, claim):
+        client = client_manager.get_client(endpoint.base_url, endpoint.api_key).with_options(max_retries=0)
+        response = client.chat.completions.create(model="stub", messages=[{"role": "user", "content": "hi"}],
+                                                  stream=True)
+        parts = []
+        try:
+            for chunk in response:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if not claim():
+                        return None
+                    parts.append(delta)
+        finally:
+            response.close()
+        claim()
+        return "".join(parts)
+    return pool.run(attempt, kind="stream")
+
+
+def check(title: str, condition: bool, detail: str):
+    print(f"{'✅' if condition else '❌'} {title}: {detail}")
+    return condition
+
+
+def main():
+    slow = start_stub("slow", delay=2.0)
+    fast = start_stub("fast", delay=0.05)
+    broken = start_stub("broken", status=500)
+    results = []
+
+    pool = EndpointPool(SETTINGS, [slow, fast])
+    start_time = time.perf_counter()
+    answer = complete(pool)
+    elapsed = time.perf_counter() - start_time
+    results.append(check("对冲（普通请求）", "fast" in answer and elapsed < 1.5,
+                         f"{answer}，耗时 {elapsed:.2f}s，对冲 {pool.stats['hedges_fired']} 次"))
+
+    pool = EndpointPool(SETTINGS, [slow, fast])
+    start_time = time.perf_counter()
+    answer = stream(pool)
+    elapsed = time.perf_counter() - start_time
+    results.append(check("对冲（流式请求）", "fast" in answer and elapsed < 1.5, f"{answer}，耗时 {elapsed:.2f}s"))
+
+    pool = EndpointPool(SETTINGS, [broken, fast])
+    answer = complete(pool)
+    results.append(check("故障转移", "fast" in answer, f"{answer}，换端点 {pool.stats['failovers']} 次"))
+
+    for _ in range(3):
+        complete(pool)
+    results.append(check("熔断", broken.state == "open" and broken.stats["requests"] == SETTINGS["breaker_failures"],
+                         f"broken 状态 {broken.state}，共收到 {broken.stats['requests']} 次请求"))
+
+    print()
+    print("全部通过" if all(results) else "存在未通过的检查")
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
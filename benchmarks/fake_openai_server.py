@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地 OpenAI 兼容的替身服务
+不需要真实的 API Key 和网络，就能跑通 simple_ai_response / get_ai_response_stream / speak / describe_image：
+
+- /v1/chat/completions：普通和流式（SSE）响应；根据请求中的 Prompt 模板识别阶段（judge / route / chat / detail /
+  match / generate / final），带图片的请求识别为 vision，按脚本返回对应的内容
+- /v1/audio/speech：返回 wav 或 pcm（24kHz 16bit 单声道）正弦波，时长与文本长度成正比，分块发送
+- /v1/models：模型列表（用于连通性检查）
+
+首包延迟、抖动、流式出字间隔、语音合成延迟等都可以配置，也可以按阶段单独覆盖。
+
+用法（在项目根目录运行）：
+    python benchmarks/fake_openai_server.py --port 8808 --latency 0.3 --jitter 0.1
+    python benchmarks/fake_openai_server.py --script my_script.json
+
+脚本文件是一个 JSON 对象，字段同 DEFAULT_SETTINGS，例如：
+    {"latency": 0.5, "stages": {"chat": {"latency": 1.2, "response": {"reply": "好的主人♡", "tone": "Speak softly."}}}}
+response 可以是字符串、对象（序列化为 JSON 返回）或列表（依次轮流返回）。
+"""
+
+import argparse
+import io
+import itertools
+import json
+import os
+import random
+import string
+import sys
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+DEFAULT_REPLY = "好的主人，女仆这就为您效劳哟～今天也要元气满满地度过呢♡"
+DEFAULT_TONE = "Speak in a cheerful and positive tone."
+
+DEFAULT_RESPONSES = {
+    "judge": {"a": "chat"},
+    "route": {"a": "chat", "reply": DEFAULT_REPLY, "tone": DEFAULT_TONE, "task_summary": None,
+              "need_additional_data": None},
+    "chat": {"reply": DEFAULT_REPLY, "tone": DEFAULT_TONE},
+    "detail": {"task_summary": "列出桌面上的文件", "need_additional_data": None},
+    "match": {"matched": False, "matched_function": None, "args_value_list": []},
+    "generate": {"function_name": "list_desktop_files",
+                 "code": "import os\n\ndef main():\n    return '、'.join(os.listdir('.'))\n",
+                 "args_doc": [], "current_inputs": []},
+    "final": {"maid_response": "主人，已经帮您完成了哟～"},
+    "vision": "图片里是一只趴在键盘上的小猫。",
+    "default": "好的。",
+}
+
+DEFAULT_SETTINGS = {
+    "latency": 0.3,              # 首包延迟（秒）
+    "jitter": 0.1,               # 首包延迟的随机抖动（±秒）
+    "token_interval": 0.02,      # 流式响应每段之间的间隔（秒）
+    "chunk_chars": 4,            # 流式响应每段的字符数
+    "tts_latency": 0.4,          # 语音合成的首包延迟（秒）
+    "tts_seconds_per_char": 0.12,
+    "tts_realtime_factor": 4.0,  # 语音数据的发送速度（相对于实时播放的倍数，0 表示一次发完）
+    "sample_rate": 24000,
+    "error_rate": 0.0,           # 随机返回 500 的比例
+    "seed": None,
+    "stages": {},                # 阶段 -> {"latency", "jitter", "token_interval", "response"}
+}
+
+_completion_ids = itertools.count(1)
+
+
+def _load_stage_markers() -> list:
+    """
+    从 prompt.py 的模板中提取各阶段的识别片段：模板把变量放在最后，
+    去掉所有模板共同的称呼前缀后，第一行固定文本即可唯一识别阶段
+    """
+    try:
+        import prompt
+    except Exception as e:
+        print(f"⚠️ 无法导入 prompt.py，阶段识别不可用: {e}")
+        return []
+    templates = {
+        "judge": prompt.CODE_EXECUTION_JUDGEMENT_PROMPT,
+        "route": prompt.CODE_ROUTING_PROMPT,
+        "detail": prompt.CODE_DETAIL_PROMPT,
+        "match": prompt.CODE_LIBRARY_MATCHING_PROMPT,
+        "generate": prompt.CODE_GENERATION_PROMPT,
+        "final": prompt.FINAL_RESPONSE_PROMPT,
+        "chat": prompt.SMALL_TALK_PROMPT,
+    }
+    literals = {stage: next(string.Formatter().parse(template))[0] for stage, template in templates.items()}
+    common = os.path.commonprefix(list(literals.values()))
+    return [(stage, literal[len(common):].split("\n", 1)[0]) for stage, literal in literals.items()]
+
+
+def _message_text(message: dict) -> str:
+    content = message.get("content")
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+
+def _has_image(messages: list) -> bool:
+    return any(isinstance(message.get("content"), list) and
+               any(isinstance(part, dict) and part.get("type") == "image_url" for part in message["content"])
+               for message in messages)
+
+
+def make_wav(samples: np.ndarray, sample_rate: int) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+class FakeOpenAIServer:
+    """在后台线程运行的替身服务"""
+
+    def __init__(self, settings: dict = None, host: str = "127.0.0.1", port: int = 0):
+        self.settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        self.random = random.Random(self.settings.get("seed"))
+        self.stage_markers = _load_stage_markers()
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._cycles = {}
+        self._httpd = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def configure(self, **settings):
+        """修改延迟等配置（对之后的请求生效）"""
+        with self._lock:
+            self.settings.update(settings)
+            self._cycles.clear()
+
+    def count(self, stage: str):
+        with self._lock:
+            self.stats[stage] = self.stats.get(stage, 0) + 1
+
+    def stage_setting(self, stage: str, name: str):
+        return (self.settings.get("stages", {}).get(stage) or {}).get(name, self.settings.get(name))
+
+    def delay(self, stage: str, base: str = "latency") -> float:
+        latency = self.stage_setting(stage, base)
+        jitter = self.stage_setting(stage, "jitter") or 0.0
+        with self._lock:
+            offset = self.random.uniform(-jitter, jitter) if jitter else 0.0
+            failed = self.random.random() < (self.settings.get("error_rate") or 0.0)
+        return max(0.0, latency + offset), failed
+
+    def detect_stage(self, messages: list) -> str:
+        if _has_image(messages):
+            return "vision"
+        text = _message_text(messages[-1]) if messages else ""
+        for stage, marker in self.stage_markers:
+            if marker and marker in text:
+                return stage
+        return "default"
+
+    def response_for(self, stage: str) -> str:
+        response = (self.settings.get("stages", {}).get(stage) or {}).get("response")
+        if response is None:
+            response = DEFAULT_RESPONSES.get(stage, DEFAULT_RESPONSES["default"])
+        if isinstance(response, list):
+            with self._lock:
+                cycle = self._cycles.setdefault(stage, itertools.cycle(response))
+                response = next(cycle)
+        if isinstance(response, str):
+            return response
+        return json.dumps(response, ensure_ascii=False)
+
+    def synthesize(self, text: str) -> np.ndarray:
+        """按文本长度生成一段 440Hz 正弦波（int16）"""
+        sample_rate = self.settings["sample_rate"]
+        duration = max(0.3, len(text) * self.settings["tts_seconds_per_char"])
+        t = np.arange(int(duration * sample_rate)) / sample_rate
+        return (np.sin(2 * np.pi * 440 * t) * 0.2 * 32767).astype(np.int16)
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def fake(self) -> FakeOpenAIServer:
+        return self.server.fake
+
+    def _send_json(self, status: int, payload: dict):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, message: str):
+        self._send_json(500, {"error": {"message": message, "type": "server_error"}})
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "fake-model", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        path = self.path.rstrip("/")
+        if path.endswith("/chat/completions"):
+            self._chat_completions(body)
+        elif path.endswith("/audio/speech"):
+            self._speech(body)
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def _chat_completions(self, body: dict):
+        messages = body.get("messages") or []
+        stage = self.fake.detect_stage(messages)
+        self.fake.count(stage)
+        delay, failed = self.fake.delay(stage)
+        time.sleep(delay)
+        if failed:
+            self._send_error("随机注入的错误")
+            return
+
+        content = self.fake.response_for(stage)
+        model = body.get("model") or "fake-model"
+        completion_id = f"chatcmpl-fake-{next(_completion_ids)}"
+        prompt_tokens = sum(len(_message_text(message)) for message in messages)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(content),
+                 "total_tokens": prompt_tokens + len(content)}
+
+        if not body.get("stream"):
+            self._send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send_chunk(delta: dict, finish_reason=None, chunk_usage=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None
+                     else []}
+            if chunk_usage is not None:
+                chunk["usage"] = chunk_usage
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        interval = self.fake.stage_setting(stage, "token_interval")
+        size = max(1, self.fake.settings["chunk_chars"])
+        try:
+            send_chunk({"role": "assistant", "content": ""})
+            for start in range(0, len(content), size):
+                if start and interval:
+                    time.sleep(interval)
+                send_chunk({"content": content[start:start + size]})
+            send_chunk({}, finish_reason="stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                send_chunk(None, chunk_usage=usage)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端取消了请求（对冲失败方、被新输入取消等）
+            pass
+
+    def _speech(self, body: dict):
+        self.fake.count("tts")
+        delay, failed = self.fake.delay("tts", "tts_latency")
+        time.sleep(delay)
+        if failed:
+            self._send_error("随机注入的错误")
+            return
+
+        samples = self.fake.synthesize(body.get("input") or "")
+        sample_rate = self.fake.settings["sample_rate"]
+        if body.get("response_format") == "pcm":
+            data, content_type = samples.tobytes(), "audio/pcm"
+        else:
+            data, content_type = make_wav(samples, sample_rate), "audio/wav"
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+
+        # 按实时播放速度的若干倍分块发送，模拟边合成边下发
+        factor = self.fake.settings["tts_realtime_factor"]
+        chunk_size = sample_rate // 10 * 2  # 约 100 毫秒的音频
+        try:
+            for start in range(0, len(data), chunk_size):
+                self.wfile.write(data[start:start + chunk_size])
+                self.wfile.flush()
+                if factor:
+                    time.sleep(0.1 / factor)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容的替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8808)
+    parser.add_argument("--script", help="脚本文件（JSON），覆盖默认的延迟配置和各阶段的响应")
+    parser.add_argument("--latency", type=float, help="首包延迟（秒）")
+    parser.add_argument("--jitter", type=float, help="首包延迟抖动（±秒）")
+    parser.add_argument("--tts-latency", type=float, help="语音合成首包延迟（秒）")
+    parser.add_argument("--seed", type=int, help="随机数种子")
+    args = parser.parse_args()
+
+    settings = {}
+    if args.script:
+        with open(args.script, "r", encoding="utf-8") as f:
+            settings.update(json.load(f))
+    for name in ("latency", "jitter", "tts_latency", "seed"):
+        if getattr(args, name) is not None:
+            settings[name] = getattr(args, name)
+
+    server = FakeOpenAIServer(settings, args.host, args.port).start()
+    print(f"替身服务已启动: {server.base_url}")
+    print("在 maid_settings.json 的 api_config.base_url 中填入该地址即可离线运行（api_key 任意非空）")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+变调引擎基准测试
+用合成的类人声信号（带颤音的谐波，按音节起伏的包络）对比 pitch_engine 中各引擎在不同时长下的速度和音质：
+
+- 耗时：每次变调的中位数耗时，以及相对音频时长的实时倍数
+- 音高误差：输出基频与目标基频相差的音分（cents）
+- 频谱距离：输出与按目标音高直接合成的理想信号之间的对数谱距离（dB，越小越好）
+
+最后按结果给出 auto 模式 short_clip_seconds 的参考值（numpy 引擎在更短的音频上更快）。
+
+用法（在项目根目录运行）：
+    python benchmarks/pitch_benchmark.py
+    python benchmarks/pitch_benchmark.py --durations 0.3 1 3 10 --rounds 5 --engines numpy rubberband
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pitch_engine import ENGINES, available_engines, pitch_shift  # noqa: E402
+
+SAMPLE_RATE = 24000
+BASE_F0 = 220.0
+
+
+def synthesize(duration: float, f0: float, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """合成类人声的测试信号：基频 f0 带 5Hz 颤音，前 8 个谐波逐渐衰减，包络按 4Hz 起伏"""
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    phase = 2 * np.pi * np.cumsum(f0 * (1 + 0.01 * np.sin(2 * np.pi * 5 * t))) / sample_rate
+    signal = sum(np.sin(k * phase) / k for k in range(1, 9))
+    envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 4 * t)
+    return (0.2 * signal * envelope).astype(np.float64)
+
+
+def estimate_f0(y: np.ndarray, sample_rate: int = SAMPLE_RATE) -> float:
+    """用自相关估计基频（60~1000Hz）"""
+    y = y - np.mean(y)
+    spectrum = np.fft.rfft(y, n=2 * len(y))
+    correlation = np.fft.irfft(np.abs(spectrum) ** 2)[:len(y)]
+    low, high = int(sample_rate / 1000), int(sample_rate / 60)
+    lag = low + int(np.argmax(correlation[low:high]))
+    # 抛物线插值得到小数延迟
+    if 0 < lag < len(correlation) - 1:
+        a, b, c = correlation[lag - 1:lag + 2]
+        denominator = a - 2 * b + c
+        if denominator:
+            lag += 0.5 * (a - c) / denominator
+    return sample_rate / lag
+
+
+def spectral_distance(y: np.ndarray, reference: np.ndarray, n_fft: int = 1024) -> float:
+    """两段音频平均幅度谱之间的对数谱距离（dB）"""
+    def average_spectrum(x):
+        frames = len(x) // n_fft
+        if frames == 0:
+            return np.abs(np.fft.rfft(x, n=n_fft)) + 1e-9
+        x = x[:frames * n_fft].reshape(frames, n_fft) * np.hanning(n_fft)
+        return np.mean(np.abs(np.fft.rfft(x, axis=1)), axis=0) + 1e-9
+
+    def to_db(spectrum, floor):
+        return 20 * np.log10(np.maximum(spectrum, floor))
+    reference_spectrum = average_spectrum(reference)
+    # 只比较参考信号峰值以下 60dB 以内的部分，谐波之间几乎为零的频点不计入
+    floor = reference_spectrum.max() * 1e-3
+    difference = to_db(average_spectrum(y), floor) - to_db(reference_spectrum, floor)
+    return float(np.sqrt(np.mean(difference ** 2)))
+
+
+def run_engine(engine: str, duration: float, n_steps: float, rounds: int) -> dict:
+    source = synthesize(duration, BASE_F0)
+    target_f0 = BASE_F0 * 2 ** (n_steps / 12)
+    reference = synthesize(duration, target_f0)
+    timings = []
+    output = None
+    for _ in range(rounds):
+        start_time = time.perf_counter()
+        output = pitch_shift(source, SAMPLE_RATE, n_steps, engine=engine)
+        timings.append(time.perf_counter() - start_time)
+    elapsed = statistics.median(timings)
+    return {
+        "engine": engine,
+        "duration": duration,
+        "seconds": elapsed,
+        "realtime": duration / elapsed if elapsed else float("inf"),
+        "cents": 1200 * abs(np.log2(estimate_f0(output) / target_f0)),
+        "spectral_db": spectral_distance(output, reference),
+        "length_ok": len(output) == len(source),
+    }
+
+
+def print_report(results: list):
+    print(f"{'引擎':<16}{'时长(秒)':>10}{'耗时(秒)':>10}{'实时倍数':>10}{'音高误差(音分)':>16}{'频谱距离(dB)':>14}")
+    for result in results:
+        print(f"{result['engine']:<16}{result['duration']:>10.1f}{result['seconds']:>10.4f}"
+              f"{result['realtime']:>10.1f}{result['cents']:>16.1f}{result['spectral_db']:>14.2f}"
+              f"{'' if result['length_ok'] else '  长度不一致'}")
+
+
+def suggest_threshold(results: list, long_engine: str) -> float:
+    """numpy 引擎比 long_engine 快的最长时长，作为 short_clip_seconds 的参考"""
+    by_duration = {}
+    for result in results:
+        by_duration.setdefault(result["duration"], {})[result["engine"]] = result["seconds"]
+    faster = [duration for duration, timings in by_duration.items()
+              if "numpy" in timings and long_engine in timings and timings["numpy"] < timings[long_engine]]
+    return max(faster) if faster else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="变调引擎基准测试")
+    parser.add_argument("--durations", type=float, nargs="+", default=[0.3, 1.0, 3.0, 10.0],
+                        help="测试音频的时长（秒）")
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), help="要测试的引擎（默认测试所有可用的引擎）")
+    parser.add_argument("--n-steps", type=float, default=4.1, help="升调的半音数")
+    parser.add_argument("--rounds", type=int, default=3, help="每个组合重复的次数（取耗时中位数）")
+    args = parser.parse_args()
+
+    engines = args.engines or available_engines()
+    missing = [engine for engine in engines if engine not in available_engines()]
+    if missing:
+        print(f"以下引擎在当前环境中不可用，跳过: {', '.join(missing)}")
+        engines = [engine for engine in engines if engine not in missing]
+
+    # 预热（首次导入 scipy 等的开销不计入结果）
+    for engine in engines:
+        pitch_shift(synthesize(0.2, BASE_F0), SAMPLE_RATE, args.n_steps, engine=engine)
+
+    results = [run_engine(engine, duration, args.n_steps, args.rounds)
+               for duration in args.durations for engine in engines]
+    print_report(results)
+
+    for long_engine in ("rubberband", "rubberband-r3"):
+        threshold = suggest_threshold(results, long_engine)
+        if threshold is not None:
+            print(f"numpy 在 {threshold:g} 秒及以下的音频上比 {long_engine} 快，"
+                  f"可参考设置 short_clip_seconds 略大于该值")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
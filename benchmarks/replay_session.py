@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线重放录制的真实对话，检查本地处理耗时是否退化
+先在 maid_settings.json 中把 performance_settings.traffic.mode 设为 record 正常使用一段时间，
+得到 traffic/ 下的会话文件；之后用本脚本按会话中的用户输入重新驱动 maid_handle_input 和 speak，
+上游API的响应全部从会话文件回放（默认不等待，即只剩本地处理耗时）。
+
+输出每条输入的总耗时和 JSON 解析、历史读写、变调、翻译等本地阶段的耗时，
+可以用 --save 保存结果、用 --baseline 与之前保存的结果对比。
+
+用法（在项目根目录运行）：
+    python benchmarks/replay_session.py traffic/session_20250101_120000.jsonl
+    python benchmarks/replay_session.py session.jsonl --speed 1 --save before.json
+    python benchmarks/replay_session.py session.jsonl --baseline before.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from http_recorder import load_session_inputs  # noqa: E402
+from headless import NullProcessor  # noqa: E402
+from ttfa_benchmark import prepare_workdir, run_once  # noqa: E402
+
+# 回放时不访问网络，base_url 只是占位（回放按路径匹配记录）
+REPLAY_BASE_URL = "http://replay.invalid/v1"
+
+# 本地处理阶段（不含等待上游的时间）
+LOCAL_STAGES = ("json_parse", "history_save", "pitch_shift", "translate", "precheck", "execute")
+
+
+def summarize(results: list) -> dict:
+    stages = {}
+    for result in results:
+        for stage, duration in result["stages"].items():
+            stages.setdefault(stage, []).append(duration)
+    return {
+        "requests": len(results),
+        "total_mean": statistics.mean(r["total"] for r in results) if results else 0.0,
+        "stages": {stage: statistics.mean(values) for stage, values in stages.items()},
+    }
+
+
+def print_report(summary: dict, baseline: dict = None):
+    print()
+    print(f"回放 {summary['requests']} 条输入，平均总耗时 {summary['total_mean']:.3f} 秒")
+    print(f"{'阶段':<20}{'平均(s)':>10}{'基线(s)':>10}{'变化':>10}")
+    for stage, mean in sorted(summary["stages"].items()):
+        marker = "*" if stage in LOCAL_STAGES else " "
+        line = f"{marker}{stage:<19}{mean:>10.4f}"
+        if baseline and stage in baseline["stages"]:
+            base = baseline["stages"][stage]
+            change = (mean - base) / base * 100 if base else 0.0
+            line += f"{base:>10.4f}{change:>+9.1f}%"
+        print(line)
+    print("（* 为本地处理阶段）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线重放录制的对话")
+    parser.add_argument("session", help="录制的会话文件（JSONL）")
+    parser.add_argument("--speed", type=float, default=0.0, help="回放速度倍数，0 表示不等待（默认）")
+    parser.add_argument("--save", help="把汇总结果保存为 JSON")
+    parser.add_argument("--baseline", help="与之前保存的汇总结果对比")
+    args = parser.parse_args()
+
+    session = os.path.abspath(args.session)
+    inputs = load_session_inputs(session)
+    if not inputs:
+        print("会话文件中没有录制到用户输入")
+        return 1
+
+    workdir = prepare_workdir(REPLAY_BASE_URL, {
+        "traffic": {"mode": "replay", "session_file": session, "replay_speed": args.speed},
+    })
+    os.chdir(workdir)
+
+    # 切换工作目录后再导入，历史和缓存都落在临时目录中；翻译由会话之外的服务提供，回放时原文直接送入语音合成
+    import translate
+    translate._translate = lambda text: text
+
+    try:
+        processor = NullProcessor()
+        results = [run_once(user_input, processor) for user_input in inputs]
+        summary = summarize(results)
+        baseline = None
+        if args.baseline:
+            with open(os.path.join(ROOT, args.baseline) if not os.path.isabs(args.baseline) else args.baseline,
+                      "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+        print_report(summary, baseline)
+
+        from metrics import metrics
+        print(f"回放匹配情况: {metrics.snapshot()['collectors'].get('traffic')}")
+        if args.save:
+            with open(os.path.join(ROOT, args.save), "w", encoding="utf-8") as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+路由流程基准测试
+对比 two_stage（判断 + 详情/闲聊两次请求）、combined（合并为一次请求）
+和 speculative（三个请求并行）几种路由模式的延迟、调用次数和 token 用量。
+
+用法（在项目根目录运行）：
+    python benchmarks/routing_benchmark.py
+    python benchmarks/routing_benchmark.py --inputs my_inputs.txt --rounds 3
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from call_ai import get_prompt_token_stats, get_usage_counter, reset_usage_counter  # noqa: E402
+from routing import ROUTING_MODES, get_routing_stats, route_user_input  # noqa: E402
+
+DEFAULT_INPUTS = [
+    "你好呀，今天过得怎么样？",
+    "给我讲个冷笑话吧",
+    "最近有什么好看的动画推荐吗？",
+    "帮我打开记事本",
+    "截一张屏幕截图保存到桌面",
+    "列出 D 盘下所有的 PDF 文件",
+]
+
+
+def load_inputs(path: str = None) -> list:
+    """读取测试输入（每行一条），不传则使用内置样例"""
+    if not path:
+        return list(DEFAULT_INPUTS)
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def run_mode(mode: str, inputs: list, rounds: int) -> dict:
+    """用指定路由模式跑完所有输入，返回汇总结果"""
+    latencies = []
+    calls = []
+    prompt_tokens = []
+    completion_tokens = []
+    verdicts = {}
+
+    for _ in range(rounds):
+        for user_input in inputs:
+            reset_usage_counter()
+            start_time = time.perf_counter()
+            # 关闭流式，以便拿到服务端返回的 token 用量
+            route = route_user_input(user_input, mode=mode, stream=False)
+            latencies.append(time.perf_counter() - start_time)
+
+            usage = get_usage_counter()
+            calls.append(usage["calls"])
+            prompt_tokens.append(usage["prompt_tokens"])
+            completion_tokens.append(usage["completion_tokens"])
+            verdicts[user_input] = route["a"] if route else "error"
+
+    return {
+        "mode": mode,
+        "latencies": latencies,
+        "avg_calls": statistics.mean(calls),
+        "avg_prompt_tokens": statistics.mean(prompt_tokens),
+        "avg_completion_tokens": statistics.mean(completion_tokens),
+        "verdicts": verdicts,
+    }
+
+
+def print_report(results: list):
+    print()
+    print(f"{'模式':<12}{'平均延迟(s)':>12}{'p50(s)':>10}{'最大(s)':>10}"
+          f"{'调用次数':>10}{'输入token':>12}{'输出token':>12}")
+    for result in results:
+        latencies = result["latencies"]
+        print(f"{result['mode']:<12}{statistics.mean(latencies):>12.3f}{statistics.median(latencies):>10.3f}"
+              f"{max(latencies):>10.3f}{result['avg_calls']:>10.2f}"
+              f"{result['avg_prompt_tokens']:>12.1f}{result['avg_completion_tokens']:>12.1f}")
+
+    base = results[0]
+    for other in results[1:]:
+        mismatched = [text for text in base["verdicts"]
+                      if base["verdicts"][text] != other["verdicts"].get(text)]
+        speedup = statistics.mean(base["latencies"]) / max(statistics.mean(other["latencies"]), 1e-9)
+        print()
+        print(f"{other['mode']} 相对 {base['mode']} 的速度: {speedup:.2f}x")
+        print(f"判断结果不一致: {len(mismatched)} / {len(base['verdicts'])}")
+        for text in mismatched:
+            print(f"  - {text}: {base['verdicts'][text]} vs {other['verdicts'].get(text)}")
+
+    routing_stats = get_routing_stats()
+    if routing_stats.get("speculative"):
+        stats = routing_stats["speculative"]
+        print()
+        print("speculative 模式的分支始终以流式发出，流式请求只计调用次数、不计 token；")
+        print(f"被丢弃分支估算浪费 {stats['wasted_tokens']} token，累计节省延迟 {stats['latency_saved']:.3f} 秒")
+
+    prompt_stats = get_prompt_token_stats()
+    if prompt_stats:
+        print()
+        print(f"{'阶段':<10}{'调用次数':>10}{'平均估算输入token':>20}{'前缀缓存命中token':>20}")
+        for stage, stats in sorted(prompt_stats.items()):
+            print(f"{stage:<10}{stats['calls']:>10}{stats['avg_estimated_tokens']:>20.1f}{stats['cached_tokens']:>20}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比不同路由模式的延迟和 token 用量")
+    parser.add_argument("--inputs", help="测试输入文件，每行一条")
+    parser.add_argument("--rounds", type=int, default=1, help="每条输入重复的轮数")
+    parser.add_argument("--modes", nargs="+", default=list(ROUTING_MODES), choices=ROUTING_MODES)
+    args = parser.parse_args()
+
+    inputs = load_inputs(args.inputs)
+    results = [run_mode(mode, inputs, args.rounds) for mode in args.modes]
+    print_report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+端到端首音延迟基准测试
+启动本地替身服务（fake_openai_server.py），用无界面的 NullProcessor 驱动 maid_handle_input 和 speak，
+按场景统计首字时间（time-to-first-text）、首音时间（time-to-first-audio）和总耗时，以及各阶段的平均耗时。
+
+为了不影响正在使用的数据，测试在临时目录中运行：复制一份 maid_settings.json 并把 api_config 指向替身服务，
+聊天历史、音频缓存和响应缓存都写在临时目录里。默认不连接真实的翻译服务（原文直接送入语音合成，
+可用 --translate-latency 模拟翻译耗时），也不实际播放音频（首音时间记在调用播放的时刻）。
+
+用法（在项目根目录运行）：
+    python benchmarks/ttfa_benchmark.py
+    python benchmarks/ttfa_benchmark.py --rounds 5 --scenarios my_scenarios.json
+    python benchmarks/ttfa_benchmark.py --real-translate --play
+
+场景文件是一个 JSON 列表，每个场景可包含：
+    name、inputs（输入列表）、server（替身服务配置，见 fake_openai_server.DEFAULT_SETTINGS）、
+    performance（覆盖 maid_settings.json 中的 performance_settings）
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_openai_server import DEFAULT_SETTINGS, FakeOpenAIServer  # noqa: E402
+from headless import NullProcessor  # noqa: E402
+
+DEFAULT_INPUTS = [
+    "你好呀，今天过得怎么样？",
+    "给我讲个冷笑话吧",
+    "最近有什么好看的动画推荐吗？",
+]
+
+LONG_REPLY = {
+    "reply": "好的主人，女仆这就为您整理今天的安排哟～上午十点有一个线上会议，记得提前准备好资料呢。"
+             "中午请不要忘记按时吃饭，身体最重要了！下午三点快递会送到，女仆会提醒您去取的。"
+             "晚上如果有空的话，一起看看新番吧♡",
+    "tone": "Speak in a cheerful and positive tone.",
+}
+
+DEFAULT_SCENARIOS = [
+    {"name": "stream-fast", "server": {"latency": 0.2, "jitter": 0.05, "tts_latency": 0.3}},
+    {"name": "stream-slow-llm", "server": {"latency": 1.2, "jitter": 0.4, "token_interval": 0.05}},
+    {"name": "stream-slow-tts", "server": {"latency": 0.2, "jitter": 0.05, "tts_latency": 1.5}},
+    # 与上一个场景相同，但语音整段下载、整段变调后才播放（关闭流式语音合成），对比首音时间
+    {"name": "buffered-tts", "server": {"latency": 0.2, "jitter": 0.05, "tts_latency": 1.5},
+     "performance": {"tts_stream": {"enabled": False}}},
+    {"name": "no-stream", "server": {"latency": 0.2, "jitter": 0.05}, "performance": {"stream_responses": False}},
+    # 长回复：按句合成，与原来的整段下载、整段变调后播放对比
+    {"name": "long-reply", "server": {"latency": 0.2, "jitter": 0.05, "stages": {"chat": {"response": LONG_REPLY}}}},
+    {"name": "long-reply-whole", "server": {"latency": 0.2, "jitter": 0.05, "stages": {"chat": {"response": LONG_REPLY}}},
+     "performance": {"tts_pipeline": {"enabled": False}, "tts_stream": {"enabled": False}}},
+]
+
+# 运行时需要复制到临时目录的文件（存在时）
+WORKDIR_FILES = ["maid_settings.json", "intent_seed.json", "intent_model.npz"]
+
+
+def prepare_workdir(base_url: str, performance: dict) -> str:
+    """创建临时工作目录，写入指向替身服务的配置"""
+    workdir = tempfile.mkdtemp(prefix="maid_ttfa_")
+    for name in WORKDIR_FILES:
+        if (ROOT / name).exists():
+            shutil.copy(ROOT / name, workdir)
+    settings_path = os.path.join(workdir, "maid_settings.json")
+    settings = {}
+    if os.path.exists(settings_path):
+        with open(settings_path, "r", encoding="utf-8") as f:
+            settings = json.load(f)
+    settings.setdefault("api_config", {}).update({"base_url": base_url, "api_key": "fake-key", "endpoints": []})
+    settings.setdefault("performance_settings", {}).update(performance)
+    with open(settings_path, "w", encoding="utf-8") as f:
+        json.dump(settings, f, ensure_ascii=False, indent=2)
+    return workdir
+
+
+# 第一次写入前的性能配置，每个场景都在它的基础上覆盖，避免上一个场景的设置残留
+_base_performance = None
+
+
+def write_settings(performance: dict):
+    """在当前工作目录中更新场景的性能配置（配置按修改时间缓存，写入后立即生效）"""
+    global _base_performance
+    with open("maid_settings.json", "r", encoding="utf-8") as f:
+        settings = json.load(f)
+    if _base_performance is None:
+        _base_performance = settings["performance_settings"]
+    settings["performance_settings"] = {**_base_performance, **performance}
+    with open("maid_settings.json", "w", encoding="utf-8") as f:
+        json.dump(settings, f, ensure_ascii=False, indent=2)
+    from config_loader import invalidate_config_cache
+    invalidate_config_cache()
+
+
+def mark_offset(trace, name: str):
+    """trace 中某个瞬时事件距请求开始的时间（秒），没有该事件时返回 None"""
+    for event in trace.to_chrome_trace()["traceEvents"]:
+        if event.get("ph") == "i" and event["name"] == name:
+            return event["ts"] / 1e6
+    return None
+
+
+def run_once(user_input: str, processor, play: bool = False) -> dict:
+    """处理一次输入并合成语音，返回首字 / 首音 / 总耗时和各阶段耗时"""
+    from call_ai import speak
+    from maid_core import maid_handle_input_async
+    from pipeline import stage_runner
+    from tracing import finish_trace, start_trace
+
+    trace = start_trace("request", user_input=user_input)
+    first_text = []
+
+    def on_partial(text):
+        if not first_text:
+            first_text.append(trace.duration)
+
+    async def handle():
+        reply, tone = await maid_handle_input_async(user_input, processor, on_partial, session={})
+        if not first_text:
+            first_text.append(trace.duration)
+        await stage_runner.run_stage("tts", speak, reply, tone=tone, play=play)
+        return reply
+
+    try:
+        reply = stage_runner.run(handle, trace=trace)
+    finally:
+        finish_trace(trace)
+    return {
+        "reply": reply,
+        "first_text": first_text[0] if first_text else None,
+        "first_audio": mark_offset(trace, "first_audio_sample"),
+        "total": trace.duration,
+        "stages": trace.summary(),
+    }
+
+
+def run_scenario(server: FakeOpenAIServer, scenario: dict, inputs: list, rounds: int, play: bool = False) -> dict:
+    from audio_cache import audio_cache, raw_audio_cache
+    from chat_history import chat_history
+
+    # 每个场景都从默认配置开始，避免上一个场景的设置残留
+    server.configure(**{**DEFAULT_SETTINGS, "seed": server.settings.get("seed"), **scenario.get("server", {})})
+    write_settings(scenario.get("performance", {}))
+    processor = NullProcessor()
+    results = []
+    for _ in range(rounds):
+        for user_input in scenario.get("inputs") or inputs:
+            # 每次都清空历史和音频缓存，避免后面的请求因为缓存命中而变快
+            chat_history.clear_history()
+            audio_cache.clear()
+            raw_audio_cache.clear()
+            results.append(run_once(user_input, processor, play))
+    return {"name": scenario["name"], "results": results}
+
+
+def _percentiles(values: list) -> str:
+    values = [value for value in values if value is not None]
+    if not values:
+        return f"{'-':>8}{'-':>8}"
+    values.sort()
+    p95 = values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+    return f"{statistics.median(values):>8.3f}{p95:>8.3f}"
+
+
+def print_report(reports: list):
+    print()
+    print(f"{'场景':<18}{'次数':>6}{'首字p50':>8}{'首字p95':>8}{'首音p50':>8}{'首音p95':>8}{'总计p50':>8}{'总计p95':>8}")
+    for report in reports:
+        results = report["results"]
+        print(f"{report['name']:<18}{len(results):>6}"
+              f"{_percentiles([r['first_text'] for r in results])}"
+              f"{_percentiles([r['first_audio'] for r in results])}"
+              f"{_percentiles([r['total'] for r in results])}")
+
+    print()
+    print("各阶段平均耗时（秒）")
+    for report in reports:
+        totals = {}
+        for result in report["results"]:
+            for stage, duration in result["stages"].items():
+                totals.setdefault(stage, []).append(duration)
+        stages = "  ".join(f"{stage}={statistics.mean(values):.3f}" for stage, values in sorted(totals.items()))
+        print(f"{report['name']:<18}{stages}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端首音延迟基准测试")
+    parser.add_argument("--rounds", type=int, default=3, help="每个场景重复的轮数")
+    parser.add_argument("--inputs", help="测试输入文件（每行一条）")
+    parser.add_argument("--scenarios", help="场景文件（JSON 列表）")
+    parser.add_argument("--seed", type=int, default=0, help="替身服务的随机数种子")
+    parser.add_argument("--real-translate", action="store_true", help="使用真实的翻译服务（需要网络）")
+    parser.add_argument("--translate-latency", type=float, default=0.0, help="不使用真实翻译时模拟的翻译耗时（秒）")
+    parser.add_argument("--play", action="store_true", help="实际播放音频")
+    parser.add_argument("--keep-workdir", action="store_true", help="保留临时工作目录（其中有导出的追踪文件）")
+    args = parser.parse_args()
+
+    inputs = DEFAULT_INPUTS
+    if args.inputs:
+        with open(args.inputs, "r", encoding="utf-8") as f:
+            inputs = [line.strip() for line in f if line.strip()]
+    scenarios = DEFAULT_SCENARIOS
+    if args.scenarios:
+        with open(args.scenarios, "r", encoding="utf-8") as f:
+            scenarios = json.load(f)
+
+    server = FakeOpenAIServer({"seed": args.seed}).start()
+    workdir = prepare_workdir(server.base_url, {"tracing": {"export": args.keep_workdir}})
+    print(f"替身服务: {server.base_url}，工作目录: {workdir}")
+    os.chdir(workdir)
+
+    # 切换工作目录后再导入，聊天历史、缓存等相对路径都落在临时目录中
+    import translate
+    if not args.real_translate:
+        def fake_translate(text):
+            time.sleep(args.translate_latency)
+            return text
+        translate._translate = fake_translate
+
+    try:
+        reports = [run_scenario(server, scenario, inputs, args.rounds, args.play) for scenario in scenarios]
+        print_report(reports)
+        print()
+        print(f"替身服务收到的请求: {server.stats}")
+    finally:
+        server.stop()
+        os.chdir(ROOT)
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,27 @@
-import asyncio
 import base64
 import http.client
 import time
 import prompt as pt
-import librosa
 import sounddevice as sd
-import requests
 import json
-import pyrubberband as pyrb
 import soundfile as sf
-from openai import AsyncOpenAI, OpenAI
-from openai.helpers import LocalAudioPlayer
-from openai._response import AsyncStreamedBinaryAPIResponse, StreamedBinaryAPIResponse
-from openai import _legacy_response
-from typing import Union
+from typing import Callable
+from collections import deque
+import contextvars
+import threading
 import numpy as np
 import io
 import translate
+from json_stream import IncrementalJSONFieldExtractor
+from llm_client import client_manager
+from response_cache import response_cache
+from model_router import model_router
+from endpoint_pool import endpoint_pool
+from rate_limiter import rate_limiter, raise_for_rate_limit
+from pipeline import CancelEvent, current_token
+from tracing import span, mark
+from metrics import metrics
+from token_estimator import estimate_messages_tokens
 
 def load_api_config():
     """加载API配置"""
@@ -72,18 +77,19 @@ def get_trial_ai_response(text: str) -> str:
         # 准备输入数据
         input_data = json.dumps({"prompt": text})
         
-        # 启动试用程序
-        process = subprocess.Popen(
-            [trial_exe_path],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0)
-        )
-        
-        # 发送数据并获取输出
-        stdout, stderr = process.communicate(input=input_data, timeout=60)
+        # 启动试用程序（试用程序访问的也是主端点的上游，与其他请求共用该端点的限流）
+        with rate_limiter.slot(endpoint_pool.primary_name(), "complete"):
+            process = subprocess.Popen(
+                [trial_exe_path],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+            )
+
+            # 发送数据并获取输出
+            stdout, stderr = process.communicate(input=input_data, timeout=60)
         
         # 解析响应
         try:
@@ -177,18 +183,19 @@ def get_trial_speak(text: str, tone: str = "Speak in a cheerful and positive ton
             "save_path": save_path
         })
         
-        # 启动试用程序
-        process = subprocess.Popen(
-            [trial_exe_path],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0)
-        )
-        
-        # 发送数据并获取输出
-        stdout, stderr = process.communicate(input=input_data, timeout=60)
+        # 启动试用程序（试用程序访问的也是主端点的上游，与其他请求共用该端点的限流）
+        with rate_limiter.slot(endpoint_pool.primary_name(), "tts"):
+            process = subprocess.Popen(
+                [trial_exe_path],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+            )
+
+            # 发送数据并获取输出
+            stdout, stderr = process.communicate(input=input_data, timeout=60)
         
         if process.returncode != 0:
             return f"试用程序出错了：{stderr}"
@@ -250,12 +257,10 @@ def get_model_from_config() -> str:
     如果没有配置或配置无效，返回默认值
     """
     try:
-        config_path = 'maid_settings.json'
-        if os.path.exists(config_path):
-            with open(config_path, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-                model = config.get('api_config', {}).get('model', 'Doubao-1.5-pro-32k')
-                return model
+        if os.path.exists('maid_settings.json'):
+            # 配置由 client_manager 按文件修改时间缓存，不会每次读盘
+            _, _, model = client_manager.get_settings()
+            return model
     except Exception as e:
         print(f"⚠️ 读取模型配置失败: {e}")
     
@@ -263,23 +268,16 @@ def get_model_from_config() -> str:
     return ''
 
 
-def simple_ai_response(text: str, include_history: bool = True) -> str:
+def build_messages(text: str, include_history: bool = True, stage: str = None) -> list:
     """
-    简单的AI响应函数，输入文本返回文本
-    支持历史记录功能
+    构建发送给AI的消息列表：系统提示 + 历史记录（可选）+ 当前输入
+    系统提示按 stage 选择（人设背景故事只发给面向用户说话的阶段），历史记录按 stage 对应的 token 预算截断
     """
-    # 动态获取API配置
-    base_url, api_key = load_api_config()
-    
-    # 检查是否使用试用模式
-    if api_key == "AKASAKAMAID" and should_use_trial():
-        return get_trial_ai_response(text)
-    
     # 构建消息列表，包含系统提示
     messages = [
         {
             "role": "system",
-            "content": pt.story
+            "content": pt.get_system_prompt(stage)
         }
     ]
     
@@ -287,8 +285,8 @@ def simple_ai_response(text: str, include_history: bool = True) -> str:
     if include_history:
         try:
             from chat_history import chat_history
-            # 添加历史记录，模仿449-450行的代码
-            history_messages = chat_history.format_history_for_ai(10)
+            # 添加历史记录，按阶段的 token 预算截断
+            history_messages = chat_history.format_history_for_stage(stage, 10)
             messages.extend(history_messages)
         except Exception as e:
             print(f"⚠️ 加载历史记录失败: {e}")
@@ -298,51 +296,285 @@ def simple_ai_response(text: str, include_history: bool = True) -> str:
         "role": "user",
         "content": text
     })
+    return messages
 
-    # 从配置中获取模型名称，如果没有则使用默认值
-    model_name = get_model_from_config()
-    
+
+# 当前上下文的 token 用量累计，用于对比不同流程的开销。
+# 使用 contextvars 而不是线程局部变量，这样通过 copy_context() 派发到线程池的并行请求也会计入同一份统计
+_usage_totals = contextvars.ContextVar("usage_totals", default=None)
+_usage_lock = threading.Lock()
+
+
+def _new_usage_totals() -> dict:
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+
+def _record_usage(usage):
+    """累计一次调用的 token 用量（流式调用没有用量信息时只计次数）"""
+    totals = _usage_totals.get()
+    if totals is None:
+        totals = _new_usage_totals()
+        _usage_totals.set(totals)
+    with _usage_lock:
+        totals["calls"] += 1
+        if usage is not None:
+            totals["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+            totals["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+
+
+# 各阶段的提示词 token 统计：估算值，以及服务端返回的实际输入 token 和前缀缓存命中的 token
+_prompt_token_stats = {}
+_prompt_token_lock = threading.Lock()
+
+
+def _record_prompt_tokens(stage: str, messages: list, usage=None):
+    """记录并打印一次调用的提示词 token 数"""
+    estimated = estimate_messages_tokens(messages)
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0 if usage is not None else 0
+    details = getattr(usage, "prompt_tokens_details", None) if usage is not None else None
+    cached_tokens = getattr(details, "cached_tokens", 0) or 0 if details is not None else 0
+
+    with _prompt_token_lock:
+        stats = _prompt_token_stats.setdefault(stage or "other", {
+            "calls": 0, "estimated_tokens": 0, "prompt_tokens": 0, "cached_tokens": 0
+        })
+        stats["calls"] += 1
+        stats["estimated_tokens"] += estimated
+        stats["prompt_tokens"] += prompt_tokens
+        stats["cached_tokens"] += cached_tokens
+
+    message = f"提示词 token [{stage or 'other'}]: 估算 {estimated}"
+    if prompt_tokens:
+        message += f"，实际 {prompt_tokens}，前缀缓存命中 {cached_tokens}"
+    print(message)
+
+
+def get_prompt_token_stats() -> dict:
+    """获取各阶段的提示词 token 统计（含平均每次调用的估算值）"""
+    with _prompt_token_lock:
+        result = {stage: dict(stats) for stage, stats in _prompt_token_stats.items()}
+    for stats in result.values():
+        stats["avg_estimated_tokens"] = stats["estimated_tokens"] / stats["calls"] if stats["calls"] else 0.0
+    return result
+
+
+def reset_usage_counter():
+    """清零当前上下文的 token 用量累计"""
+    _usage_totals.set(_new_usage_totals())
+
+
+def get_usage_counter() -> dict:
+    """获取当前上下文自上次清零以来的调用次数和 token 用量"""
+    totals = _usage_totals.get() or _new_usage_totals()
+    with _usage_lock:
+        return dict(totals)
+
+
+# 对话请求使用的 temperature（同时作为响应缓存键的一部分）
+CHAT_TEMPERATURE = 0.7
+
+
+def _lookup_response_cache(stage: str, include_history: bool, model_name: str, messages: list):
+    """
+    按阶段的缓存策略查询响应缓存
+
+    Returns:
+        (缓存键, 缓存策略, 命中的响应)；该阶段不走缓存时缓存键为 None
+    """
     try:
-        # 使用OpenAI库而不是requests
-        client = OpenAI(
-            api_key=api_key,
-            base_url=base_url
-        )
-        
-        # 调用OpenAI API
+        policy = response_cache.get_policy(stage, include_history)
+        if policy is None:
+            response_cache.record_bypass()
+            return None, None, None
+        cache_key = response_cache.make_key(model_name, CHAT_TEMPERATURE, messages)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            print(f"命中响应缓存: {stage}")
+        return cache_key, policy, cached
+    except Exception as e:
+        print(f"⚠️ 查询响应缓存失败: {e}")
+        return None, None, None
+
+
+def _store_response_cache(cache_key: str, policy: dict, content: str, stage: str, model_name: str):
+    if not cache_key or not content:
+        return
+    if policy.get("json"):
+        # 与 _finish_ai_response 一样去掉代码块标记后再检查，调用方解析不了的结果不缓存
+        try:
+            json.loads(content.replace("```json", "").replace("```", "").strip())
+        except ValueError:
+            print(f"⚠️ {stage} 阶段的响应不是有效的 JSON，不写入响应缓存")
+            response_cache.record_rejected()
+            return
+    try:
+        response_cache.put(cache_key, content, stage, model_name, ttl=policy.get("ttl"))
+    except Exception as e:
+        print(f"⚠️ 写入响应缓存失败: {e}")
+
+
+def simple_ai_response(text: str, include_history: bool = True, stage: str = None) -> str:
+    """
+    简单的AI响应函数，输入文本返回文本
+    支持历史记录功能
+
+    stage 为调用所属的流程阶段（judge / chat / detail / match / generate / analyze / final 等），
+    用于选择模型、max_tokens 和响应缓存策略
+    """
+    # 动态获取API配置
+    base_url, api_key = load_api_config()
+    
+    # 检查是否使用试用模式
+    if api_key == "AKASAKAMAID" and should_use_trial():
+        return get_trial_ai_response(text)
+    
+    messages = build_messages(text, include_history, stage)
+
+    # 按阶段选择模型和 max_tokens，未配置时使用 api_config 中的模型
+    model_name, max_tokens = model_router.select(stage, get_model_from_config())
+
+    cache_key, cache_policy, cached = _lookup_response_cache(stage, include_history, model_name, messages)
+    if cached is not None:
+        return cached
+    
+    def attempt(endpoint, claim):
+        # 复用进程级的客户端和连接池，避免每次调用都重新握手
+        client = client_manager.get_client(endpoint.base_url, endpoint.api_key)
         response = client.chat.completions.create(
             model=model_name,
             messages=messages,
-            temperature=0.7,
-            max_tokens=2000
+            temperature=CHAT_TEMPERATURE,
+            max_tokens=max_tokens
         )
+        claim()
+        return response
+
+    request_start = time.perf_counter()
+    try:
+        # 调用OpenAI API（多端点时带对冲和故障转移）
+        with span(f"llm.{stage or 'other'}", model=model_name):
+            response = endpoint_pool.run(attempt, kind="complete")
+        model_router.record_latency(stage, model_name, time.perf_counter() - request_start)
+        metrics.inc("llm_calls_total", stage=stage or "other", model=model_name)
+        _record_usage(getattr(response, "usage", None))
+        _record_prompt_tokens(stage, messages, getattr(response, "usage", None))
         
-        return response.choices[0].message.content.strip()
+        content = response.choices[0].message.content.strip()
+        _store_response_cache(cache_key, cache_policy, content, stage, model_name)
+        return content
         
     except Exception as e:
+        # 超时和出错也计入延迟样本，主模型持续失败时切换到备用模型
+        model_router.record_failure(stage, model_name, time.perf_counter() - request_start)
+        metrics.inc("llm_errors_total", stage=stage or "other", model=model_name)
         return f"出错了：{str(e)}"
 
 
-def get_ai_response(prompt: str, conversation_type: str = "chat",
-                    include_history: bool = True, save_to_history: bool = True,
-                    current_prompt_template: str = None) -> str:
+def simple_ai_response_stream(text: str, include_history: bool = True,
+                              on_delta: Callable[[str], None] = None,
+                              cancel_event: threading.Event = None, stage: str = None) -> str:
     """
-    带历史记录的AI响应函数
+    流式AI响应函数，每收到一段增量文本就回调 on_delta，最终返回完整文本
 
-    Args:
-        prompt: 用户输入或完整的prompt
-        conversation_type: 对话类型 ("chat", "code_execution", "image_analysis")
-        include_history: 是否包含历史记录
-        save_to_history: 是否保存到历史记录
-        current_prompt_template: 当前使用的prompt模板（用于格式化最新一条历史记录）
-
-    Returns:
-        AI响应内容
+    当前请求被取消，或 cancel_event 为 CancelEvent 且被设置时，立即关闭HTTP流并返回已收到的部分文本；
+    普通的 threading.Event 只在收到下一段数据时检查
     """
-    from chat_history import chat_history
+    # 动态获取API配置
+    base_url, api_key = load_api_config()
 
-    # 调用底层函数获取AI响应，传递历史记录参数
-    assistant_response = simple_ai_response(prompt, include_history=include_history)
+    # 试用程序不支持流式输出，一次性回调全部内容
+    if api_key == "AKASAKAMAID" and should_use_trial():
+        content = get_trial_ai_response(text)
+        if on_delta:
+            on_delta(content)
+        return content
+
+    messages = build_messages(text, include_history, stage)
+    model_name, max_tokens = model_router.select(stage, get_model_from_config())
+
+    cache_key, cache_policy, cached = _lookup_response_cache(stage, include_history, model_name, messages)
+    if cached is not None:
+        if on_delta:
+            on_delta(cached)
+        return cached
+
+    token = current_token()
+    request_start = time.perf_counter()
+    # 首字到达的时刻：流式调用的延迟样本记首字延迟，不受回复长度影响
+    first_delta = {"at": None}
+
+    def is_cancelled() -> bool:
+        return ((cancel_event is not None and cancel_event.is_set()) or
+                (token is not None and token.is_cancelled))
+
+    def attempt(endpoint, claim):
+        client = client_manager.get_client(endpoint.base_url, endpoint.api_key)
+        stream = client.chat.completions.create(
+            model=model_name,
+            messages=messages,
+            temperature=CHAT_TEMPERATURE,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        # 请求被取消时立即关闭连接，不再等待下一段数据
+        unregister = token.register(stream.close) if token is not None else None
+        unregister_event = cancel_event.register(stream.close) if isinstance(cancel_event, CancelEvent) else None
+
+        parts = []
+        try:
+            for chunk in stream:
+                if is_cancelled():
+                    break
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    # 对冲时先出字的端点胜出，落后的一方立即关闭连接
+                    if not claim():
+                        return None
+                    if first_delta["at"] is None:
+                        first_delta["at"] = time.perf_counter()
+                    parts.append(delta)
+                    if on_delta:
+                        on_delta(delta)
+        except Exception:
+            # 取消时连接被主动关闭，读取报错属于正常情况，不算端点故障
+            if not is_cancelled():
+                raise
+        finally:
+            if unregister is not None:
+                unregister()
+            if unregister_event is not None:
+                unregister_event()
+            stream.close()
+        claim()
+        return parts
+
+    try:
+        with span(f"llm.{stage or 'other'}", model=model_name, stream=True):
+            parts = endpoint_pool.run(attempt, kind="stream")
+        metrics.inc("llm_calls_total", stage=stage or "other", model=model_name)
+        _record_usage(None)
+        _record_prompt_tokens(stage, messages)
+
+        content = "".join(parts).strip()
+        if not is_cancelled():
+            # 被取消的请求不计入延迟样本
+            model_router.record_latency(stage, model_name, (first_delta["at"] or time.perf_counter()) - request_start)
+            _store_response_cache(cache_key, cache_policy, content, stage, model_name)
+        return content
+
+    except Exception as e:
+        if not is_cancelled():
+            model_router.record_failure(stage, model_name, time.perf_counter() - request_start)
+            metrics.inc("llm_errors_total", stage=stage or "other", model=model_name)
+        return f"出错了：{str(e)}"
+
+
+def _finish_ai_response(prompt: str, assistant_response: str, conversation_type: str,
+                        save_to_history: bool, current_prompt_template: str = None) -> str:
+    """清理AI响应中的代码块标记，并按需保存到历史记录"""
+    from chat_history import chat_history
 
     # 移除所有的"```json"和"```"标记
     assistant_response = assistant_response.replace("```json", "").replace("```", "").strip()
@@ -363,67 +595,145 @@ def get_ai_response(prompt: str, conversation_type: str = "chat",
     return assistant_response
 
 
-class PitchShiftedLocalAudioPlayer(LocalAudioPlayer):
-    async def _tts_response_to_buffer(
-            self,
-            response: Union[
-                _legacy_response.HttpxBinaryResponseContent,
-                AsyncStreamedBinaryAPIResponse,
-                StreamedBinaryAPIResponse,
-            ],
-    ) -> np.ndarray:
-        chunks: list[bytes] = []
-        if isinstance(response, _legacy_response.HttpxBinaryResponseContent) or isinstance(
-                response, StreamedBinaryAPIResponse
-        ):
-            for chunk in response.iter_bytes(chunk_size=1024):
-                if chunk:
-                    chunks.append(chunk)
-        else:
-            async for chunk in response.iter_bytes(chunk_size=1024):
-                if chunk:
-                    chunks.append(chunk)
+def get_ai_response(prompt: str, conversation_type: str = "chat",
+                    include_history: bool = True, save_to_history: bool = True,
+                    current_prompt_template: str = None, stage: str = None) -> str:
+    """
+    带历史记录的AI响应函数
+
+    Args:
+        prompt: 用户输入或完整的prompt
+        conversation_type: 对话类型 ("chat", "code_execution", "image_analysis")
+        include_history: 是否包含历史记录
+        save_to_history: 是否保存到历史记录
+        current_prompt_template: 当前使用的prompt模板（用于格式化最新一条历史记录）
+        stage: 调用所属的流程阶段，用于选择响应缓存策略
+
+    Returns:
+        AI响应内容
+    """
+    # 调用底层函数获取AI响应，传递历史记录参数
+    assistant_response = simple_ai_response(prompt, include_history=include_history, stage=stage)
 
-        audio_bytes = b"".join(chunks)
-        audio_np = np.frombuffer(audio_bytes, dtype=np.int16).astype(np.float32) / 32767.0
-        audio_np = audio_np.flatten()  # flatten to 1D mono
+    return _finish_ai_response(prompt, assistant_response, conversation_type,
+                               save_to_history, current_prompt_template)
 
-        # Apply pitch shift (+4.1 semitones)
-        audio_shifted = librosa.effects.pitch_shift(audio_np, sr=SAMPLE_RATE, n_steps=4.1)
-        audio_shifted = audio_shifted.reshape(-1, 1)  # reshape for playback
-        return audio_shifted.astype(np.float32)
 
+# 流式响应的耗时统计（最近若干次），首字耗时是主要优化指标
+_stream_timings = deque(maxlen=100)
+_stream_timings_lock = threading.Lock()
 
-async def _speak_async(text: str,tone="Speak in a cheerful and positive tone."):
+
+def get_ai_response_stream(prompt: str, fields: tuple = ("reply",),
+                           on_partial: Callable[[str, str], None] = None,
+                           on_field_complete: Callable[[str, str], None] = None,
+                           conversation_type: str = "chat",
+                           include_history: bool = True, save_to_history: bool = True,
+                           current_prompt_template: str = None,
+                           cancel_event: threading.Event = None, stage: str = None) -> str:
     """
-    异步语音合成函数，使用音调偏移
+    流式版本的 get_ai_response，边接收边增量解析 JSON 字段
 
     Args:
-        text (str): 要转换为语音的文本
-        tone: 语气
-    """
-    # 动态获取API配置
-    base_url, api_key = load_api_config()
-    client = AsyncOpenAI(api_key=api_key, base_url=base_url)
+        prompt: 用户输入或完整的prompt
+        fields: 需要增量提取的顶层字符串字段
+        on_partial: 字段内容增长时的回调 (字段名, 当前文本)
+        on_field_complete: 字段解析完成时的回调 (字段名, 完整文本)
+        cancel_event: 设置后中止接收，返回已收到的部分内容
+        stage: 调用所属的流程阶段，用于选择响应缓存策略
+        其余参数同 get_ai_response
 
+    Returns:
+        完整的AI响应内容（与 get_ai_response 的返回格式一致）
+    """
     start_time = time.time()
-    async with client.audio.speech.with_streaming_response.create(
-            model="gpt-4o-mini-tts",
-            voice="sage",
-            input=text,
-            instructions=tone,
-            response_format="pcm",
-    ) as response:
-        mid_time = time.time()
-        await PitchShiftedLocalAudioPlayer().play(response)
-        end_time = time.time()
-
-    print(f"[Async] 请求耗时: {mid_time - start_time:.4f} 秒")
-    print(f"[Async] 播放耗时: {end_time - mid_time:.4f} 秒")
-    print(f"[Async] 总耗时: {end_time - start_time:.4f} 秒")
-
-def speak_async(text):
-    asyncio.get_event_loop().run_until_complete(_speak_async(text))
+    timing = {"first_token": None, "first_word": None}
+
+    def handle_partial(field, text):
+        if timing["first_word"] is None and text:
+            timing["first_word"] = time.time() - start_time
+        if on_partial:
+            on_partial(field, text)
+
+    extractor = IncrementalJSONFieldExtractor(fields, on_partial=handle_partial,
+                                              on_complete=on_field_complete)
+
+    def handle_delta(delta):
+        if timing["first_token"] is None:
+            timing["first_token"] = time.time() - start_time
+        extractor.feed(delta)
+
+    assistant_response = simple_ai_response_stream(prompt, include_history=include_history,
+                                                   on_delta=handle_delta, cancel_event=cancel_event,
+                                                   stage=stage)
+    total_time = time.time() - start_time
+
+    # 被取消（停止按钮或新输入抢占）的流没有跑完，不计入首字、总耗时统计
+    token = current_token()
+    cancelled = ((cancel_event is not None and cancel_event.is_set()) or
+                 (token is not None and token.is_cancelled))
+    if not cancelled:
+        with _stream_timings_lock:
+            _stream_timings.append((timing["first_token"], timing["first_word"], total_time))
+    if timing["first_word"] is not None and not cancelled:
+        print(f"首字耗时: {timing['first_word']:.4f} 秒，总耗时: {total_time:.4f} 秒")
+
+    return _finish_ai_response(prompt, assistant_response, conversation_type,
+                               save_to_history, current_prompt_template)
+
+
+def get_ai_reply(prompt_text: str, reply_field: str, on_partial: Callable[[str], None] = None,
+                 fields: tuple = (), stream: bool = None, **kwargs) -> str:
+    """
+    获取AI回复：开启流式模式时边生成边把 reply_field 的内容交给 on_partial 显示，
+    字段一完成就提前启动语音阶段的准备工作
+
+    Args:
+        prompt_text: 完整的prompt
+        reply_field: 要实时显示并提前送去语音合成的字段
+        on_partial: 收到部分回复文本时的回调
+        fields: 额外需要增量提取的字段（不显示）
+        stream: 是否使用流式模式，不传则读取配置
+        其余参数同 get_ai_response
+    """
+    if stream is None:
+        from config_loader import get_performance_config
+        stream = get_performance_config().get("stream_responses", True)
+    if not stream:
+        return get_ai_response(prompt_text, **kwargs)
+
+    def handle_partial(field, text):
+        if field == reply_field and on_partial and text:
+            on_partial(text)
+
+    def handle_complete(field, text):
+        if field == reply_field:
+            prefetch_speech(text)
+
+    return get_ai_response_stream(prompt_text, fields=(reply_field,) + tuple(fields),
+                                  on_partial=handle_partial, on_field_complete=handle_complete, **kwargs)
+
+
+def get_stream_stats() -> dict:
+    """获取流式响应的平均首token / 首字 / 总耗时（秒）"""
+    with _stream_timings_lock:
+        timings = list(_stream_timings)
+
+    def average(values):
+        values = [v for v in values if v is not None]
+        return sum(values) / len(values) if values else None
+
+    return {
+        "requests": len(timings),
+        "avg_time_to_first_token": average(t[0] for t in timings),
+        "avg_time_to_first_word": average(t[1] for t in timings),
+        "avg_total_time": average(t[2] for t in timings),
+    }
+
+
+metrics.register_collector("prompt_tokens", get_prompt_token_stats)
+metrics.register_collector("stream", get_stream_stats)
+
 
 def describe_image(image_path, api_key=None):
     """
@@ -443,9 +753,7 @@ def describe_image(image_path, api_key=None):
         with open(path, "rb") as f:
             return base64.b64encode(f.read()).decode("utf-8")
 
-    # 动态获取API配置
-    base_url, api_key = load_api_config()
-    api_url = f"{base_url}/chat/completions"
+    # API端点由 endpoint_pool 按配置选择
     base64_image = encode_image(image_path)
 
     # 构建消息列表，包含历史记录
@@ -456,8 +764,8 @@ def describe_image(image_path, api_key=None):
         }
     ]
 
-    # 添加历史记录
-    history_messages = chat_history.format_history_for_ai(10)
+    # 添加历史记录（按 image 阶段的 token 预算截断）
+    history_messages = chat_history.format_history_for_stage("image", 10)
     messages.extend(history_messages)
 
     # 添加当前图片分析请求
@@ -482,15 +790,25 @@ def describe_image(image_path, api_key=None):
         "user": "miao"
     }
 
-    # 请求头
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}",
-        "User-Agent": "VirtualMaid/1.0.0",
-    }
+    def attempt(endpoint, claim):
+        # 请求头
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {endpoint.api_key}",
+            "User-Agent": "VirtualMaid/1.0.0",
+        }
+        # 发送请求（复用共享连接池），服务端错误交给端点池换端点重试
+        response = client_manager.http_client.post(f"{endpoint.base_url}/chat/completions",
+                                                   headers=headers, json=payload)
+        # 429 交给限流器按 Retry-After 退避后重试
+        raise_for_rate_limit(response)
+        if response.status_code >= 500:
+            raise Exception(f"图片识别请求失败: {response.status_code}")
+        claim()
+        return response
 
-    # 发送请求
-    response = requests.post(api_url, headers=headers, json=payload)
+    response = endpoint_pool.run(attempt, kind="image")
+    _record_prompt_tokens("image", messages)
 
     # 处理返回结果
     if response.status_code == 200:
@@ -528,29 +846,317 @@ import json
 import time
 import io
 import soundfile as sf
-import pyrubberband as pyrb
 import sounddevice as sd
 
 import json
 import time
 import io
 import os
-import hashlib
 import soundfile as sf
 import sounddevice as sd
 from urllib.parse import quote
+from audio_stream import AudioStreamPlayer, StreamingPitchShifter, get_settings as get_tts_stream_settings
+from speech_pipeline import run_pipeline, split_sentences, get_settings as get_tts_pipeline_settings
+from pitch_engine import choose_engine, pitch_shift
+import audio_variants
 
-# 缓存目录
-CACHE_DIR = "audio_cache"
+# 语音合成的模型和音色
+TTS_MODEL = "gpt-4o-mini-tts"
+TTS_VOICE = "sage"
 
-def speak(text, tone, dialog_shower=None, do_translate=True, save_path=None):
+def prefetch_speech(text, do_translate=True):
+    """
+    在回复文本刚生成完时提前启动语音阶段的准备工作（目前是预翻译），
+    让随后的 speak 调用少等一次网络往返
+    """
     if do_translate:
-            text = translate.connect(text)
+        # 按句合成时每句单独翻译，逐句预翻译
+        for sentence in _split_for_pipeline(text):
+            translate.prefetch(sentence)
+
+def _play_audio(y, sr, play=True, audio_sink=None):
+    """
+    播放音频并等待结束；当前请求被取消时立即停止播放。play 为 False 时只记录音频就绪的时刻，
+    传入 audio_sink(y, sr) 时把音频交给它（例如服务模式下推送给客户端）而不在本机播放
+    """
+    token = current_token()
+    if token is not None and token.is_cancelled:
+        return
+    if audio_sink is not None:
+        mark("first_audio_sample", played=False)
+        audio_sink(y, sr)
+        return
+    if not play:
+        mark("first_audio_sample", played=False)
+        return
+    sd.play(y, sr)
+    mark("first_audio_sample")
+    unregister = token.register(sd.stop) if token is not None else None
+    try:
+        sd.wait()  # 等待播放完成
+    finally:
+        if unregister is not None:
+            unregister()
+
+
+def _raw_speech_params(text, tone):
+    """决定接口返回的原始语音的全部参数（文本、语气、模型、音色），变调参数见 audio_variants"""
+    return {
+        "text": text,
+        "tone": tone,
+        "model": TTS_MODEL,
+        "voice": TTS_VOICE,
+    }
+
+
+def _download_speech(text, tone):
+    """整段合成语音，返回 WAV 数据"""
+    payload = {
+        "model": TTS_MODEL,
+        "input": text,
+        "voice": TTS_VOICE,
+        "response_format": "wav",
+        "instructions": tone
+    }
+
+    def attempt(endpoint, claim):
+        # 复用共享连接池发送请求，避免每次重新握手；失败时由端点池换端点重试
+        response = client_manager.http_client.post(
+            f"{endpoint.base_url}/audio/speech",
+            headers={'Authorization': f'Bearer {endpoint.api_key}', 'Content-Type': 'application/json'},
+            json=payload
+        )
+        raise_for_rate_limit(response)
+        if response.status_code != 200:
+            raise Exception(f"TTS请求失败: {response.status_code}")
+        claim()
+        return response.content
+
+    with span("tts_download"):
+        return endpoint_pool.run(attempt, kind="tts")
+
+
+def _pitch_shift_and_cache(audio_data, raw_params):
+    """解码 WAV 数据并变调，原始语音和变调结果分别写入缓存，返回 (变调后的音频, 采样率)"""
+    y, sr = sf.read(io.BytesIO(audio_data))
+    # 升调（默认4.1半音，引擎见 pitch_engine）
+    return audio_variants.store(raw_params, y, sr), sr
+
+
+def _split_for_pipeline(text):
+    """按配置把文本切成句子；不启用按句合成或文本较短时返回 [text]"""
+    settings = get_tts_pipeline_settings()
+    if not settings.get("enabled", True) or len(text) < settings.get("min_text_chars", 40):
+        return [text]
+    return split_sentences(text, settings.get("min_sentence_chars", 8)) or [text]
+
+
+def _speak_sentences(sentences, tone, dialog_shower=None, do_translate=True, save_path=None, play=True,
+                     audio_sink=None):
+    """
+    按句流水线合成并播放（见 speech_pipeline）：翻译、下载、变调各占一个线程，播放第 N 句时准备后面的句子；
+    第一句可以播放时显示对话。每句单独读写音频缓存
+    """
+    settings = get_tts_pipeline_settings()
+    token = current_token()
+
+    def is_cancelled() -> bool:
+        return token is not None and token.is_cancelled
+
+    def translate_stage(sentence):
+        return translate.connect(sentence) if do_translate else sentence
+
+    def download_stage(sentence):
+        raw_params = _raw_speech_params(sentence, tone)
+        cached = audio_variants.load(raw_params)
+        if cached is not None:
+            return raw_params, None, cached
+        audio_data = _download_speech(sentence, tone)
+        print("正在处理语音：" + sentence)
+        return raw_params, audio_data, None
+
+    def pitch_shift_stage(item):
+        raw_params, audio_data, audio = item
+        return audio if audio is not None else _pitch_shift_and_cache(audio_data, raw_params)
+
+    player = None
+    unregister = None
+    previous = None
+    parts = []
+    try:
+        for y, sr in run_pipeline(sentences, [translate_stage, download_stage, pitch_shift_stage],
+                                  settings.get("lookahead", 1), is_cancelled):
+            if is_cancelled():
+                return
+            if not parts:
+                # 第一句就绪：显示对话
+                if dialog_shower:
+                    dialog_shower()
+                if play and audio_sink is None:
+                    mark("first_audio_sample")
+                else:
+                    mark("first_audio_sample", played=False)
+            parts.append((y, sr))
+
+            if audio_sink is not None:
+                audio_sink(y, sr)
+            elif play:
+                if player is not None and player.sample_rate != sr:
+                    player.finish()
+                    player.wait()
+                    player = None
+                if player is None:
+                    player = AudioStreamPlayer(sr)
+                    if unregister is not None:
+                        unregister()
+                    unregister = token.register(player.stop) if token is not None else None
+                # 同一个输出流连续播放，句子之间没有停顿；最多提前写入一句，取消时少合成
+                written = player.write(y)
+                if previous is not None:
+                    previous.wait()
+                previous = written
+    finally:
+        if player is not None:
+            player.finish()
+            player.wait()
+        if unregister is not None:
+            unregister()
+
+    if save_path and parts and not is_cancelled():
+        _save_audio(save_path, np.concatenate([y for y, _ in parts]), parts[0][1])
+
+
+def _speak_streaming(text, tone, raw_params, dialog_shower=None, play=True):
+    """
+    流式语音合成：以 PCM 格式边下载边分块变调，每块处理完立即播放（见 audio_stream），
+    完整播放（或合成）结束后把原始语音和变调后的整段音频写入缓存
+
+    Returns:
+        (变调后的完整音频, 采样率)；请求被取消时返回 (None, 采样率)
+    """
+    settings = get_tts_stream_settings()
+    sample_rate = int(settings.get("sample_rate", SAMPLE_RATE))
+    token = current_token()
+    player = AudioStreamPlayer(sample_rate) if play else None
+    params = audio_variants.derive_params()
+    blocks = []
+    raw_chunks = []
+    state = {"truncated": False}
+
+    def is_cancelled() -> bool:
+        return token is not None and token.is_cancelled
+
+    def emit(block):
+        if not blocks:
+            # 第一块就绪：显示对话并开始播放
+            if dialog_shower:
+                dialog_shower()
+            if play:
+                mark("first_audio_sample")
+            else:
+                mark("first_audio_sample", played=False)
+        blocks.append(block)
+        if player is not None:
+            player.write(block)
+
+    # 每块都用同一个引擎（按带上下文的块长选择），写缓存时据此判断能否直接存为整段的派生版本
+    block_engine = choose_engine(settings.get("block", 1.0) + 2 * settings.get("overlap", 0.1))
+
+    def attempt(endpoint, claim):
+        # 换端点重试时从头接收（只有还没开始播放时才会重试）
+        raw_chunks.clear()
+        n_steps = params["n_steps"]
+        shifter = StreamingPitchShifter(lambda y, sr: pitch_shift(y, sr, n_steps, engine=block_engine), sample_rate,
+                                        first_block=settings.get("first_block", 0.3),
+                                        block=settings.get("block", 1.0),
+                                        overlap=settings.get("overlap", 0.1))
+        with client_manager.http_client.stream(
+                "POST", f"{endpoint.base_url}/audio/speech",
+                headers={'Authorization': f'Bearer {endpoint.api_key}', 'Content-Type': 'application/json'},
+                json={
+                    "model": TTS_MODEL,
+                    "input": text,
+                    "voice": TTS_VOICE,
+                    "response_format": "pcm",
+                    "instructions": tone
+                }) as response:
+            raise_for_rate_limit(response)
+            if response.status_code != 200:
+                raise Exception(f"TTS请求失败: {response.status_code}")
+            if not claim():
+                return
+            # 请求被取消时立即关闭连接
+            unregister = token.register(response.close) if token is not None else None
+            remainder = b""
+            try:
+                for chunk in response.iter_bytes():
+                    if is_cancelled():
+                        return
+                    data = remainder + chunk
+                    usable = len(data) - len(data) % 2
+                    remainder = data[usable:]
+                    samples = np.frombuffer(data[:usable], dtype="<i2").astype(np.float32) / 32768.0
+                    raw_chunks.append(samples)
+                    with span("pitch_shift"):
+                        ready = shifter.feed(samples)
+                    for block in ready:
+                        emit(block)
+                with span("pitch_shift"):
+                    ready = shifter.flush()
+                for block in ready:
+                    emit(block)
+            except Exception as e:
+                if is_cancelled():
+                    return
+                if not blocks:
+                    raise
+                # 已经开始播放，不再换端点从头重试，播完已收到的部分
+                state["truncated"] = True
+                print(f"语音流中断: {e}")
+            finally:
+                if unregister is not None:
+                    unregister()
+
+    try:
+        with span("tts_download", stream=True):
+            endpoint_pool.run(attempt, kind="tts")
+    finally:
+        if player is not None:
+            player.finish()
+    print("正在处理语音：" + text)
+
+    if player is not None:
+        unregister = token.register(player.stop) if token is not None else None
+        try:
+            player.wait()
+        finally:
+            if unregister is not None:
+                unregister()
+
+    if is_cancelled() or not blocks:
+        return None, sample_rate
+    y = np.concatenate(blocks)
+    if not state["truncated"]:
+        audio_variants.store(raw_params, np.concatenate(raw_chunks), sample_rate, params, y, engine=block_engine)
+    return y, sample_rate
+
+
+def speak(text, tone, dialog_shower=None, do_translate=True, save_path=None, play=True, audio_sink=None):
     # 动态获取API配置
     base_url, api_key = load_api_config()
+    use_trial = api_key == "AKASAKAMAID" and should_use_trial()
+
+    # 较长的回复按句流水线合成（试用程序只能整段合成）
+    sentences = _split_for_pipeline(text)
+    if len(sentences) > 1 and not use_trial:
+        _speak_sentences(sentences, tone, dialog_shower, do_translate, save_path, play, audio_sink)
+        return
+
+    if do_translate:
+            text = translate.connect(text)
     
     # 检查是否使用试用模式
-    if api_key == "AKASAKAMAID" and should_use_trial():
+    if use_trial:
         # 使用试用版本的语音合成，不占用试用次数
         trial_file_path = get_trial_speak(text, tone, save_path)
         print(f"试用版本语音合成文件路径: {trial_file_path}")
@@ -563,7 +1169,8 @@ def speak(text, tone, dialog_shower=None, do_translate=True, save_path=None):
                 print(f"成功加载试用版本音频: {trial_file_path}")
                 
                 # 变调处理
-                y_shifted = pyrb.pitch_shift(y, sr, n_steps=4.1)  # 升调4.1半音
+                with span("pitch_shift"):
+                    y_shifted = pitch_shift(y, sr)  # 升调（默认4.1半音）
                 print("试用版本音频变调处理完成")
                 
                 # 显示对话（如果有）
@@ -571,8 +1178,7 @@ def speak(text, tone, dialog_shower=None, do_translate=True, save_path=None):
                     dialog_shower()
                 
                 # 播放音频
-                sd.play(y_shifted, sr)
-                sd.wait()  # 等待播放完成
+                _play_audio(y_shifted, sr, play, audio_sink)
                 print("试用版本音频播放完成")
                 
                 return
@@ -583,84 +1189,48 @@ def speak(text, tone, dialog_shower=None, do_translate=True, save_path=None):
         else:
             print("试用版本未生成有效音频文件，回退到正常模式...")
     
-    # 正常模式：确保缓存目录存在
-    if not os.path.exists(CACHE_DIR):
-        os.makedirs(CACHE_DIR)
-    
-    # 计算文本的MD5值作为缓存文件名
-    text_hash = hashlib.md5(text.encode('utf-8')).hexdigest()
-    cache_file = os.path.join(CACHE_DIR, f"{text_hash}.wav")
+    # 正常模式：查询音频缓存（只有原始语音时在本地重新变调，不请求接口）
+    raw_params = _raw_speech_params(text, tone)
+    cached = audio_variants.load(raw_params)
     
-    # 检查缓存文件是否存在
-    if os.path.exists(cache_file):
-        print(f"使用缓存音频: {cache_file}")
-        # 加载缓存的音频
-        y, sr = sf.read(cache_file)
+    if cached is not None:
+        y, sr = cached
+    elif audio_sink is None and get_tts_stream_settings().get("enabled", True):
+        # 流式合成：下载、变调、播放同时进行，播放已在其中完成
+        y, sr = _speak_streaming(text, tone, raw_params, dialog_shower, play)
+        if y is not None and save_path:
+            _save_audio(save_path, y, sr)
+        return
     else:
-        # 构建请求 payload（注意：实际使用需替换为有效的API端点和参数）
-        payload = json.dumps({
-            "model": "gpt-4o-mini-tts",
-            "input": text,
-            "voice": "sage",
-            "response_format": "wav",
-            "instructions": tone
-        })
-        
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json'
-        }
-
-        # 使用requests发送请求，避免硬编码的conn
-        url = f"{base_url}/audio/speech"
-        response = requests.post(url, headers=headers, json=json.loads(payload))
-        
-        if response.status_code != 200:
-            raise Exception(f"TTS请求失败: {response.status_code}")
-        
-        audio_data = response.content
-
-        # 音频数据已通过requests获取
-        receive_start = time.time()
-        receive_end = time.time()
+        audio_data = _download_speech(text, tone)
         print("正在处理语音：" + text)
-
-        # 加载音频数据
-        y, sr = sf.read(io.BytesIO(audio_data))
-
-        # 变调处理计时
-        pitch_start = time.time()
-        y_shifted = pyrb.pitch_shift(y, sr, n_steps=4.1)  # 升调4.1半音
-        pitch_end = time.time()
-
-        # 打印耗时信息
-        print(f"接收部分耗时: {receive_end - receive_start:.4f} 秒")
-        print(f"变调部分耗时: {pitch_end - pitch_start:.4f} 秒")
-        y = y_shifted
-        # 保存到缓存
-        try:
-            sf.write(cache_file, y_shifted, sr)
-            print(f"已缓存音频至: {cache_file}")
-        except Exception as e:
-            print(f"缓存音频失败: {str(e)}")
+        y, sr = _pitch_shift_and_cache(audio_data, raw_params)
     
+    # 请求已被取消（新的输入到来）时不再显示和播放
+    token = current_token()
+    if token is not None and token.is_cancelled:
+        return
+
     # 显示对话（如果有）
     if dialog_shower:
         dialog_shower()
 
     
-    # 播放音频
-    sd.play(y, sr)
-    sd.wait()  # 等待播放完成
+    # 播放音频（无界面批处理等场景 play 为 False，只合成不播放）
+    _play_audio(y, sr, play, audio_sink)
 
         # 保存音频（如果指定了保存路径）
     if save_path:
-        try:
-            # 使用soundfile保存WAV文件（默认格式为WAV）
-            sf.write(save_path, y, sr)
-            print(f"音频已保存至：{save_path}")
-        except Exception as e:
-            print(f"保存音频失败：{str(e)}")
+        _save_audio(save_path, y, sr)
+
+
+def _save_audio(save_path, y, sr):
+    try:
+        # 使用soundfile保存WAV文件（默认格式为WAV）
+        sf.write(save_path, y, sr)
+        print(f"音频已保存至：{save_path}")
+    except Exception as e:
+        print(f"保存音频失败：{str(e)}")
 
 # 使用示例：
 # speak("测试语音", "友好", save_path="output.wav")
@@ -1,8 +1,37 @@
 import json
 import os
+import threading
 from datetime import datetime
 from typing import List, Dict, Optional
 
+from token_estimator import estimate_tokens, MESSAGE_OVERHEAD_TOKENS
+from tracing import span
+
+
+def _elide_text(text: str, max_tokens: int) -> str:
+    """超出 token 上限的内容只保留开头和结尾，中间用省略标记代替"""
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    # 按这段文本的平均每字 token 数换算出首尾各保留的字符数
+    keep_chars = max(1, int(max_tokens * len(text) / tokens) // 2)
+    omitted = len(text) - keep_chars * 2
+    return f"{text[:keep_chars]}\n……（中间省略 {omitted} 字）……\n{text[-keep_chars:]}"
+
+
+def get_context_limits(stage: str = None) -> tuple:
+    """
+    读取某个阶段的历史上下文预算（performance_settings.context_budget）
+
+    Returns:
+        (历史记录总 token 预算, 单条消息 token 上限)
+    """
+    from config_loader import get_performance_config
+    settings = get_performance_config().get("context_budget") or {}
+    stage_budgets = settings.get("stages") or {}
+    token_budget = stage_budgets.get(stage, settings.get("default_tokens", 3000))
+    return token_budget, settings.get("max_message_tokens", 800)
+
 
 class ChatHistoryManager:
     """聊天历史管理器"""
@@ -11,6 +40,11 @@ class ChatHistoryManager:
         self.history_file = history_file
         self.max_history = max_history
         self.history: List[Dict] = self._load_history()
+        self._lock = threading.Lock()
+        # 历史版本号：每次新增或清空记录时加一，依赖历史的短期缓存（scheduler.stage_memo）以此判断是否失效
+        self.revision = 0
+        # 与 history 一一对应的格式化结果：(用户消息, 助手回复, 用户 token 数, 回复 token 数)
+        self._formatted: List[tuple] = [self._format_record(record) for record in self.history]
 
     def _load_history(self) -> List[Dict]:
         """从文件加载历史记录"""
@@ -26,7 +60,7 @@ class ChatHistoryManager:
     def _save_history(self):
         """保存历史记录到文件"""
         try:
-            with open(self.history_file, 'w', encoding='utf-8') as f:
+            with span("history_save"), open(self.history_file, 'w', encoding='utf-8') as f:
                 json.dump(self.history, f, ensure_ascii=False, indent=2)
         except Exception as e:
             print(f"保存历史记录失败: {e}")
@@ -50,11 +84,15 @@ class ChatHistoryManager:
             "metadata": metadata or {}
         }
 
-        self.history.append(conversation)
+        with self._lock:
+            self.history.append(conversation)
+            self._formatted.append(self._format_record(conversation))
+            self.revision += 1
 
-        # 保持最大历史记录数量
-        if len(self.history) > self.max_history:
-            self.history = self.history[-self.max_history:]
+            # 保持最大历史记录数量
+            if len(self.history) > self.max_history:
+                self.history = self.history[-self.max_history:]
+                self._formatted = self._formatted[-self.max_history:]
 
         self._save_history()
 
@@ -64,46 +102,95 @@ class ChatHistoryManager:
             count = self.max_history
         return self.history[-count:] if self.history else []
 
-    def format_history_for_ai(self, count: int = 10, current_prompt: str = None) -> List[Dict]:
+    @staticmethod
+    def _format_record(record: Dict) -> tuple:
+        """格式化单条记录并估算 token 数，结果随记录一起缓存"""
+        # 对于历史记录，只保存核心信息，不使用prompt模板
+        user_content = record.get("user_input", "")
+        assistant_content = record.get("assistant_response", "")
+        return (
+            {"role": "user", "content": user_content},
+            {"role": "assistant", "content": assistant_content},
+            estimate_tokens(user_content) + MESSAGE_OVERHEAD_TOKENS,
+            estimate_tokens(assistant_content) + MESSAGE_OVERHEAD_TOKENS,
+        )
+
+    def format_history_for_ai(self, count: int = 10, current_prompt: str = None,
+                              token_budget: int = None, max_message_tokens: int = None) -> List[Dict]:
         """
         格式化历史记录用于AI上下文
 
+        从最新的一轮往前取，单条超过 max_message_tokens 的消息只保留首尾，
+        累计超过 token_budget 时更早的记录不再加入。
+
         Args:
             count: 获取的历史记录数量
             current_prompt: 当前的prompt模板（如果提供，只对最新一条使用）
+            token_budget: 历史记录总 token 预算，None 表示不限制
+            max_message_tokens: 单条消息的 token 上限，None 表示不限制
 
         Returns:
             格式化后的消息列表，适合传递给AI API
         """
-        recent_history = self.get_recent_history(count)
+        with self._lock:
+            recent = self._formatted[-count:] if count else []
+
         formatted_messages = []
+        used_tokens = 0
 
-        for i, record in enumerate(recent_history):
-            # 对于历史记录，只保存核心信息，不使用prompt模板
-            user_content = record["user_input"]
-            assistant_content = record["assistant_response"]
+        for i, (user_message, assistant_message, user_tokens, assistant_tokens) in enumerate(reversed(recent)):
+            user_message = dict(user_message)
+            assistant_message = dict(assistant_message)
 
             # 如果是当前最新的一条且提供了prompt模板，则使用模板
-            if i == len(recent_history) - 1 and current_prompt:
-                user_content = current_prompt.format(user_input=record["user_input"])
-
-            # 添加用户消息
-            formatted_messages.append({
-                "role": "user",
-                "content": user_content
-            })
-
-            # 添加助手回复
-            formatted_messages.append({
-                "role": "assistant",
-                "content": assistant_content
-            })
-
+            if i == 0 and current_prompt:
+                user_message["content"] = current_prompt.format(user_input=user_message["content"])
+                user_tokens = estimate_tokens(user_message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+            if max_message_tokens:
+                if user_tokens > max_message_tokens:
+                    user_message["content"] = _elide_text(user_message["content"], max_message_tokens)
+                    user_tokens = max_message_tokens
+                if assistant_tokens > max_message_tokens:
+                    assistant_message["content"] = _elide_text(assistant_message["content"], max_message_tokens)
+                    assistant_tokens = max_message_tokens
+
+            if token_budget is not None and used_tokens + user_tokens + assistant_tokens > token_budget:
+                break
+            used_tokens += user_tokens + assistant_tokens
+
+            # 倒序收集，最后再翻转回时间顺序（助手回复在前，翻转后位于用户消息之后）
+            formatted_messages.append(assistant_message)
+            formatted_messages.append(user_message)
+
+        formatted_messages.reverse()
         return formatted_messages
 
+    def format_history_for_stage(self, stage: str = None, count: int = 10) -> List[Dict]:
+        """按阶段配置的 token 预算格式化历史记录"""
+        token_budget, max_message_tokens = get_context_limits(stage)
+        return self.format_history_for_ai(count, token_budget=token_budget,
+                                          max_message_tokens=max_message_tokens)
+
+    def get_history_tokens(self) -> int:
+        """当前全部历史记录的估算 token 数（未截断）"""
+        with self._lock:
+            return sum(user_tokens + assistant_tokens for _, _, user_tokens, assistant_tokens in self._formatted)
+
+    def use_file(self, history_file: str):
+        """改用另一个历史记录文件并载入其中的记录（无界面批处理等不应读写用户真实对话记录的场景）"""
+        with self._lock:
+            self.history_file = history_file
+            self.history = self._load_history()
+            self._formatted = [self._format_record(record) for record in self.history]
+            self.revision += 1
+
     def clear_history(self):
         """清空历史记录"""
-        self.history = []
+        with self._lock:
+            self.history = []
+            self._formatted = []
+            self.revision += 1
         self._save_history()
 
     def get_history_summary(self) -> str:
@@ -116,7 +203,8 @@ class ChatHistoryManager:
         code_count = sum(1 for h in self.history if h["type"] == "code_execution")
         image_count = sum(1 for h in self.history if h["type"] == "image_analysis")
 
-        return f"历史记录总数: {total}, 闲聊: {chat_count}, 代码执行: {code_count}, 图片分析: {image_count}"
+        return (f"历史记录总数: {total}, 闲聊: {chat_count}, 代码执行: {code_count}, 图片分析: {image_count}, "
+                f"估算 token: {self.get_history_tokens()}")
 
 
 # 全局历史管理器实例
@@ -5,12 +5,33 @@
 用于动态加载虚拟女仆系统的配置
 """
 
+import copy
 import json
 import os
+import threading
 from pathlib import Path
 
+# 配置缓存：只有文件修改时间或大小变化时才重新读取磁盘
+_config_cache = None
+_config_cache_key = None
+_config_cache_lock = threading.Lock()
+# 配置内容变化后要执行的回调（按新参数重新派生缓存音频等）
+_reload_listeners = []
+
+def add_reload_listener(callback):
+    """登记配置内容变化后（包括首次读取）要执行的回调"""
+    _reload_listeners.append(callback)
+
+def _notify_reload():
+    for callback in list(_reload_listeners):
+        try:
+            callback()
+        except Exception as e:
+            print(f"⚠️ 配置重新加载回调执行失败: {e}")
+
 def load_maid_config():
     """加载女仆系统配置"""
+    global _config_cache, _config_cache_key
     config_file = 'maid_settings.json'
     
     if not os.path.exists(config_file):
@@ -18,13 +39,184 @@ def load_maid_config():
         create_default_config()
     
     try:
-        with open(config_file, 'r', encoding='utf-8') as f:
-            config = json.load(f)
-            return config
+        stat = os.stat(config_file)
+        cache_key = (stat.st_mtime_ns, stat.st_size)
+        reloaded = False
+        with _config_cache_lock:
+            if _config_cache is None or _config_cache_key != cache_key:
+                with open(config_file, 'r', encoding='utf-8') as f:
+                    config = json.load(f)
+                # 只有内容真的变化（或首次读取）时才通知回调；文件被重新写入但内容相同时不通知
+                reloaded = config != _config_cache
+                _config_cache = config
+                _config_cache_key = cache_key
+            # 返回副本，避免调用方修改缓存内容
+            config = copy.deepcopy(_config_cache)
+        # 回调中可能再次读取配置，在锁外执行
+        if reloaded:
+            _notify_reload()
+        return config
     except Exception as e:
         print(f"⚠️ 加载配置文件失败: {e}")
         return get_default_config()
 
+def get_default_performance_config():
+    """获取默认的性能相关配置"""
+    return {
+        "stream_responses": True,  # 流式接收AI回复，边生成边显示
+        "routing_mode": "two_stage",  # 路由模式：two_stage（判断+详情两次请求）/ combined（合并为一次请求）/ speculative（三个请求并行）
+        "local_classifier": True,  # 先用本地意图分类器判断闲聊/代码，置信度不足时再请求大模型
+        "local_classifier_threshold": 0.9,
+        # 大模型响应缓存：stages 中可按阶段覆盖 enabled / ttl，带历史记录的调用默认不缓存
+        "response_cache": {
+            "enabled": True,
+            "cache_history_calls": False,
+            "max_entries": 2000,
+            "max_bytes": 20 * 1024 * 1024,
+            "stages": {}
+        },
+        # 历史上下文预算：default_tokens 为历史记录总 token 上限，stages 中可按阶段覆盖；
+        # 超过 max_message_tokens 的单条消息只保留首尾
+        "context_budget": {
+            "default_tokens": 3000,
+            "max_message_tokens": 800,
+            "stages": {"judge": 1500, "image": 2000}
+        },
+        # 按阶段选择模型：model 为空时使用 api_config 中的模型；配置了 fallback 和 p95_target 时，
+        # 主模型滚动 p95 延迟（秒，按阶段统计，流式调用为首字延迟）超过目标会切换到备用模型，每隔 probe_interval 次
+        # 探测一次主模型；超时或出错的调用按至少 failure_penalty 秒计入
+        "model_routing": {
+            "enabled": True,
+            "window": 50,
+            "probe_interval": 10,
+            "failure_penalty": 30.0,
+            "stages": {
+                "judge": {"model": None, "max_tokens": 100, "fallback": None, "p95_target": 3.0},
+                "match": {"model": None, "max_tokens": 500, "fallback": None, "p95_target": 5.0},
+                "generate": {"model": None, "max_tokens": 2000, "fallback": None, "p95_target": 30.0}
+            }
+        },
+        # 超时、多端点对冲和熔断：备用端点在 api_config.endpoints 中配置；
+        # 主端点超过其 p90 延迟仍未响应时向下一个端点发出对冲请求（hedge_kinds 中的请求类型；默认只对冲流式请求，
+        # complete 请求落败的一方无法中途取消，会完整生成并计费），
+        # 连续失败 breaker_failures 次的端点熔断 breaker_cooldown 秒
+        "resilience": {
+            "request_timeout": 60.0,
+            "connect_timeout": 5.0,
+            "max_retries": 1,
+            "hedging": True,
+            "hedge_kinds": ["stream"],
+            "hedge_quantile": 0.9,
+            "hedge_min_delay": 0.5,
+            "hedge_default_delay": 3.0,
+            "breaker_failures": 3,
+            "breaker_cooldown": 30.0
+        },
+        # 请求级延迟追踪：export 为 true 时每次请求导出一个 Chrome trace 文件到 directory，最多保留 max_files 个
+        "tracing": {
+            "export": False,
+            "directory": "traces",
+            "max_files": 50
+        },
+        # 上游API流量录制 / 回放：mode 为 off / record / replay；录制时 session_file 为空则在 directory 下按时间命名，
+        # 回放时 replay_speed 为回放速度倍数（0 表示不等待）
+        "traffic": {
+            "mode": "off",
+            "directory": "traffic",
+            "session_file": "",
+            "replay_speed": 1.0
+        },
+        # 本地服务模式（maid_server.py）：多个前端通过 WebSocket 共用一个进程中的流水线、连接池和缓存；
+        # audio_chunk_size 为推送给客户端的每个音频分块的字节数；连接必须带上访问令牌 token（留空时每次启动随机生成），
+        # 浏览器发起的连接只接受 allowed_origins 中的来源（如 "http://127.0.0.1:5000"）
+        "server": {
+            "host": "127.0.0.1",
+            "port": 8765,
+            "token": "",
+            "allowed_origins": [],
+            "send_audio": True,
+            "audio_chunk_size": 32768
+        },
+        # 连续输入的调度：policy 为 preempt（取消正在处理的请求）/ queue（排队）/ merge（排队的输入合并为一条后续请求），
+        # max_queue 为最多排队的输入数；stage_reuse 为 true 时复用被取消请求已完成的阶段结果（reuse_ttl 秒内有效）
+        "scheduler": {
+            "policy": "preempt",
+            "max_queue": 5,
+            "stage_reuse": True,
+            "reuse_ttl": 300.0
+        },
+        # 上游限流：每个端点 requests_per_second 的令牌桶（突发 burst）和 max_concurrent 个并发名额
+        # （流式请求收到响应后即归还名额，接收数据期间不占用），
+        # 等待中的请求按 priorities（请求类型 -> interactive / normal / background）排队；
+        # 429 时按 Retry-After（没有时从 backoff_base 秒开始指数退避）暂停放行，最多重试 max_retries 次；
+        # endpoints 中可按端点名称覆盖以上参数
+        "rate_limit": {
+            "enabled": True,
+            "requests_per_second": 5.0,
+            "burst": 5,
+            "max_concurrent": 4,
+            "max_retries": 2,
+            "backoff_base": 1.0,
+            "backoff_max": 30.0,
+            "priorities": {"complete": "interactive", "stream": "interactive", "tts": "interactive",
+                           "image": "background"},
+            "endpoints": {}
+        },
+        # 连接预热：按下 Alt+D（服务模式为 hello / typing 消息）时在后台刷新配置、加载意图分类器，
+        # 并向各端点发一个小请求建立连接（ping 为 true 时 GET /models，否则 HEAD），两次预热至少间隔 min_interval 秒；
+        # 距离上一次上游请求超过 keepalive_interval 秒时自动保活（0 关闭），用户超过 keepalive_max_idle 秒没有活动后停止
+        "warmup": {
+            "enabled": True,
+            "ping": True,
+            "timeout": 10.0,
+            "min_interval": 15.0,
+            "keepalive_interval": 60.0,
+            "keepalive_max_idle": 1800.0
+        },
+        # 流式语音合成：以 PCM（sample_rate 采样率）边下载边变调边播放，第一块 first_block 秒、之后每块 block 秒，
+        # 每块前后带 overlap 秒上下文一起变调以消除接缝；服务模式（推送音频给客户端）仍整段合成
+        "tts_stream": {
+            "enabled": True,
+            "sample_rate": 24000,
+            "first_block": 0.3,
+            "block": 1.0,
+            "overlap": 0.1
+        },
+        # 按句合成：不少于 min_text_chars 个字的回复按句（不足 min_sentence_chars 个字的片段并入下一句）
+        # 依次翻译、下载、变调、播放，各阶段之间最多提前准备 lookahead 句；每句单独缓存
+        "tts_pipeline": {
+            "enabled": True,
+            "min_text_chars": 40,
+            "min_sentence_chars": 8,
+            "lookahead": 1
+        },
+        # 变调：升调 n_steps 个半音；engine 为 numpy（进程内相位声码器）/ rubberband / rubberband-r3 / librosa / auto，
+        # auto 时短于 short_clip_seconds 秒的音频用 short_engine，其余用 long_engine，不可用时退回 numpy
+        "pitch_shift": {
+            "engine": "auto",
+            "n_steps": 4.1,
+            "short_clip_seconds": 3.0,
+            "short_engine": "numpy",
+            "long_engine": "rubberband"
+        },
+        # 音频缓存：变调后的派生版本按原始语音和变调参数索引，条数或总字节数超出上限时按最近访问时间淘汰；
+        # raw 为接口返回的原始语音（按文本、语气、音色、模型索引）的上限
+        "audio_cache": {
+            "enabled": True,
+            "max_entries": 5000,
+            "max_bytes": 209715200,
+            "raw": {
+                "max_entries": 5000,
+                "max_bytes": 209715200
+            }
+        },
+        # 派生版本：变调参数改变后，在后台为最近使用的 rederive_max_clips 段原始语音重新派生
+        "audio_variants": {
+            "rederive": True,
+            "rederive_max_clips": 200
+        }
+    }
+
 def get_default_config():
     """获取默认配置"""
     return {
@@ -32,8 +224,10 @@ def get_default_config():
         "background_story": None,  # 背景故事，None表示使用默认故事
         "api_config": {
             "base_url": "https://www.dmxapi.cn/v1",
-            "api_key": ""
+            "api_key": "",
+            "endpoints": []  # 备用端点列表：[{"name": ..., "base_url": ..., "api_key": ...}]
         },
+        "performance_settings": get_default_performance_config(),
         "animation_settings": {
             "刚开启时": {
                 "folder": "politeTalk",
@@ -120,8 +314,18 @@ def create_default_config():
     except Exception as e:
         print(f"❌ 创建默认配置文件失败: {e}")
 
+def invalidate_config_cache():
+    """清除配置缓存，下次读取时强制从磁盘加载"""
+    global _config_cache, _config_cache_key
+    with _config_cache_lock:
+        _config_cache = None
+        _config_cache_key = None
+
 def reload_config():
-    """重新加载配置"""
+    """重新加载配置（清除缓存后重新读取文件，文件时间戳精度不够时也不会漏掉刚保存的修改）"""
+    global _config_cache_key
+    with _config_cache_lock:
+        _config_cache_key = None
     return load_maid_config()
 
 def get_api_config():
@@ -135,6 +339,13 @@ def get_animation_config(scene_name):
     animation_settings = config.get('animation_settings', {})
     return animation_settings.get(scene_name, {})
 
+def get_performance_config():
+    """获取性能相关配置（缺失的字段使用默认值补全）"""
+    config = load_maid_config()
+    performance_config = get_default_performance_config()
+    performance_config.update(config.get('performance_settings') or {})
+    return performance_config
+
 def get_user_name():
     """获取用户名称"""
     config = load_maid_config()
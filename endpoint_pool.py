@@ -0,0 +1,262 @@
+"""
+多端点故障转移与对冲请求
+api_config 中的 base_url / api_key 是主端点，api_config.endpoints 中可以再配置若干备用端点。
+
+- 对冲：主端点在 p90 延迟内还没有响应时，向下一个端点再发一份相同的请求，先返回（流式请求为先出字）的一方胜出。
+  流式请求落败的一方在 claim() 返回 False 时立即关闭连接；非流式请求（complete）无法中途取消，落败的一方会
+  完整生成、计费并占用限流名额，所以 hedge_kinds 默认只包含 stream
+- 故障转移：请求失败时立即改用下一个端点
+- 熔断：端点连续失败达到阈值后暂时剔除，冷却结束后放行请求试探，成功即恢复
+
+每次尝试发出前还要经过 rate_limiter 的限流（令牌桶、并发上限和优先级排队，429 时按 Retry-After 退避）。
+相关参数在 performance_settings.resilience 中配置。
+"""
+
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+from metrics import metrics
+from rate_limiter import rate_limiter
+
+# 计算对冲延迟前至少需要的样本数，样本不足时使用 hedge_default_delay
+MIN_SAMPLES = 5
+LATENCY_WINDOW = 100
+
+
+class Endpoint:
+    """一个 API 端点及其熔断状态和延迟样本"""
+
+    def __init__(self, name: str, base_url: str, api_key: str):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.state = "closed"       # closed 正常 / open 已熔断 / half_open 冷却结束，等待试探
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.latencies = {}         # 请求类型 -> 最近的响应延迟
+        self.stats = {"requests": 0, "successes": 0, "failures": 0, "wins": 0, "ejections": 0}
+
+    def snapshot(self) -> dict:
+        return {
+            "name": self.name,
+            "base_url": self.base_url,
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            **self.stats,
+        }
+
+
+class EndpointPool:
+    """按熔断状态挑选端点，执行带对冲和故障转移的请求"""
+
+    def __init__(self, settings: dict = None, endpoints: list = None):
+        # settings / endpoints 不传时从配置文件读取；直接传入便于对着本地桩服务测试
+        self._settings = settings
+        self._fixed_endpoints = endpoints
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="endpoint")
+        self.stats = {"hedges_fired": 0, "hedge_wins": 0, "failovers": 0, "all_failed": 0}
+
+    def get_settings(self) -> dict:
+        """读取容错配置（performance_settings.resilience）"""
+        if self._settings is not None:
+            return self._settings
+        from config_loader import get_performance_config
+        return get_performance_config().get("resilience") or {}
+
+    def primary_name(self) -> str:
+        """主端点的名称（试用程序等不经过端点池、但访问同一上游的请求用它共享限流）"""
+        endpoints = self.get_endpoints()
+        return endpoints[0].name if endpoints else "primary"
+
+    def get_endpoints(self) -> list:
+        """按配置顺序返回所有端点（熔断状态跨配置重载保留）"""
+        if self._fixed_endpoints is not None:
+            return list(self._fixed_endpoints)
+
+        from config_loader import load_maid_config
+        from llm_client import DEFAULT_BASE_URL
+        api_config = load_maid_config().get('api_config', {})
+        entries = [{
+            "name": "primary",
+            "base_url": api_config.get('base_url') or DEFAULT_BASE_URL,
+            "api_key": api_config.get('api_key', ''),
+        }]
+        entries.extend(api_config.get('endpoints') or [])
+
+        endpoints = []
+        with self._lock:
+            for index, entry in enumerate(entries):
+                if not entry.get("base_url"):
+                    continue
+                key = (entry["base_url"].rstrip('/'), entry.get("api_key", ''))
+                endpoint = self._endpoints.get(key)
+                if endpoint is None:
+                    endpoint = Endpoint(entry.get("name") or f"endpoint-{index}", key[0], key[1])
+                    self._endpoints[key] = endpoint
+                endpoints.append(endpoint)
+        return endpoints
+
+    def _available(self, endpoints: list, settings: dict) -> list:
+        """剔除熔断中的端点；全部熔断时仍返回最早熔断的一个，避免完全不可用"""
+        now = time.time()
+        cooldown = settings.get("breaker_cooldown", 30.0)
+        closed, half_open = [], []
+        with self._lock:
+            for endpoint in endpoints:
+                if endpoint.state == "open" and now - endpoint.opened_at >= cooldown:
+                    endpoint.state = "half_open"
+                if endpoint.state == "closed":
+                    closed.append(endpoint)
+                elif endpoint.state == "half_open":
+                    half_open.append(endpoint)
+        available = closed + half_open
+        if not available and endpoints:
+            available = [min(endpoints, key=lambda endpoint: endpoint.opened_at)]
+        return available
+
+    def _hedge_delay(self, endpoint: Endpoint, kind: str, settings: dict) -> float:
+        """对冲延迟：该端点此类请求的 p90 延迟（不低于 hedge_min_delay）"""
+        with self._lock:
+            samples = list(endpoint.latencies.get(kind, ()))
+        if len(samples) < MIN_SAMPLES:
+            return settings.get("hedge_default_delay", 3.0)
+        quantile = settings.get("hedge_quantile", 0.9) * 100
+        return max(settings.get("hedge_min_delay", 0.5), float(np.percentile(samples, quantile)))
+
+    def _record_success(self, endpoint: Endpoint):
+        with self._lock:
+            endpoint.stats["successes"] += 1
+            endpoint.consecutive_failures = 0
+            if endpoint.state != "closed":
+                print(f"✅ API端点 {endpoint.name} 已恢复")
+            endpoint.state = "closed"
+
+    def _record_failure(self, endpoint: Endpoint, error: Exception, settings: dict):
+        with self._lock:
+            endpoint.stats["failures"] += 1
+            endpoint.consecutive_failures += 1
+            should_open = (endpoint.state == "half_open" or
+                           endpoint.consecutive_failures >= settings.get("breaker_failures", 3))
+            if should_open and endpoint.state != "open":
+                endpoint.state = "open"
+                endpoint.opened_at = time.time()
+                endpoint.stats["ejections"] += 1
+                print(f"⚠️ API端点 {endpoint.name} 连续失败 {endpoint.consecutive_failures} 次，暂时熔断: {error}")
+
+    def _record_latency(self, endpoint: Endpoint, kind: str, latency: float):
+        with self._lock:
+            samples = endpoint.latencies.setdefault(kind, deque(maxlen=LATENCY_WINDOW))
+            samples.append(latency)
+
+    def run(self, attempt, kind: str = "complete"):
+        """
+        在可用端点上执行请求
+
+        Args:
+            attempt: attempt(endpoint, claim) -> 结果。拿到响应（流式请求为第一段内容）后调用 claim()，
+                     返回 True 表示本次尝试胜出，返回 False 表示其他端点已经胜出，应尽快放弃并返回
+            kind: 请求类型（complete / stream / tts / image），延迟样本和对冲开关按类型区分
+
+        Returns:
+            胜出尝试的返回值；所有端点都失败时抛出最后一个异常
+        """
+        settings = self.get_settings()
+        candidates = self._available(self.get_endpoints(), settings)
+        if not candidates:
+            raise Exception("没有可用的API端点")
+        hedging = settings.get("hedging", True) and kind in settings.get("hedge_kinds", ["stream"])
+
+        claim_lock = threading.Lock()
+        winner = {"endpoint": None}
+
+        def launch(endpoint: Endpoint):
+            start_time = time.perf_counter()
+
+            def claim() -> bool:
+                # 已经收到响应：归还限流的并发名额，流式请求接收数据期间不再占用
+                rate_limiter.release_current_slot()
+                with claim_lock:
+                    if winner["endpoint"] is None:
+                        winner["endpoint"] = endpoint
+                        self._record_latency(endpoint, kind, time.perf_counter() - start_time)
+                    return winner["endpoint"] is endpoint
+
+            with self._lock:
+                endpoint.stats["requests"] += 1
+            # 复制上下文，让 token 用量等 ContextVar 统计计入调用方；
+            # 发出前先经过该端点的限流（令牌桶、并发上限、按优先级排队，429 时退避重试）
+            return self._executor.submit(contextvars.copy_context().run, rate_limiter.call,
+                                         endpoint.name, kind, attempt, endpoint, claim)
+
+        remaining = list(candidates)
+        first_endpoint = remaining.pop(0)
+        pending = {launch(first_endpoint): first_endpoint}
+        hedged = False
+        last_error = None
+
+        while pending:
+            timeout = None
+            if hedging and remaining and not hedged and winner["endpoint"] is None:
+                timeout = self._hedge_delay(first_endpoint, kind, settings)
+
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # 主端点迟迟没有响应，向下一个端点发出对冲请求
+                if winner["endpoint"] is None:
+                    hedged = True
+                    endpoint = remaining.pop(0)
+                    with self._lock:
+                        self.stats["hedges_fired"] += 1
+                    print(f"⏱️ {first_endpoint.name} 响应超过 {timeout:.2f} 秒，向 {endpoint.name} 发出对冲请求")
+                    pending[launch(endpoint)] = endpoint
+                continue
+
+            for future in done:
+                endpoint = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    self._record_failure(endpoint, e, settings)
+                    if winner["endpoint"] is endpoint:
+                        # 已经开始输出后才失败，无法再换端点
+                        raise
+                    if remaining and not pending:
+                        next_endpoint = remaining.pop(0)
+                        with self._lock:
+                            self.stats["failovers"] += 1
+                        print(f"🔀 API端点 {endpoint.name} 请求失败，改用 {next_endpoint.name}: {e}")
+                        pending[launch(next_endpoint)] = next_endpoint
+                    continue
+
+                self._record_success(endpoint)
+                if winner["endpoint"] is endpoint:
+                    with self._lock:
+                        endpoint.stats["wins"] += 1
+                        if hedged and endpoint is not first_endpoint:
+                            self.stats["hedge_wins"] += 1
+                    return result
+
+        with self._lock:
+            self.stats["all_failed"] += 1
+        raise last_error or Exception("所有API端点均未返回结果")
+
+    def get_stats(self) -> dict:
+        """获取对冲、故障转移次数和各端点的熔断状态"""
+        endpoints = self.get_endpoints()
+        with self._lock:
+            stats = dict(self.stats)
+            stats["endpoints"] = [endpoint.snapshot() for endpoint in endpoints]
+        return stats
+
+
+# 全局端点池实例
+endpoint_pool = EndpointPool()
+metrics.register_collector("endpoints", endpoint_pool.get_stats)
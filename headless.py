@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+无界面批处理模式
+不启动 Qt，用 NullProcessor 代替动画/对话框处理器，从 JSONL 文件读取输入，按给定并发数调用 maid_handle_input，
+把每条输入的回复、语气、各阶段耗时和处理器收到的界面操作写入结果文件。可用于吞吐量测试，
+也可以把一批任务描述丢进来批量生成代码库（py/ 目录）。
+
+输入文件每行一个 JSON 对象 {"id": ..., "input": "..."}，也可以直接是一个字符串。
+每条输入使用独立的会话（需要补充信息的请求不会把下一条输入拼接进来）。对话历史写入单独的文件
+（默认是运行结束后删除的临时文件，可用 --history-file 指定），不会读写用户真实的 chat_history.json，
+批处理的输入也就不会挤掉真实的对话记录或成为意图分类器的训练样本。同一批输入共用这份历史记录，
+并发处理时一条输入可能看到其他输入的对话；需要各条输入完全独立时使用 --concurrency 1 并分批运行。
+
+用法（在项目根目录运行）：
+    python headless.py inputs.jsonl --output results.jsonl --concurrency 4
+    python headless.py inputs.jsonl --tts --save-audio audio_out/
+    python headless.py inputs.jsonl --history-file headless_history.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class NullProcessor:
+    """不显示任何界面的处理器：实现 PRImageProcessor 中请求流程用到的方法，只记录调用"""
+
+    def __init__(self, verbose: bool = False):
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self.calls = []
+
+    def _record(self, name: str, *args):
+        with self._lock:
+            self.calls.append([name, *args])
+        if self.verbose:
+            print(f"[{name}] {' '.join(str(arg) for arg in args)}")
+
+    def play(self, inner_folder, scale_factor=1.0, loop=False, play_speed=1.0):
+        self._record("play", inner_folder)
+
+    def show_dialog(self, text):
+        self._record("show_dialog", text)
+
+    def show_timed_dialog(self, *texts: str, duration=None):
+        self._record("show_timed_dialog", *texts)
+
+    def hide_dialog(self):
+        self._record("hide_dialog")
+
+    def cancel_timed_close(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def load_inputs(path: str) -> list:
+    """读取输入文件，返回 [(id, 输入文本), ...]"""
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for index, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if isinstance(entry, str):
+                items.append((index, entry))
+            else:
+                items.append((entry.get("id", index), entry["input"]))
+    return items
+
+
+def run_item(item_id, user_input: str, tts: bool = False, play: bool = False, audio_dir: str = None,
+             verbose: bool = False) -> dict:
+    """处理一条输入（可选合成语音），返回结果和各阶段耗时"""
+    from call_ai import speak
+    from maid_core import maid_handle_input_async
+    from pipeline import stage_runner
+    from tracing import finish_trace, start_trace
+
+    processor = NullProcessor(verbose)
+    trace = start_trace("request", user_input=user_input)
+    first_text = []
+
+    def on_partial(text):
+        if not first_text:
+            first_text.append(trace.duration)
+
+    async def handle():
+        reply, tone = await maid_handle_input_async(user_input, processor, on_partial, session={})
+        if not first_text:
+            first_text.append(trace.duration)
+        if tts:
+            save_path = os.path.join(audio_dir, f"{item_id}.wav") if audio_dir else None
+            await stage_runner.run_stage("tts", speak, reply, tone=tone, save_path=save_path, play=play)
+        return reply, tone
+
+    result = {"id": item_id, "input": user_input}
+    try:
+        reply, tone = stage_runner.run(handle, trace=trace)
+        result.update(reply=reply, tone=tone)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        finish_trace(trace)
+    result.update(
+        first_text=first_text[0] if first_text else None,
+        total=trace.duration,
+        stages=trace.summary(),
+        ui_calls=processor.calls,
+    )
+    return result
+
+
+def run_batch(items: list, output: str, concurrency: int = 1, tts: bool = False, play: bool = False,
+              audio_dir: str = None, verbose: bool = False) -> list:
+    """
+    按并发数处理一批输入，每完成一条就追加写入结果文件
+
+    Returns:
+        所有结果（按完成顺序）
+    """
+    if audio_dir:
+        os.makedirs(audio_dir, exist_ok=True)
+    write_lock = threading.Lock()
+    results = []
+    start_time = time.perf_counter()
+
+    def worker(item):
+        item_id, user_input = item
+        result = run_item(item_id, user_input, tts, play, audio_dir, verbose)
+        with write_lock:
+            results.append(result)
+            with open(output, "a", encoding="utf-8") as f:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+            status = "❌" if "error" in result else "✅"
+            print(f"{status} [{len(results)}/{len(items)}] {item_id}: {result['total']:.2f} 秒")
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="headless") as executor:
+        list(executor.map(worker, items))
+
+    elapsed = time.perf_counter() - start_time
+    failures = sum(1 for result in results if "error" in result)
+    print(f"完成 {len(results)} 条（失败 {failures} 条），总耗时 {elapsed:.2f} 秒，"
+          f"吞吐量 {len(results) / elapsed if elapsed else 0:.2f} 条/秒")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="无界面批处理模式")
+    parser.add_argument("inputs", help="输入文件（JSONL）")
+    parser.add_argument("--output", default="headless_results.jsonl", help="结果文件（JSONL，追加写入）")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="同时处理的输入数（各阶段共用阶段调度器的线程池，超过其大小时会排队）")
+    parser.add_argument("--tts", action="store_true", help="同时合成语音（默认跳过）")
+    parser.add_argument("--play", action="store_true", help="合成后实际播放（需要 --tts）")
+    parser.add_argument("--save-audio", help="把合成的语音保存到该目录（需要 --tts）")
+    parser.add_argument("--verbose", action="store_true", help="打印处理器收到的界面操作")
+    parser.add_argument("--history-file",
+                        help="批处理使用的对话历史文件（默认使用临时文件，不影响真实的 chat_history.json）")
+    args = parser.parse_args()
+
+    items = load_inputs(args.inputs)
+    if not items:
+        print("输入文件为空")
+        return 1
+
+    from chat_history import chat_history
+    temp_dir = None
+    history_file = args.history_file
+    if history_file is None:
+        temp_dir = tempfile.mkdtemp(prefix="maid_headless_")
+        history_file = os.path.join(temp_dir, "chat_history.json")
+    chat_history.use_file(history_file)
+    try:
+        results = run_batch(items, args.output, args.concurrency, args.tts, args.play, args.save_audio,
+                            args.verbose)
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    from tracing import format_stage_report
+    print("各阶段耗时统计:\n" + format_stage_report())
+    print(f"结果已写入: {args.output}")
+    return 1 if any("error" in result for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
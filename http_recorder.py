@@ -0,0 +1,319 @@
+"""
+上游API流量的录制与回放
+挂在 llm_client 共享 HTTP 连接池的传输层上，call_ai 中的大模型调用、流式响应、语音合成和图片识别都会经过这里：
+
+- record：把每个请求、响应（含流式响应的每个分块）和时间写入 JSONL 会话文件，用户输入也一并记录
+- replay：不连接网络，按录制时的时间（或按 replay_speed 加速）把会话中的响应返回给调用方
+
+回放时请求按 (方法, 路径, 规范化后的请求体) 精确匹配；对话历史等不同导致匹配不上时，
+按录制顺序取同一路径、同样流式设置的下一条记录。配合 benchmarks/replay_session.py 可以离线重放真实对话，
+检查 JSON 解析、变调、历史读写等本地处理耗时是否退化。
+
+相关参数在 performance_settings.traffic 中配置。
+"""
+
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import httpx
+
+from metrics import metrics
+
+SESSION_VERSION = 1
+TRAFFIC_DIR = "traffic"
+
+
+def get_settings() -> dict:
+    """读取录制 / 回放配置（performance_settings.traffic）"""
+    try:
+        from config_loader import get_performance_config
+        return get_performance_config().get("traffic") or {}
+    except Exception:
+        return {}
+
+
+def _parse_body(content: bytes):
+    """请求体能解析为 JSON 时返回对象（便于阅读和匹配），否则返回 None"""
+    if not content:
+        return None
+    try:
+        return json.loads(content)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _request_key(method: str, path: str, content: bytes) -> str:
+    body = _parse_body(content)
+    normalized = json.dumps(body, ensure_ascii=False, sort_keys=True) if body is not None else content.hex()
+    return hashlib.sha256(f"{method} {path} {normalized}".encode("utf-8")).hexdigest()
+
+
+def _is_stream(content: bytes) -> bool:
+    body = _parse_body(content)
+    return bool(isinstance(body, dict) and body.get("stream"))
+
+
+def _encode_chunk(offset: float, data: bytes) -> dict:
+    try:
+        return {"o": round(offset, 6), "text": data.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"o": round(offset, 6), "b64": base64.b64encode(data).decode("ascii")}
+
+
+def _decode_chunk(chunk: dict) -> bytes:
+    if "text" in chunk:
+        return chunk["text"].encode("utf-8")
+    return base64.b64decode(chunk["b64"])
+
+
+class SessionRecorder:
+    """把流量逐行追加到会话文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stats = {"recorded": 0, "inputs": 0, "errors": 0}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.write({"type": "session", "version": SESSION_VERSION, "started_at": datetime.now().isoformat()})
+        print(f"📼 正在录制上游API流量: {path}")
+
+    def offset(self) -> float:
+        return round(time.perf_counter() - self.start, 6)
+
+    def write(self, entry: dict):
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def record_input(self, text: str):
+        with self._lock:
+            self.stats["inputs"] += 1
+        self.write({"type": "input", "t": self.offset(), "text": text})
+
+    def record_exchange(self, entry: dict):
+        with self._lock:
+            self.stats["recorded"] += 1
+            if entry.get("error"):
+                self.stats["errors"] += 1
+        self.write(entry)
+
+
+class _RecordingStream(httpx.SyncByteStream):
+    """边向调用方输出响应分块，边记录每块的到达时间；关闭时写入会话文件"""
+
+    def __init__(self, inner, entry: dict, start: float, recorder: SessionRecorder):
+        self._inner = inner
+        self._entry = entry
+        self._start = start
+        self._recorder = recorder
+        self._written = False
+
+    def __iter__(self):
+        try:
+            for data in self._inner:
+                self._entry["chunks"].append(_encode_chunk(time.perf_counter() - self._start, data))
+                yield data
+        except Exception as e:
+            self._entry["error"] = str(e)
+            raise
+
+    def close(self):
+        try:
+            self._inner.close()
+        finally:
+            if not self._written:
+                self._written = True
+                self._entry["total_time"] = round(time.perf_counter() - self._start, 6)
+                self._recorder.record_exchange(self._entry)
+
+
+class RecordingTransport(httpx.BaseTransport):
+    """把请求交给真实的传输层，并录制请求和响应"""
+
+    def __init__(self, inner: httpx.BaseTransport, recorder: SessionRecorder):
+        self._inner = inner
+        self._recorder = recorder
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        content = request.read()
+        body = _parse_body(content)
+        entry = {
+            "type": "http",
+            "t": self._recorder.offset(),
+            "method": request.method,
+            "url": str(request.url.copy_with(query=None)),
+            "path": request.url.path,
+            "key": _request_key(request.method, request.url.path, content),
+            "stream": _is_stream(content),
+            "request": body if body is not None else base64.b64encode(content).decode("ascii"),
+            "chunks": [],
+        }
+        start = time.perf_counter()
+        try:
+            response = self._inner.handle_request(request)
+        except Exception as e:
+            entry.update(error=f"{type(e).__name__}: {e}", total_time=round(time.perf_counter() - start, 6))
+            self._recorder.record_exchange(entry)
+            raise
+
+        entry["status"] = response.status_code
+        entry["headers"] = {name: value for name, value in response.headers.items()
+                            if name.lower() in ("content-type", "content-encoding")}
+        entry["header_latency"] = round(time.perf_counter() - start, 6)
+        response.stream = _RecordingStream(response.stream, entry, start, self._recorder)
+        return response
+
+    def close(self):
+        self._inner.close()
+
+
+class _ReplayStream(httpx.SyncByteStream):
+    """按录制时的到达时间（除以回放速度）输出响应分块"""
+
+    def __init__(self, chunks: list, speed: float, start: float):
+        self._chunks = chunks
+        self._speed = speed
+        self._start = start
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            if self._speed > 0:
+                wait = chunk["o"] / self._speed - (time.perf_counter() - self._start)
+                if wait > 0:
+                    time.sleep(wait)
+            yield _decode_chunk(chunk)
+
+
+class ReplayTransport(httpx.BaseTransport):
+    """从会话文件回放响应，不连接网络"""
+
+    def __init__(self, path: str, speed: float = 1.0):
+        self.path = path
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._by_key = {}
+        self._by_route = {}
+        self.stats = {"requests": 0, "exact_matches": 0, "fallback_matches": 0, "misses": 0}
+
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry.get("type") == "http":
+                    entry["used"] = False
+                    self._by_key.setdefault(entry["key"], deque()).append(entry)
+                    route = (entry["method"], entry["path"], entry.get("stream", False))
+                    self._by_route.setdefault(route, deque()).append(entry)
+        print(f"📼 从 {path} 回放上游API流量（{sum(len(q) for q in self._by_key.values())} 条记录，"
+              f"速度 {'不限' if speed <= 0 else f'{speed}x'}）")
+
+    @staticmethod
+    def _take(queue: deque):
+        while queue:
+            entry = queue.popleft()
+            if not entry["used"]:
+                entry["used"] = True
+                return entry
+        return None
+
+    def _match(self, method: str, path: str, content: bytes):
+        with self._lock:
+            self.stats["requests"] += 1
+            entry = self._take(self._by_key.get(_request_key(method, path, content), deque()))
+            if entry is not None:
+                self.stats["exact_matches"] += 1
+                return entry
+            entry = self._take(self._by_route.get((method, path, _is_stream(content)), deque()))
+            if entry is not None:
+                self.stats["fallback_matches"] += 1
+                return entry
+            self.stats["misses"] += 1
+            return None
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        content = request.read()
+        entry = self._match(request.method, request.url.path, content)
+        if entry is None:
+            return httpx.Response(599, json={"error": {"message": f"回放会话中没有 {request.url.path} 的记录"}},
+                                  request=request)
+
+        start = time.perf_counter()
+        if entry.get("error"):
+            if self.speed > 0:
+                time.sleep(entry.get("total_time", 0.0) / self.speed)
+            raise httpx.TransportError(f"[回放] {entry['error']}")
+        if self.speed > 0:
+            time.sleep(entry.get("header_latency", 0.0) / self.speed)
+        return httpx.Response(entry["status"], headers=entry.get("headers") or {},
+                              stream=_ReplayStream(entry["chunks"], self.speed, start), request=request)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["unused"] = sum(1 for queue in self._by_key.values() for entry in queue if not entry["used"])
+        return stats
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    """录制模式下返回（首次调用时创建）会话录制器，其他模式返回 None"""
+    global _recorder
+    settings = get_settings()
+    if settings.get("mode", "off") != "record":
+        return None
+    with _recorder_lock:
+        if _recorder is None:
+            path = settings.get("session_file") or os.path.join(
+                settings.get("directory", TRAFFIC_DIR), f"session_{datetime.now():%Y%m%d_%H%M%S}.jsonl")
+            _recorder = SessionRecorder(path)
+            metrics.register_collector("traffic", lambda: dict(_recorder.stats))
+        return _recorder
+
+
+def build_transport(inner: httpx.BaseTransport) -> httpx.BaseTransport:
+    """按配置包装传输层：record 时录制，replay 时改为回放，其他情况原样返回"""
+    settings = get_settings()
+    mode = settings.get("mode", "off")
+    if mode == "record":
+        return RecordingTransport(inner, get_recorder())
+    if mode == "replay":
+        path = settings.get("session_file")
+        if not path or not os.path.exists(path):
+            print(f"⚠️ 回放会话文件不存在: {path}，改为直接请求上游API")
+            return inner
+        inner.close()
+        replay = ReplayTransport(path, settings.get("replay_speed", 1.0))
+        metrics.register_collector("traffic", replay.get_stats)
+        return replay
+    return inner
+
+
+def record_input(text: str):
+    """录制模式下记录一条用户输入（回放时用来驱动同样的对话）"""
+    recorder = get_recorder()
+    if recorder is not None:
+        recorder.record_input(text)
+
+
+def load_session_inputs(path: str) -> list:
+    """读取会话文件中录制的用户输入"""
+    inputs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                if entry.get("type") == "input":
+                    inputs.append(entry["text"])
+    return inputs
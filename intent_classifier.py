@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地意图分类器
+用字符 n-gram 特征 + NumPy 逻辑回归在本地判断用户输入是闲聊（chat）还是需要执行代码（code），
+置信度足够高时直接给出结果，省掉一次远程的判断请求；置信度不足时交回大模型判断。
+
+训练数据来自 chat_history.json 中记录的 type 字段和 intent_seed.json 中的种子样本。
+
+用法（在项目根目录运行）：
+    python intent_classifier.py --train     # 重新训练并保存模型
+    python intent_classifier.py --report    # 输出交叉验证准确率、置信覆盖率和推理延迟
+    python intent_classifier.py "帮我打开记事本"
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+import zlib
+
+import numpy as np
+
+SEED_FILE = "intent_seed.json"
+HISTORY_FILE = "chat_history.json"
+MODEL_FILE = "intent_model.npz"
+
+LABELS = ("chat", "code")
+# chat_history.json 中的对话类型与分类标签的对应关系（图片分析等其他类型不参与训练）
+HISTORY_TYPE_LABELS = {"chat": "chat", "code_execution": "code"}
+
+NGRAM_RANGE = (1, 3)
+FEATURE_DIM = 1 << 14
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def extract_features(text: str, dim: int = FEATURE_DIM) -> np.ndarray:
+    """把文本转成哈希后的字符 n-gram 特征向量（L2 归一化）"""
+    vector = np.zeros(dim, dtype=np.float32)
+    text = f"^{_normalize(text)}$"
+    for n in range(NGRAM_RANGE[0], NGRAM_RANGE[1] + 1):
+        for i in range(len(text) - n + 1):
+            # crc32 在不同进程间结果稳定，保证保存的模型可以复用
+            index = zlib.crc32(text[i:i + n].encode("utf-8")) % dim
+            vector[index] += 1.0
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+
+def load_training_data(seed_file: str = SEED_FILE, history_file: str = HISTORY_FILE) -> tuple[list, list]:
+    """读取种子样本和历史记录，返回 (文本列表, 标签列表)"""
+    texts, labels = [], []
+
+    if os.path.exists(seed_file):
+        try:
+            with open(seed_file, 'r', encoding='utf-8') as f:
+                for example in json.load(f).get("examples", []):
+                    if example.get("label") in LABELS and example.get("text"):
+                        texts.append(example["text"])
+                        labels.append(example["label"])
+        except Exception as e:
+            print(f"⚠️ 读取意图种子数据失败: {e}")
+
+    if os.path.exists(history_file):
+        try:
+            with open(history_file, 'r', encoding='utf-8') as f:
+                for record in json.load(f):
+                    label = HISTORY_TYPE_LABELS.get(record.get("type"))
+                    if label and record.get("user_input"):
+                        texts.append(record["user_input"])
+                        labels.append(label)
+        except Exception as e:
+            print(f"⚠️ 读取历史记录训练数据失败: {e}")
+
+    return texts, labels
+
+
+class IntentClassifier:
+    """字符 n-gram 逻辑回归分类器"""
+
+    def __init__(self, dim: int = FEATURE_DIM):
+        self.dim = dim
+        self.weights = None
+        self.bias = 0.0
+
+    @property
+    def is_trained(self) -> bool:
+        return self.weights is not None
+
+    def fit(self, texts: list, labels: list, epochs: int = 500, learning_rate: float = 2.0,
+            l2: float = 1e-5) -> "IntentClassifier":
+        """用全批量梯度下降训练逻辑回归"""
+        features = np.stack([extract_features(text, self.dim) for text in texts])
+        targets = np.array([LABELS.index(label) for label in labels], dtype=np.float32)
+
+        weights = np.zeros(self.dim, dtype=np.float32)
+        bias = 0.0
+        count = len(texts)
+        for _ in range(epochs):
+            probabilities = 1.0 / (1.0 + np.exp(-(features @ weights + bias)))
+            error = probabilities - targets
+            weights -= learning_rate * (features.T @ error / count + l2 * weights)
+            bias -= learning_rate * float(error.mean())
+
+        self.weights = weights
+        self.bias = bias
+        return self
+
+    def predict_proba(self, text: str) -> float:
+        """返回输入属于 code 的概率"""
+        score = float(extract_features(text, self.dim) @ self.weights + self.bias)
+        return 1.0 / (1.0 + np.exp(-score))
+
+    def predict(self, text: str) -> tuple[str, float]:
+        """返回 (标签, 置信度)"""
+        code_probability = self.predict_proba(text)
+        if code_probability >= 0.5:
+            return "code", code_probability
+        return "chat", 1.0 - code_probability
+
+    def save(self, path: str = MODEL_FILE):
+        """先写临时文件再替换，其他进程或线程不会读到写了一半的模型"""
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                np.savez(f, weights=self.weights, bias=np.array([self.bias]), dim=np.array([self.dim]))
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @classmethod
+    def load(cls, path: str = MODEL_FILE) -> "IntentClassifier":
+        data = np.load(path)
+        classifier = cls(dim=int(data["dim"][0]))
+        classifier.weights = data["weights"]
+        classifier.bias = float(data["bias"][0])
+        return classifier
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+# 训练和首次加载模型时持有，保证首个请求和预热线程同时需要模型时只训练一次
+_train_lock = threading.Lock()
+
+
+def train_classifier(save: bool = True) -> IntentClassifier:
+    """用种子数据和历史记录重新训练模型"""
+    with _train_lock:
+        return _train(save)
+
+
+def _train(save: bool) -> IntentClassifier:
+    global _classifier
+    texts, labels = load_training_data()
+    classifier = IntentClassifier().fit(texts, labels)
+    if save:
+        try:
+            classifier.save()
+        except Exception as e:
+            print(f"⚠️ 保存意图分类模型失败: {e}")
+    with _classifier_lock:
+        _classifier = classifier
+    print(f"✅ 意图分类器训练完成，样本数: {len(texts)}")
+    return classifier
+
+
+def get_classifier() -> IntentClassifier:
+    """获取全局分类器：优先加载已保存的模型，没有则现场训练"""
+    global _classifier
+    with _classifier_lock:
+        if _classifier is not None:
+            return _classifier
+    with _train_lock:
+        # 等锁期间其他线程可能已经加载或训练好了
+        with _classifier_lock:
+            if _classifier is not None:
+                return _classifier
+        if os.path.exists(MODEL_FILE):
+            try:
+                classifier = IntentClassifier.load()
+                with _classifier_lock:
+                    _classifier = classifier
+                return classifier
+            except Exception as e:
+                print(f"⚠️ 加载意图分类模型失败，重新训练: {e}")
+        return _train(save=True)
+
+
+def classify_intent(text: str, threshold: float) -> str:
+    """
+    本地判断用户输入的类型
+
+    Returns:
+        置信度不低于 threshold 时返回 "chat" / "code"，否则返回 None（交给大模型判断）
+    """
+    try:
+        label, confidence = get_classifier().predict(text)
+    except Exception as e:
+        print(f"⚠️ 本地意图分类失败: {e}")
+        return None
+    return label if confidence >= threshold else None
+
+
+def evaluate(texts: list, labels: list, folds: int = 5, threshold: float = 0.9) -> dict:
+    """k 折交叉验证：整体准确率、置信样本的覆盖率和准确率，以及单次推理延迟"""
+    indices = np.random.default_rng(0).permutation(len(texts))
+    correct = confident = confident_correct = 0
+    latencies = []
+
+    for fold in range(folds):
+        test_indices = set(indices[fold::folds].tolist())
+        train_texts = [texts[i] for i in range(len(texts)) if i not in test_indices]
+        train_labels = [labels[i] for i in range(len(texts)) if i not in test_indices]
+        classifier = IntentClassifier().fit(train_texts, train_labels)
+
+        for i in test_indices:
+            start_time = time.perf_counter()
+            label, confidence = classifier.predict(texts[i])
+            latencies.append(time.perf_counter() - start_time)
+            correct += label == labels[i]
+            if confidence >= threshold:
+                confident += 1
+                confident_correct += label == labels[i]
+
+    total = len(texts)
+    return {
+        "samples": total,
+        "accuracy": correct / total if total else 0.0,
+        "coverage": confident / total if total else 0.0,
+        "confident_accuracy": confident_correct / confident if confident else 0.0,
+        "avg_latency_us": float(np.mean(latencies)) * 1e6 if latencies else 0.0,
+        "p99_latency_us": float(np.percentile(latencies, 99)) * 1e6 if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地意图分类器")
+    parser.add_argument("--train", action="store_true", help="重新训练并保存模型")
+    parser.add_argument("--report", action="store_true", help="输出准确率和延迟报告")
+    parser.add_argument("--threshold", type=float, default=None, help="置信度阈值（默认读取配置）")
+    parser.add_argument("text", nargs="*", help="要分类的文本")
+    args = parser.parse_args()
+
+    threshold = args.threshold
+    if threshold is None:
+        from config_loader import get_performance_config
+        threshold = get_performance_config().get("local_classifier_threshold", 0.9)
+
+    if args.train:
+        train_classifier()
+
+    if args.report:
+        texts, labels = load_training_data()
+        report = evaluate(texts, labels, threshold=threshold)
+        print(f"样本数: {report['samples']}")
+        print(f"交叉验证准确率: {report['accuracy']:.2%}")
+        print(f"置信度 ≥ {threshold} 的覆盖率: {report['coverage']:.2%}，其中准确率: {report['confident_accuracy']:.2%}")
+        print(f"单次推理延迟: 平均 {report['avg_latency_us']:.1f} µs，p99 {report['p99_latency_us']:.1f} µs")
+
+    if args.text:
+        text = " ".join(args.text)
+        label, confidence = get_classifier().predict(text)
+        decision = label if confidence >= threshold else "交给大模型判断"
+        print(f"{text} -> {label} (置信度 {confidence:.3f}) => {decision}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+流式JSON字段提取器
+在大模型逐字返回 JSON 时，增量解析顶层字符串字段，
+让 reply / maid_response 等字段无需等到整段 JSON 结束就能先显示出来
+"""
+
+from typing import Callable, Dict, Iterable, Optional
+
+_ESCAPES = {
+    '"': '"',
+    '\\': '\\',
+    '/': '/',
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+}
+
+
+class IncrementalJSONFieldExtractor:
+    """
+    增量提取 JSON 对象中顶层字符串字段的值
+
+    只跟踪需要的字段，其余内容只做括号与字符串状态的跟踪，
+    可以容忍 ```json 代码块标记等前缀噪声（在第一个 { 之前的内容会被忽略）。
+    """
+
+    def __init__(self, fields: Iterable[str],
+                 on_partial: Optional[Callable[[str, str], None]] = None,
+                 on_complete: Optional[Callable[[str, str], None]] = None):
+        """
+        Args:
+            fields: 需要提取的顶层字段名
+            on_partial: 字段值增长时的回调 (字段名, 当前已解析的文本)
+            on_complete: 字段值解析完成时的回调 (字段名, 完整文本)
+        """
+        self.fields = set(fields)
+        self.on_partial = on_partial
+        self.on_complete = on_complete
+
+        self.values: Dict[str, str] = {}
+        self.completed: Dict[str, str] = {}
+
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._unicode_buffer = None
+        self._string_is_key = False
+        self._buffer = []
+        self._last_key = None
+        self._expect_value = False
+        self._current_field = None
+
+    def feed(self, chunk: str):
+        """喂入新到达的文本片段"""
+        if not chunk:
+            return
+        grown = False
+        for ch in chunk:
+            if self._in_string:
+                grown |= self._feed_string_char(ch)
+                continue
+
+            if ch == '{' or ch == '[':
+                self._depth += 1
+                self._expect_value = False
+            elif ch == '}' or ch == ']':
+                self._depth = max(0, self._depth - 1)
+            elif ch == '"' and self._depth > 0:
+                self._start_string()
+            elif ch == ':' and self._depth == 1:
+                self._expect_value = True
+            elif ch == ',' and self._depth == 1:
+                self._expect_value = False
+                self._last_key = None
+
+        if grown and self._current_field and self.on_partial:
+            self.on_partial(self._current_field, self.values[self._current_field])
+
+    def _start_string(self):
+        self._in_string = True
+        self._escape = False
+        self._buffer = []
+        # 顶层对象中，冒号之前的字符串是键，之后的是值
+        self._string_is_key = self._depth == 1 and not self._expect_value
+        if (self._depth == 1 and self._expect_value and self._last_key in self.fields):
+            self._current_field = self._last_key
+            self.values[self._current_field] = ""
+        else:
+            self._current_field = None
+
+    def _feed_string_char(self, ch: str) -> bool:
+        """处理字符串内部的字符，返回被跟踪字段是否有新内容"""
+        if self._unicode_buffer is not None:
+            self._unicode_buffer += ch
+            if len(self._unicode_buffer) < 4:
+                return False
+            try:
+                decoded = chr(int(self._unicode_buffer, 16))
+            except ValueError:
+                decoded = ""
+            self._unicode_buffer = None
+            return self._append(decoded)
+
+        if self._escape:
+            self._escape = False
+            if ch == 'u':
+                self._unicode_buffer = ""
+                return False
+            return self._append(_ESCAPES.get(ch, ch))
+
+        if ch == '\\':
+            self._escape = True
+            return False
+
+        if ch == '"':
+            self._end_string()
+            return False
+
+        return self._append(ch)
+
+    def _append(self, text: str) -> bool:
+        if not text:
+            return False
+        self._buffer.append(text)
+        if self._current_field:
+            self.values[self._current_field] += text
+            return True
+        return False
+
+    def _end_string(self):
+        self._in_string = False
+        text = "".join(self._buffer)
+        self._buffer = []
+        if self._string_is_key:
+            self._last_key = text
+            return
+
+        if self._current_field:
+            field = self._current_field
+            self._current_field = None
+            self.completed[field] = self.values[field]
+            if self.on_partial:
+                self.on_partial(field, self.values[field])
+            if self.on_complete:
+                self.on_complete(field, self.values[field])
+        self._expect_value = False
+
+    def get(self, field: str, default: str = None) -> Optional[str]:
+        """获取字段当前（可能尚未完整的）值"""
+        return self.values.get(field, default)
@@ -0,0 +1,161 @@
+"""
+LLM客户端管理器
+在进程内复用同一个 HTTP 连接池，每个 (base_url, api_key) 对应的 OpenAI 客户端只构建一次，
+避免每次调用都重新握手。多个端点共用同一个连接池。
+超时、重试（performance_settings.resilience）或流量录制（performance_settings.traffic）的配置改变后，
+下一次请求时按新配置重建连接池和客户端，不需要重启。
+"""
+
+import json
+import threading
+import time
+
+import httpx
+from openai import OpenAI
+
+DEFAULT_BASE_URL = 'https://www.dmxapi.cn/v1'
+DEFAULT_MODEL = 'Doubao-1.5-pro-32k'
+
+
+class LLMClientManager:
+    """进程级的 LLM 客户端管理器"""
+
+    def __init__(self, max_connections: int = 10, max_keepalive_connections: int = 5,
+                 keepalive_expiry: float = 120.0):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._clients = {}
+        self._http_client = None
+        self._client_signature = None
+        # 最近一次用户请求（不含预热请求）发出的时间（monotonic），供空闲保活判断
+        self.last_request_at = 0.0
+
+        self.stats = {
+            "client_builds": 0,        # 客户端（连接池）构建次数
+            "http_client_rebuilds": 0, # 配置改变后重建连接池的次数
+            "client_reuses": 0,        # 复用已有客户端的次数
+            "requests": 0,             # 经过连接池发出的HTTP请求数
+            "tcp_connects": 0,         # 新建TCP连接次数
+            "tls_handshakes": 0,       # TLS握手次数
+            "connection_reuses": 0,    # 复用已有连接的请求数
+        }
+
+    def get_settings(self) -> tuple[str, str, str]:
+        """
+        获取当前的 API 配置（配置文件按修改时间缓存，不会每次读盘）
+
+        Returns:
+            (base_url, api_key, model)
+        """
+        from config_loader import load_maid_config
+        api_config = load_maid_config().get('api_config', {})
+        base_url = api_config.get('base_url') or DEFAULT_BASE_URL
+        api_key = api_config.get('api_key', '')
+        model = api_config.get('model', DEFAULT_MODEL)
+        return base_url, api_key, model
+
+    def _trace(self, event_name: str, info: dict):
+        """httpcore 的连接追踪回调，用于统计握手和连接复用"""
+        if event_name == "connection.connect_tcp.started":
+            self._count("tcp_connects")
+        elif event_name == "connection.start_tls.started":
+            self._count("tls_handshakes")
+
+    def _on_request(self, request: httpx.Request):
+        """为每个请求挂上追踪回调"""
+        request.extensions["trace"] = self._trace
+        self._count("requests")
+        if not request.extensions.get("warmup"):
+            self.last_request_at = time.monotonic()
+
+    def _count(self, name: str, amount: int = 1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    @staticmethod
+    def get_timeout_settings() -> dict:
+        """读取超时和重试配置（performance_settings.resilience）"""
+        from config_loader import get_performance_config
+        return get_performance_config().get("resilience") or {}
+
+    def _build_http_client(self) -> httpx.Client:
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        # 设置明确的超时，避免上游卡住时工作线程永远阻塞
+        settings = self.get_timeout_settings()
+        timeout = httpx.Timeout(settings.get("request_timeout", 60.0), connect=settings.get("connect_timeout", 5.0))
+        # 开启流量录制 / 回放时（performance_settings.traffic）在传输层上包一层
+        from http_recorder import build_transport
+        transport = build_transport(httpx.HTTPTransport(limits=limits))
+        return httpx.Client(timeout=timeout, transport=transport, event_hooks={"request": [self._on_request]})
+
+    def _settings_signature(self) -> str:
+        """影响连接池和客户端构建的配置（超时、重试、流量录制）"""
+        from http_recorder import get_settings as get_traffic_settings
+        return json.dumps([self.get_timeout_settings(), get_traffic_settings()], sort_keys=True, default=str)
+
+    def _get_http_client(self) -> httpx.Client:
+        signature = self._settings_signature()
+        with self._lock:
+            if self._http_client is None or signature != self._client_signature:
+                if self._http_client is not None:
+                    # 旧连接池上可能还有进行中的请求（流式回复等），不主动关闭，随引用释放
+                    self._count("http_client_rebuilds")
+                    self._clients = {}
+                self._http_client = self._build_http_client()
+                self._client_signature = signature
+            return self._http_client
+
+    def get_client(self, base_url: str = None, api_key: str = None) -> OpenAI:
+        """
+        获取指定端点的共享 OpenAI 客户端，不传参数时使用 api_config 中的主端点
+        """
+        if base_url is None:
+            base_url, api_key, _ = self.get_settings()
+        client_key = (base_url, api_key)
+        http_client = self._get_http_client()
+
+        with self._lock:
+            client = self._clients.get(client_key)
+            if client is not None:
+                self._count("client_reuses")
+                return client
+
+            # 重试交给端点池的故障转移处理，客户端自身只做少量重试
+            max_retries = self.get_timeout_settings().get("max_retries", 1)
+            client = OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=max_retries)
+            self._clients[client_key] = client
+            self._count("client_builds")
+            return client
+
+    @property
+    def http_client(self) -> httpx.Client:
+        """共享的 HTTP 连接池，供 TTS、图片识别等原始请求复用"""
+        return self._get_http_client()
+
+    def get_stats(self) -> dict:
+        """获取连接复用统计"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["connection_reuses"] = max(0, stats["requests"] - stats["tcp_connects"])
+        return stats
+
+    def close(self):
+        """关闭连接池"""
+        with self._lock:
+            if self._http_client is not None:
+                self._http_client.close()
+            self._clients = {}
+            self._http_client = None
+            self._client_signature = None
+
+
+# 全局客户端管理器实例
+client_manager = LLMClientManager()
@@ -0,0 +1,675 @@
+"""
+女仆系统的请求处理流程（不依赖 Qt）
+路由 → 代码库匹配 → 代码生成 → 执行（失败时分析并重写）→ 结果反馈。
+界面相关的操作都通过传入的 processor（PRImageProcessor 或 headless.NullProcessor 等）完成，
+因此既可以在桌面程序中使用，也可以在无界面的批处理、基准测试中使用。
+"""
+
+import os
+import importlib.util
+from pathlib import Path
+import random
+import prompt
+from call_ai import get_ai_response, get_ai_reply
+from routing import route_user_input
+from pipeline import stage_runner
+from scheduler import stage_memo
+from tracing import span, start_trace, finish_trace
+from http_recorder import record_input
+from chat_history import chat_history
+import json
+
+# 使用 Path 对象统一处理路径
+CODE_FOLDER = Path("./py").resolve()
+
+
+def analyze_code_error(error_msg: str, code_content: str) -> str:
+    """
+    分析代码错误，提供改进建议
+    """
+    try:
+        analysis_prompt = f"""
+请分析以下Python代码的错误，并提供具体的修复建议：
+
+错误信息：{error_msg}
+
+代码内容：
+{code_content}
+
+请提供：
+1. 错误原因分析
+2. 具体的修复建议
+3. 改进后的代码示例（如果需要）
+
+请用中文回答，格式要清晰。
+"""
+        
+        analysis_result = get_ai_response(analysis_prompt, "code_analysis", include_history=False, save_to_history=False,
+                                          stage="analyze")
+        return analysis_result
+    except Exception as e:
+        return f"错误分析失败: {str(e)}"
+
+
+def validate_code_syntax(code_content: str) -> tuple[bool, str]:
+    """
+    验证代码语法是否正确
+    返回: (是否有效, 错误信息)
+    """
+    try:
+        compile(code_content, '<string>', 'exec')
+        return True, ""
+    except SyntaxError as e:
+        return False, f"语法错误: {str(e)}"
+    except Exception as e:
+        return False, f"代码验证错误: {str(e)}"
+
+
+def get_function_list() -> dict:
+    """
+    获取函数列表，格式：{"a.py":["参数1描述","参数2描述"...]...}
+    """
+    function_dict = {}
+
+    if not CODE_FOLDER.exists():
+        return function_dict
+
+    for filename in os.listdir(CODE_FOLDER):
+        if filename.endswith('.py'):
+            json_filename = filename.replace('.py', '.json')
+            json_path = CODE_FOLDER / json_filename
+
+            if json_path.exists():
+                try:
+                    with open(json_path, 'r', encoding='utf-8') as f:
+                        json_data = json.load(f)
+                        args_doc = json_data.get('args_doc', [])
+                        function_dict[filename] = args_doc
+                except (json.JSONDecodeError, KeyError):
+                    continue
+
+    return function_dict
+
+
+def pre_check_code_file(file_path: str, func_name: str) -> tuple[bool, str]:
+    """
+    在代码执行前进行预检查
+    返回: (是否通过检查, 检查结果信息)
+    """
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            code_content = f.read()
+        
+        # 检查代码是否为空
+        if not code_content.strip():
+            return False, "代码文件为空"
+        
+        # 检查语法
+        syntax_valid, syntax_error = validate_code_syntax(code_content)
+        if not syntax_valid:
+            return False, f"语法检查失败: {syntax_error}"
+        
+        # 检查是否包含main函数
+        if "def main" not in code_content and "def main(" not in code_content:
+            return False, "代码缺少main函数"
+        
+        # 检查是否有明显的导入错误
+        if "import " in code_content or "from " in code_content:
+            # 这里可以添加更复杂的导入检查逻辑
+            pass
+        
+        return True, "代码预检查通过"
+        
+    except Exception as e:
+        return False, f"预检查过程出错: {str(e)}"
+
+
+def run_python_function_from_file(file_path: str, func_name: str, args_list: list = None) -> tuple[str, bool]:
+    """
+    从文件中运行Python函数，支持传入参数列表
+    返回: (执行结果, 是否成功)
+    """
+    try:
+        # 执行前预检查
+        with span("precheck"):
+            pre_check_result, pre_check_msg = pre_check_code_file(file_path, func_name)
+        if not pre_check_result:
+            return f"代码预检查失败: {pre_check_msg}", False
+        
+        spec = importlib.util.spec_from_file_location("dynamic_module", file_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        if hasattr(module, func_name):
+            func = getattr(module, func_name)
+            result = func(*args_list) if args_list else func()
+            return str(result), True
+        else:
+            return f"函数 {func_name} 不存在", False
+    except Exception as e:
+        error_msg = f"执行错误: {str(e)}"
+        print(f"代码执行失败: {error_msg}")
+        return error_msg, False
+
+
+def delete_code_file(func_name: str) -> bool:
+    """
+    删除指定的代码文件
+    返回: 是否删除成功
+    """
+    try:
+        clean_func_name = Path(func_name).stem
+        py_path = CODE_FOLDER / f"{clean_func_name}.py"
+        json_path = CODE_FOLDER / f"{clean_func_name}.json"
+        
+        # 删除Python文件
+        if py_path.exists():
+            py_path.unlink()
+            print(f"已删除Python文件: {py_path}")
+        
+        # 删除JSON文件
+        if json_path.exists():
+            json_path.unlink()
+            print(f"已删除JSON文件: {json_path}")
+        
+        return True
+    except Exception as e:
+        print(f"删除文件失败: {e}")
+        return False
+
+
+def rewrite_code_with_retry(task_summary: str, func_name: str, retry_count: int, processor, previous_error: str = "", previous_code: str = "") -> tuple[str, str, list, bool]:
+    """
+    重写代码，支持重试机制，集成错误分析和语法验证
+    返回: (新代码, 新函数名, 参数列表, 是否成功)
+    """
+    try:
+        # 写代码相关：使用配置的动画设置
+        coding_config = get_animation_config("写代码中")
+        folder = coding_config.get('folder', 'coding')
+        scale_factor = coding_config.get('scale_factor', 1.0)
+        play_speed = coding_config.get('play_speed', 32.0)
+        processor.play(folder, scale_factor=scale_factor, loop=True, play_speed=play_speed)
+        
+        retry_message = f"第{retry_count}次重试生成代码中..." if retry_count > 1 else "正在为主人生成新代码呢~"
+        processor.show_timed_dialog(retry_message, "生成中...")
+        
+        # 在重试时，给AI更明确的提示
+        enhanced_prompt = prompt.CODE_GENERATION_PROMPT.format(task_summary=task_summary)
+        
+        if retry_count > 1 and previous_error and previous_code:
+            # 分析之前的错误
+            error_analysis = analyze_code_error(previous_error, previous_code)
+            enhanced_prompt += f"\n\n注意：这是第{retry_count}次重试。之前的代码执行失败，错误信息：{previous_error}"
+            enhanced_prompt += f"\n\n错误分析：{error_analysis}"
+            enhanced_prompt += f"\n\n请根据以上分析，生成能够正确执行的代码，避免之前的错误。"
+        elif retry_count > 1:
+            enhanced_prompt += f"\n\n注意：这是第{retry_count}次重试，请确保代码能够正确执行，避免之前的错误。"
+        
+        code_result = get_ai_response(enhanced_prompt, "code_execution", include_history=False, save_to_history=False,
+                                      stage="generate")
+
+        try:
+            code_dict = json.loads(code_result)
+            print(f"代码生成结果 (重试{retry_count}): {code_dict}")
+        except json.JSONDecodeError as e:
+            print(f"JSON解析错误 (重试{retry_count}): {e}")
+            print(f"原始结果: {code_result}")
+            return "", "", [], False
+
+        new_func_name = code_dict.get("function_name")
+        code = code_dict.get("code")
+        args_doc = code_dict.get("args_doc", [])
+        current_inputs = code_dict.get("current_inputs", [])
+        
+        if not new_func_name or not code:
+            print(f"数据不完整 (重试{retry_count}) - func_name: {bool(new_func_name)}, code: {bool(code)}")
+            return "", "", [], False
+
+        # 验证代码语法
+        syntax_valid, syntax_error = validate_code_syntax(code)
+        if not syntax_valid:
+            print(f"代码语法错误 (重试{retry_count}): {syntax_error}")
+            processor.show_timed_dialog(f"生成的代码有语法错误，正在重新生成...", "重写中...")
+            return "", "", [], False
+
+        # 验证生成的代码是否包含必要的函数
+        if "def main" not in code and "def main(" not in code:
+            print(f"生成的代码缺少main函数 (重试{retry_count})")
+            processor.show_timed_dialog("生成的代码格式不正确，正在重新生成...", "重写中...")
+            return "", "", [], False
+
+        # 保存新代码
+        CODE_FOLDER.mkdir(exist_ok=True)
+        clean_func_name = Path(new_func_name).stem
+        py_path = CODE_FOLDER / f"{clean_func_name}.py"
+        json_path = CODE_FOLDER / f"{clean_func_name}.json"
+        
+        try:
+            with open(py_path, "w", encoding="utf-8") as f:
+                f.write(code)
+            print(f"Python文件保存成功 (重试{retry_count}): {py_path}")
+        except Exception as e:
+            print(f"保存Python文件失败 (重试{retry_count}): {e}")
+            return "", "", [], False
+
+        try:
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump({"function_name": new_func_name, "args_doc": args_doc}, f, ensure_ascii=False, indent=2)
+            print(f"JSON文件保存成功 (重试{retry_count}): {json_path}")
+        except Exception as e:
+            print(f"保存JSON文件失败 (重试{retry_count}): {e}")
+            # 删除已保存的Python文件
+            if py_path.exists():
+                py_path.unlink()
+            return "", "", [], False
+
+        return code, new_func_name, current_inputs if current_inputs else [], True
+        
+    except Exception as e:
+        print(f"重写代码失败 (重试{retry_count}): {e}")
+        return "", "", [], False
+
+
+# 会话状态（目前只有待补充信息的请求 pending_additional_data）；
+# 桌面程序只有一个会话，不传 session 时使用这个默认会话
+_default_session = {}
+
+
+def load_animation_settings():
+    """加载动画设置配置"""
+    try:
+        # 配置文件有修改时 load_maid_config 会按修改时间自动重新读取
+        from config_loader import load_maid_config
+        load_maid_config()
+        return True
+    except Exception as e:
+        print(f"⚠️ 加载动画配置失败: {e}")
+        return False
+
+
+def get_animation_config(scene_name):
+    """获取指定场景的动画配置"""
+    try:
+        # 配置文件有修改时 load_maid_config 会按修改时间自动重新读取，这里不必强制重新加载
+        from config_loader import get_animation_config as get_config
+        return get_config(scene_name)
+    except Exception as e:
+        print(f"⚠️ 获取动画配置失败: {e}")
+        return {}
+
+
+def get_random_normal_audio():
+    """获取随机的普通反馈音频"""
+    # 从配置中获取普通反馈的文件夹列表
+    normal_config = get_animation_config("普通反馈")
+    if normal_config and 'folders' in normal_config:
+        normal_audios = normal_config['folders']
+    else:
+        # 默认配置
+        normal_audios = ["happyTalk", "politeTalk", "DanceWhileTalk"]
+    
+    return random.choice(normal_audios)
+
+
+def maid_handle_input(user_input: str, processor, on_partial=None, session: dict = None) -> tuple[str, str]:
+    """
+    同步处理一次用户输入（在阶段调度器上执行并等待结果）
+
+    Args:
+        user_input: 用户输入
+        processor: 动画/对话框处理器
+        on_partial: 可选回调，流式模式下收到部分回复文本时调用
+        session: 会话状态字典，不传则使用默认会话
+
+    Returns:
+        (女仆的回复, 语气)
+    """
+    trace = start_trace("request", user_input=user_input)
+    try:
+        return stage_runner.run(lambda: maid_handle_input_async(user_input, processor, on_partial, session),
+                                trace=trace)
+    finally:
+        finish_trace(trace)
+
+
+async def maid_handle_input_async(user_input: str, processor, on_partial=None,
+                                  session: dict = None) -> tuple[str, str]:
+    """
+    处理一次用户输入的阶段图：路由 → 代码库匹配 → 代码生成 → 执行（失败时分析并重写）→ 结果反馈
+
+    每个阻塞阶段都通过 stage_runner.run_stage 执行，请求被取消时在阶段之间立即停止
+    """
+    if session is None:
+        session = _default_session
+
+    # 开启流量录制时记下原始输入，回放时用来重放同样的对话
+    record_input(user_input)
+
+    # 如果之前有待补充信息的请求，将用户输入拼接
+    pending = session.pop("pending_additional_data", None)
+    if pending is not None:
+        original_input = pending["original_input"]
+        need_additional_data = pending["need_additional_data"]
+        # 拼接：第一次输入 + need_additional_data + 第二次输入
+        user_input = f"{original_input}\n{need_additional_data}\n{user_input}"
+
+    # 之前被取消的同一输入已经完成路由时直接复用（聊天历史变化后失效）
+    route = await stage_runner.run_stage("route", stage_memo.run, "route", user_input,
+                                         route_user_input, user_input, on_partial)
+
+    if route is None:
+        # 错误情况：使用配置的动画设置
+        error_config = get_animation_config("错误情况")
+        folder = error_config.get('folder', 'bowWhileTalk')
+        scale_factor = error_config.get('scale_factor', 1.0)
+        play_speed = error_config.get('play_speed', 3.0)
+        processor.play(folder, scale_factor=scale_factor, loop=True, play_speed=play_speed)
+        return "回答解析失败", "Speak in a cheerful and positive tone."
+
+    if route["a"] == "chat":
+        maid_response = route["reply"]
+        tone = route["tone"]
+        chat_history.add_conversation(user_input, maid_response, "chat")
+        # 普通反馈：使用配置的动画设置
+        normal_config = get_animation_config("普通反馈")
+        if normal_config and 'folders' in normal_config:
+            folder = random.choice(normal_config['folders'])
+        else:
+            folder = get_random_normal_audio()
+        
+        scale_factor = normal_config.get('scale_factor', 1.0)
+        play_speed = normal_config.get('play_speed', 3.0)
+        processor.play(folder, scale_factor=scale_factor, loop=True, play_speed=play_speed)
+        return maid_response, tone
+
+    # 如果是code类型，路由结果中带有任务详情
+    detail_dict = route
+
+    # 检查是否需要补充信息
+    need_additional_data = detail_dict.get("need_additional_data")
+    if need_additional_data is not None and need_additional_data != "null" and not (
+        "不需要" in need_additional_data and "需不需要" not in need_additional_data):        # 保存当前状态，等待用户补充信息
+        print(f"需要补充信息: {need_additional_data}")
+        session["pending_additional_data"] = {
+            "original_input": user_input,
+            "need_additional_data": need_additional_data
+        }
+        # 等待操作：使用配置的动画设置
+        wait_config = get_animation_config("等待操作")
+        folder = wait_config.get('folder', 'DanceWhileTalk')
+        scale_factor = wait_config.get('scale_factor', 1.0)
+        play_speed = wait_config.get('play_speed', 3.0)
+        processor.play(folder, scale_factor=scale_factor, loop=True, play_speed=play_speed)
+        # 返回需要补充信息的提示（带语音输出）
+        return need_additional_data, "Speak in a cheerful and positive tone."
+
+    task_summary = detail_dict["task_summary"]
+    # 等待操作：使用配置的动画设置
+    wait_config = get_animation_config("等待操作")
+    folder = wait_config.get('folder', 'DanceWhileTalk')
+    scale_factor = wait_config.get('scale_factor', 1.0)
+    play_speed = wait_config.get('play_speed', 3.0)
+    processor.play(folder, scale_factor=scale_factor, loop=True, play_speed=play_speed)
+    processor.show_timed_dialog(f"主人的需求是：{task_summary}", "思考中...")
+
+    func_list = get_function_list()
+    match_prompt = prompt.CODE_LIBRARY_MATCHING_PROMPT.format(
+        task_summary=task_summary,
+        function_list=str(func_list)
+    )
+    # 等待操作：使用配置的动画设置
+    processor.play(folder, scale_factor=scale_factor, loop=True, play_speed=play_speed)
+    processor.show_timed_dialog("正在查找已有的代码库，看看有没有能满足主人需求的函数呢~", "查找中...")
+    match_result = await stage_runner.run_stage("match", get_ai_response, match_prompt, "code_execution",
+                                                include_history=False, save_to_history=False, stage="match")
+
+    try:
+        match_dict = json.loads(match_result)
+    except json.JSONDecodeError:
+        match_dict = {"matched": False}
+
+    if match_dict.get("matched"):
+        func_name = match_dict["matched_function"]
+        args_value_list = match_dict["args_value_list"]
+        # 等待操作：使用配置的动画设置
+        processor.play(folder, scale_factor=scale_factor, loop=True, play_speed=play_speed)
+        processor.show_timed_dialog(f"找到匹配的函数：{func_name}，马上为主人执行哟~", "准备执行...")
+    else:
+        # 写代码相关：使用配置的动画设置
+        coding_config = get_animation_config("写代码中")
+        folder = coding_config.get('folder', 'coding')
+        scale_factor = coding_config.get('scale_factor', 1.0)
+        play_speed = coding_config.get('play_speed', 32.0)
+        processor.play(folder, scale_factor=scale_factor, loop=True, play_speed=play_speed)
+        processor.show_timed_dialog("没有找到匹配的函数，正在为主人生成新代码呢~", "生成中...")
+        code_prompt = prompt.CODE_GENERATION_PROMPT.format(task_summary=task_summary)
+        code_result = await stage_runner.run_stage("generate", get_ai_response, code_prompt, "code_execution",
+                                                   include_history=False, save_to_history=False, stage="generate")
+
+        try:
+            code_dict = json.loads(code_result)
+            print(f"代码生成结果: {code_dict}")  # 调试信息
+        except json.JSONDecodeError as e:
+            print(f"JSON解析错误: {e}")
+            print(f"原始结果: {code_result}")
+            error_msg = "代码生成失败，请重新描述您的需求。"
+            chat_history.add_conversation(user_input, error_msg, "code_execution")
+            # 错误情况：使用配置的动画设置
+            error_config = get_animation_config("错误情况")
+            folder = error_config.get('folder', 'bowWhileTalk')
+            scale_factor = error_config.get('scale_factor', 1.0)
+            play_speed = error_config.get('play_speed', 3.0)
+            processor.play(folder, scale_factor=scale_factor, loop=True, play_speed=play_speed)
+            return error_msg, "Speak in a cheerful and positive tone."
+
+        func_name = code_dict.get("function_name")
+        code = code_dict.get("code")
+        args_doc = code_dict.get("args_doc", [])
+        current_inputs = code_dict.get("current_inputs", [])
+        
+        print(f"提取的数据 - 函数名: {func_name}")
+        print(f"提取的数据 - 代码长度: {len(code) if code else 0}")
+        print(f"提取的数据 - 参数文档: {args_doc}")
+        print(f"提取的数据 - 当前输入: {current_inputs}")
+
+        if not func_name or not code:
+            print(f"数据不完整 - func_name: {bool(func_name)}, code: {bool(code)}")
+            error_msg = "代码生成不完整，请重新描述您的需求。"
+            chat_history.add_conversation(user_input, error_msg, "code_execution")
+            # 错误情况：使用配置的动画设置
+            error_config = get_animation_config("错误情况")
+            folder = error_config.get('folder', 'bowWhileTalk')
+            scale_factor = error_config.get('scale_factor', 1.0)
+            play_speed = error_config.get('play_speed', 3.0)
+            processor.play(folder, scale_factor=scale_factor, loop=True, play_speed=play_speed)
+            return error_msg, "Speak in a cheerful and positive tone."
+
+        # 验证生成的代码是否包含必要的函数
+        if "def main" not in code and "def main(" not in code:
+            print("生成的代码缺少main函数")
+            error_msg = "生成的代码格式不正确，缺少main函数。请重新描述您的需求。"
+            chat_history.add_conversation(user_input, error_msg, "code_execution")
+            # 错误情况：使用配置的动画设置
+            error_config = get_animation_config("错误情况")
+            folder = error_config.get('folder', 'bowWhileTalk')
+            scale_factor = error_config.get('scale_factor', 1.0)
+            play_speed = error_config.get('play_speed', 3.0)
+            processor.play(folder, scale_factor=scale_factor, loop=True, play_speed=play_speed)
+            return error_msg, "Speak in a cheerful and positive tone."
+
+        CODE_FOLDER.mkdir(exist_ok=True)
+        # 写代码相关：使用配置的动画设置
+        processor.play(folder, scale_factor=scale_factor, loop=True, play_speed=play_speed)
+        processor.show_timed_dialog(f"代码生成完成，函数名为：{func_name}，正在保存代码呢~", "保存中...")
+
+        clean_func_name = Path(func_name).stem
+        py_path = CODE_FOLDER / f"{clean_func_name}.py"
+        json_path = CODE_FOLDER / f"{clean_func_name}.json"
+        
+        print(f"保存路径 - Python文件: {py_path}")
+        print(f"保存路径 - JSON文件: {json_path}")
+
+        try:
+            with open(py_path, "w", encoding="utf-8") as f:
+                f.write(code)
+            print(f"Python文件保存成功: {py_path}")
+        except Exception as e:
+            print(f"保存Python文件失败: {e}")
+            error_msg = f"保存代码文件失败: {str(e)}"
+            processor.play(folder, scale_factor=scale_factor, loop=True, play_speed=play_speed)
+            return error_msg, "Speak in a cheerful and positive tone."
+
+        try:
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump({"function_name": func_name, "args_doc": args_doc}, f, ensure_ascii=False, indent=2)
+            print(f"JSON文件保存成功: {json_path}")
+        except Exception as e:
+            print(f"保存JSON文件失败: {e}")
+            error_msg = f"保存配置文件失败: {str(e)}"
+            processor.play(folder, scale_factor=scale_factor, loop=True, play_speed=play_speed)
+            return error_msg, "Speak in a cheerful and positive tone."
+
+        args_value_list = current_inputs if current_inputs else []
+        # 等待操作：使用配置的动画设置
+        wait_config = get_animation_config("等待操作")
+        folder = wait_config.get('folder', 'DanceWhileTalk')
+        scale_factor = wait_config.get('scale_factor', 1.0)
+        play_speed = wait_config.get('play_speed', 3.0)
+        processor.play(folder, scale_factor=scale_factor, loop=True, play_speed=play_speed)
+        processor.show_timed_dialog("代码已保存，随时可以为主人执行哟~", "准备就绪...")
+
+    # 智能重试机制
+    max_retries = 3
+    current_retry = 0
+    execution_success = False
+    final_output = ""
+    final_func_name = func_name
+    previous_code_content = ""
+    previous_error_msg = ""
+    
+    processor.show_timed_dialog(f"开始执行函数：{func_name}，最多重试{max_retries}次", "准备执行...")
+    
+    while current_retry < max_retries and not execution_success:
+        current_retry += 1
+        
+        if current_retry > 1:
+            processor.show_timed_dialog(f"第{current_retry}次重试执行函数：{final_func_name} (共{max_retries}次)", "重试中...")
+        else:
+            processor.show_timed_dialog(f"第{current_retry}次执行函数：{final_func_name}", "执行中...")
+        
+        clean_func_name = Path(final_func_name).stem
+        py_file_path = CODE_FOLDER / f"{clean_func_name}.py"
+        
+        # 读取当前代码内容（用于错误分析）
+        try:
+            with open(py_file_path, 'r', encoding='utf-8') as f:
+                previous_code_content = f.read()
+        except Exception as e:
+            print(f"读取代码文件失败: {e}")
+            previous_code_content = ""
+        
+        # 执行代码
+        output, success = await stage_runner.run_stage("execute", run_python_function_from_file,
+                                                       str(py_file_path), "main", args_value_list)
+        
+        if success:
+            execution_success = True
+            final_output = output
+            success_message = f"代码执行成功！(第{current_retry}次尝试)"
+            print(success_message)
+            processor.show_timed_dialog(success_message, "执行成功")
+            break
+        else:
+            print(f"代码执行失败 (尝试{current_retry}次): {output}")
+            previous_error_msg = output
+            
+            if current_retry < max_retries:
+                remaining_retries = max_retries - current_retry
+                processor.show_timed_dialog(
+                    f"代码执行失败，剩余重试次数：{remaining_retries}次\n正在分析错误并重写代码...", 
+                    "分析中..."
+                )
+                
+                # 删除失败的代码文件
+                if delete_code_file(final_func_name):
+                    processor.show_timed_dialog(
+                        f"已删除失败代码，正在生成第{current_retry + 1}版代码...", 
+                        "重写中..."
+                    )
+                    
+                    # 重写代码，传递之前的错误信息和代码内容
+                    new_code, new_func_name, new_args, rewrite_success = await stage_runner.run_stage(
+                        "rewrite", rewrite_code_with_retry,
+                        task_summary, final_func_name, current_retry + 1, processor, 
+                        previous_error=previous_error_msg, previous_code=previous_code_content
+                    )
+                    
+                    if rewrite_success:
+                        final_func_name = new_func_name
+                        args_value_list = new_args
+                        processor.show_timed_dialog(
+                            f"第{current_retry + 1}版代码生成完成，准备重新执行...", 
+                            "准备中..."
+                        )
+                    else:
+                        processor.show_timed_dialog(
+                            f"第{current_retry + 1}版代码生成失败，将尝试使用原始代码...", 
+                            "准备中..."
+                        )
+                        # 如果重写失败，尝试使用原始代码
+                        final_func_name = func_name
+                        args_value_list = args_value_list
+                else:
+                    processor.show_timed_dialog(
+                        "删除失败代码文件时出错，将尝试重新执行...", 
+                        "准备中..."
+                    )
+            else:
+                # 最后一次尝试失败
+                final_output = f"代码执行失败，已重试{max_retries}次。\n最后一次错误：{output}\n\n建议：请检查需求描述是否清晰，或者尝试重新描述您的需求。"
+                processor.show_timed_dialog(
+                    f"代码执行多次失败，已重试{max_retries}次\n请检查需求描述或重新尝试", 
+                    "执行失败"
+                )
+    
+    # 等待操作：使用配置的动画设置
+    processor.play(folder, scale_factor=scale_factor, loop=True, play_speed=play_speed)
+    processor.show_timed_dialog("函数执行完成，正在整理结果呢~", "处理中...")
+
+    final_prompt = prompt.FINAL_RESPONSE_PROMPT.format(
+        task_summary=task_summary,
+        command_output=final_output
+    )
+    final_result = await stage_runner.run_stage("final", get_ai_reply, final_prompt, "maid_response", on_partial,
+                                                conversation_type="code_execution", include_history=False,
+                                                save_to_history=False, stage="final")
+
+    try:
+        final_dict = json.loads(final_result)
+        maid_response = final_dict.get("maid_response", "主人，任务完成了哟～")
+    except json.JSONDecodeError:
+        maid_response = "主人，任务完成了哟～"
+
+    chat_history.add_conversation(
+        user_input,
+        maid_response,
+        "code_execution",
+        {
+            "task_summary": task_summary,
+            "function_name": func_name,
+            "code_output": final_output
+        }
+    )
+
+    # 普通反馈：使用配置的动画设置
+    normal_config = get_animation_config("普通反馈")
+    if normal_config and 'folders' in normal_config:
+        folder = random.choice(normal_config['folders'])
+    else:
+        folder = get_random_normal_audio()
+    
+    scale_factor = normal_config.get('scale_factor', 1.0)
+    play_speed = normal_config.get('play_speed', 3.0)
+    processor.play(folder, scale_factor=scale_factor, loop=True, play_speed=play_speed)
+    return maid_response, "Speak in a cheerful and positive tone."
@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地服务模式
+在一个进程中常驻女仆流水线（阶段调度器、共享 HTTP 连接池、响应缓存、代码库），通过 WebSocket 为多个前端提供服务，
+多个桌面前端或脚本连接同一个服务即可共用已经预热的连接和缓存。
+
+协议（除音频分块外都是 JSON 文本消息）：
+
+客户端 → 服务端
+    {"type": "hello", "session": "<id>", "audio": true}  可选；带上之前的会话 id 可以在重连后继续补充信息，
+                                                         audio 为 false 时不推送音频
+    {"type": "input", "text": "...", "id": ...}        本会话中还有请求在处理时按 performance_settings.scheduler
+                                                       的策略抢占、排队或合并；id 可选，原样回传
+    {"type": "typing"}                                 可选；用户开始输入时发送，服务端在后台预热连接（同桌面版的 Alt+D）
+    {"type": "cancel"}
+
+服务端 → 客户端
+    {"type": "session", "id": "...", "resumed": false}
+    {"type": "queued" / "merged" / "duplicate", "id": ..., "queue_depth": ...}    输入没有立即处理时
+    {"type": "scene", "folder": ..., "scale_factor": ..., "loop": ..., "play_speed": ...}    切换动画
+    {"type": "dialog", "text": "..."} / {"type": "timed_dialog", "texts": [...], "duration": ...} / {"type": "hide_dialog"}
+    {"type": "partial", "text": "..."}                流式模式下已生成的回复
+    {"type": "reply", "text": "...", "tone": "..."}
+    {"type": "audio_start", "sample_rate": ..., "channels": ..., "format": "pcm_s16le"}，
+        随后是若干个二进制分块，最后是 {"type": "audio_end"}；较长的回复按句合成，每句一段
+    {"type": "done", "stages": {...}} / {"type": "cancelled"} / {"type": "error", "message": "..."}
+
+与请求相关的消息都带有 "request" 字段（输入消息中的 id，未提供时为会话内的序号；merge 策略下合并处理的
+输入为各条输入的 id 列表）。排队后被放弃的输入（被抢占、队列已满、取消）会收到 {"type": "cancelled", "request": id}。
+每个会话有独立的待补充信息状态；聊天历史仍由所有会话共用（同一个女仆）。
+另外 GET /health 返回服务状态（HTTP）。相关参数在 performance_settings.server 中配置。
+
+访问控制（服务会在本机生成并执行代码，任何网页都能向 ws://127.0.0.1 发起 WebSocket 连接）：
+- 握手必须带上访问令牌：请求头 Authorization: Bearer <token>，或浏览器中使用 ws://.../?token=<token>；
+  令牌在 server.token 中配置，留空时每次启动随机生成并打印出来
+- 带 Origin 请求头的握手（浏览器发起的连接）只有 Origin 在 server.allowed_origins 中时才接受
+- 会话 id 只由服务端生成，hello 中带上未知的 id 会开始新会话
+
+用法（在项目根目录运行，需要 websockets>=13）：
+    python maid_server.py
+    python maid_server.py --port 8765
+"""
+
+import argparse
+import asyncio
+import hmac
+import itertools
+import json
+import random
+import secrets
+import sys
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+from call_ai import speak
+from chat_history import chat_history
+from config_loader import get_performance_config
+from maid_core import maid_handle_input_async, get_animation_config, get_random_normal_audio
+from metrics import metrics
+from pipeline import stage_runner, current_token, PipelineRequest, PipelineCancelled
+from scheduler import RequestScheduler
+from tracing import start_trace, finish_trace, format_stage_report
+from warmup import warmup
+
+
+def get_settings() -> dict:
+    """读取服务模式配置（performance_settings.server）"""
+    try:
+        return get_performance_config().get("server") or {}
+    except Exception:
+        return {}
+
+
+def _scene_message(scene_name: str, default_folder: str) -> dict:
+    """按动画设置生成切换动画的消息"""
+    config = get_animation_config(scene_name)
+    if config and 'folders' in config:
+        folder = random.choice(config['folders'])
+    else:
+        folder = config.get('folder', default_folder) if config else default_folder
+    return {"type": "scene", "folder": folder, "scale_factor": config.get('scale_factor', 1.0),
+            "loop": True, "play_speed": config.get('play_speed', 3.0)}
+
+
+class RemoteProcessor:
+    """把动画和对话框操作转成消息发给客户端，接口与 PRImageProcessor 一致"""
+
+    def __init__(self, send):
+        self._send = send
+
+    def play(self, inner_folder, scale_factor=1.0, loop=False, play_speed=1.0):
+        self._send({"type": "scene", "folder": inner_folder, "scale_factor": scale_factor,
+                    "loop": loop, "play_speed": play_speed})
+
+    def show_dialog(self, text):
+        self._send({"type": "dialog", "text": text})
+
+    def show_timed_dialog(self, *texts: str, duration=None):
+        self._send({"type": "timed_dialog", "texts": list(texts), "duration": duration})
+
+    def hide_dialog(self):
+        self._send({"type": "hide_dialog"})
+
+    def cancel_timed_close(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class ClientConnection:
+    """一个 WebSocket 连接：任何线程都可以调用 send，消息按顺序由事件循环上的发送任务写出"""
+
+    def __init__(self, websocket, loop):
+        self.websocket = websocket
+        self.audio = True
+        self._loop = loop
+        self._queue = asyncio.Queue()
+
+    def send(self, message):
+        """发送 JSON 消息（dict）或二进制分块（bytes）"""
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, message)
+        except RuntimeError:
+            # 事件循环已关闭（服务正在退出）
+            pass
+
+    def close(self):
+        self.send(None)
+
+    async def run_sender(self):
+        while True:
+            message = await self._queue.get()
+            if message is None:
+                return
+            try:
+                if isinstance(message, bytes):
+                    await self.websocket.send(message)
+                else:
+                    await self.websocket.send(json.dumps(message, ensure_ascii=False))
+            except ConnectionClosed:
+                return
+
+
+class MaidSession:
+    """一个会话：独立的待补充信息状态和当前请求，断线重连后可以凭 id 继续"""
+
+    def __init__(self, session_id: str):
+        self.id = session_id
+        # 传给 maid_core 的会话状态字典
+        self.state = {}
+        self.client = None
+        self.request = None
+        self._request_ids = itertools.count(1)
+        # 客户端提供的 id 随输入一起在调度器中排队，开始处理时传回 _start_request
+        self.scheduler = RequestScheduler(self._start_request, self.is_busy, self.cancel, on_drop=self._on_drop)
+
+    def send(self, message):
+        client = self.client
+        if client is not None:
+            client.send(message)
+
+    def is_busy(self) -> bool:
+        return self.request is not None and self.request.is_running()
+
+    def cancel(self):
+        if self.is_busy():
+            self.request.cancel()
+
+    def handle_input(self, user_input: str, request_id=None):
+        """
+        提交一条输入，由调度器按策略决定立即处理、抢占正在处理的请求还是排队；
+        排队、合并和重复的输入会收到 {"type": "queued" / "merged" / "duplicate", "id": ..., "queue_depth": ...}
+        """
+        if user_input.lower() in SPECIAL_COMMANDS:
+            message = SPECIAL_COMMANDS[user_input.lower()]()
+            self.send(_scene_message("普通反馈", get_random_normal_audio()))
+            self.send({"type": "timed_dialog", "texts": [message], "duration": None})
+            self.send({"type": "done", "request": request_id if request_id is not None else next(self._request_ids),
+                       "stages": {}})
+            return
+
+        action = self.scheduler.submit(user_input, request_id)
+        if action in ("queued", "merged", "duplicate"):
+            self.send({"type": action, "id": request_id, "queue_depth": self.scheduler.queue_depth})
+
+    def _on_drop(self, request_ids: list):
+        """排队的输入被放弃（抢占、队列已满、取消）：让客户端知道这些 id 不会再有结果"""
+        for request_id in request_ids:
+            self.send({"type": "cancelled", "request": request_id})
+
+    def _start_request(self, user_input: str, request_ids: list):
+        """开始处理一条输入（由调度器调用）"""
+        if not request_ids:
+            request_id = next(self._request_ids)
+        elif len(request_ids) == 1:
+            request_id = request_ids[0]
+        else:
+            # 合并后的输入：结果消息的 request 字段是各条被合并输入的 id 列表
+            request_id = list(request_ids)
+
+        # 与桌面程序一致：先切换到等待动画并提示正在处理
+        self.send(_scene_message("等待操作", "DanceWhileTalk"))
+        self.send({"type": "timed_dialog", "texts": ["主人，我正在处理您的请求，请稍等..."], "duration": None})
+
+        trace = start_trace("request", user_input=user_input, session=self.id)
+        metrics.inc("requests_total")
+        send_audio = get_settings().get("send_audio", True) and self.client is not None and self.client.audio
+        request = PipelineRequest(lambda: self._handle(user_input, request_id, send_audio), trace=trace)
+        self.request = request
+        request.add_done_callback(lambda future: self._on_done(future, request_id, trace, request))
+
+    def _request_sender(self, request_id):
+        """请求内使用的发送函数：请求被取消后不再发送，消息带上请求 id"""
+        token = current_token()
+
+        def send(message):
+            if token is not None and token.is_cancelled:
+                return
+            if isinstance(message, dict):
+                message = {**message, "request": request_id}
+            self.send(message)
+        return send
+
+    async def _handle(self, user_input: str, request_id, send_audio: bool):
+        send = self._request_sender(request_id)
+        processor = RemoteProcessor(send)
+        reply, tone = await maid_handle_input_async(
+            user_input, processor, on_partial=lambda text: send({"type": "partial", "text": text}),
+            session=self.state)
+        send({"type": "reply", "text": reply, "tone": tone})
+        audio_sink = (lambda y, sr: self._send_audio(send, y, sr)) if send_audio else None
+        await stage_runner.run_stage("tts", speak, reply, tone=tone, dialog_shower=lambda: processor.show_dialog(reply),
+                                     play=False, audio_sink=audio_sink)
+
+    @staticmethod
+    def _send_audio(send, y, sr):
+        """把合成好的音频转成 16 位 PCM 分块推送给客户端"""
+        pcm = (np.clip(y, -1.0, 1.0) * 32767).astype("<i2")
+        data = pcm.tobytes()
+        chunk_size = max(1024, int(get_settings().get("audio_chunk_size", 32768)))
+        send({"type": "audio_start", "sample_rate": int(sr), "channels": 1 if pcm.ndim == 1 else pcm.shape[1],
+              "format": "pcm_s16le", "bytes": len(data)})
+        for offset in range(0, len(data), chunk_size):
+            send(data[offset:offset + chunk_size])
+        send({"type": "audio_end"})
+
+    def _on_done(self, future, request_id, trace, request):
+        finish_trace(trace)
+        if request is self.request:
+            self.request = None
+        try:
+            self._report_result(future, request_id, trace)
+        finally:
+            # 开始处理排队的下一条输入
+            self.scheduler.on_idle()
+
+    def _report_result(self, future, request_id, trace):
+        try:
+            if future.cancelled():
+                raise PipelineCancelled()
+            future.result()
+        except PipelineCancelled:
+            metrics.inc("requests_cancelled_total")
+            self.send({"type": "cancelled", "request": request_id})
+            return
+        except Exception as e:
+            metrics.inc("request_errors_total")
+            self.send(_scene_message("错误情况", "bowWhileTalk"))
+            self.send({"type": "error", "request": request_id, "message": f"主人，出现了错误：{str(e)}"})
+            return
+        self.send({"type": "done", "request": request_id, "stages": trace.summary()})
+
+
+def _history_command() -> str:
+    return f"主人，{chat_history.get_history_summary()}"
+
+
+def _clear_history_command() -> str:
+    chat_history.clear_history()
+    return "主人，历史记录已清空了哟～"
+
+
+def _stats_command() -> str:
+    return f"主人，{metrics.format_latency_summary()}"
+
+
+# 与桌面程序一致的特殊命令（quit 会结束整个服务，服务模式下不提供）
+SPECIAL_COMMANDS = {
+    'history': _history_command,
+    'clear_history': _clear_history_command,
+    'stats': _stats_command,
+}
+
+
+class MaidServer:
+    """WebSocket 服务：管理连接和会话"""
+
+    def __init__(self, token: str = None):
+        self.sessions = {}
+        self.connections = set()
+        # 访问令牌：未配置时每次启动随机生成
+        self.token = token or get_settings().get("token") or secrets.token_urlsafe(24)
+        self.rejected = 0
+        metrics.register_collector("server", self.get_stats)
+
+    def get_stats(self) -> dict:
+        return {
+            "connections": len(self.connections),
+            "sessions": len(self.sessions),
+            "active_requests": sum(1 for session in list(self.sessions.values()) if session.is_busy()),
+            "queued_inputs": sum(session.scheduler.queue_depth for session in list(self.sessions.values())),
+            "rejected_handshakes": self.rejected,
+        }
+
+    @staticmethod
+    def _origin_allowed(request) -> bool:
+        """非浏览器客户端不带 Origin；浏览器发起的连接只接受 allowed_origins 中的来源"""
+        origin = request.headers.get("Origin")
+        if origin is None:
+            return True
+        allowed = get_settings().get("allowed_origins") or []
+        return origin.rstrip("/") in {item.rstrip("/") for item in allowed}
+
+    def _token_valid(self, request) -> bool:
+        presented = ""
+        authorization = request.headers.get("Authorization", "")
+        if authorization.lower().startswith("bearer "):
+            presented = authorization[7:].strip()
+        else:
+            presented = (parse_qs(urlsplit(request.path).query).get("token") or [""])[0]
+        return hmac.compare_digest(presented.encode("utf-8"), self.token.encode("utf-8"))
+
+    def _reject(self, connection, status: int, reason: str):
+        self.rejected += 1
+        metrics.inc("server_rejected_handshakes_total", reason=reason)
+        return connection.respond(status, reason + "\n")
+
+    def process_request(self, connection, request):
+        """
+        握手前检查：Origin 不在允许列表中的浏览器连接一律拒绝；/health 返回服务状态；
+        其他路径必须带上访问令牌才能继续 WebSocket 握手
+        """
+        if not self._origin_allowed(request):
+            return self._reject(connection, 403, "origin not allowed")
+        if urlsplit(request.path).path == "/health":
+            return connection.respond(200, json.dumps({"status": "ok", **self.get_stats()}) + "\n")
+        if not self._token_valid(request):
+            return self._reject(connection, 401, "invalid token")
+        return None
+
+    def _attach(self, client: ClientConnection, session_id: str = None) -> MaidSession:
+        """
+        把连接绑定到会话（已有的会话 id 则继续该会话），之前绑定的连接不再收到消息。
+        会话 id 由服务端随机生成，不接受客户端指定的新 id（id 本身就是继续会话的凭据，不能被猜到）
+        """
+        resumed = session_id in self.sessions
+        if resumed:
+            session = self.sessions[session_id]
+        else:
+            session = MaidSession(secrets.token_hex(16))
+            self.sessions[session.id] = session
+        session.client = client
+        client.send({"type": "session", "id": session.id, "resumed": resumed})
+        return session
+
+    def _detach(self, client: ClientConnection, session: MaidSession):
+        """连接断开：清空排队的输入并取消它的请求；没有待补充信息的会话直接丢弃"""
+        if session.client is not client:
+            return
+        session.client = None
+        session.scheduler.clear()
+        session.cancel()
+        if not session.state:
+            self.sessions.pop(session.id, None)
+
+    async def handle_connection(self, websocket):
+        client = ClientConnection(websocket, asyncio.get_running_loop())
+        self.connections.add(client)
+        sender = asyncio.create_task(client.run_sender())
+        session = None
+        try:
+            async for raw in websocket:
+                if isinstance(raw, bytes):
+                    client.send({"type": "error", "message": "不支持二进制消息"})
+                    continue
+                try:
+                    message = json.loads(raw)
+                except ValueError:
+                    client.send({"type": "error", "message": "消息不是有效的 JSON"})
+                    continue
+                kind = message.get("type")
+                if kind == "hello":
+                    if session is not None:
+                        self._detach(client, session)
+                    client.audio = bool(message.get("audio", True))
+                    session = self._attach(client, message.get("session"))
+                    warmup.trigger("connect")
+                elif kind == "typing":
+                    warmup.trigger("typing")
+                elif kind == "input":
+                    text = str(message.get("text", "")).strip()
+                    if not text:
+                        continue
+                    if session is None:
+                        session = self._attach(client)
+                    warmup.touch()
+                    session.handle_input(text, message.get("id"))
+                elif kind == "cancel":
+                    if session is not None:
+                        session.scheduler.clear()
+                        session.cancel()
+                else:
+                    client.send({"type": "error", "message": f"未知的消息类型: {kind}"})
+        except ConnectionClosed:
+            pass
+        finally:
+            self.connections.discard(client)
+            if session is not None:
+                self._detach(client, session)
+            client.close()
+            await sender
+
+
+async def serve_forever(host: str, port: int):
+    server = MaidServer()
+    if not get_settings().get("token"):
+        print(f"🔑 未配置 server.token，本次启动的访问令牌: {server.token}")
+    warmup.start_keepalive()
+    async with serve(server.handle_connection, host, port, process_request=server.process_request,
+                     max_size=2 ** 20):
+        print(f"🌐 女仆服务已启动: ws://{host}:{port}（状态: http://{host}:{port}/health）")
+        await asyncio.Future()
+
+
+def main():
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description="女仆流水线的本地 WebSocket 服务")
+    parser.add_argument("--host", default=settings.get("host", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=settings.get("port", 8765))
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        print("正在关闭女仆服务...")
+    finally:
+        warmup.stop()
+        stage_runner.shutdown()
+        print("各阶段耗时统计:\n" + format_stage_report())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""
+进程内的运行指标
+计数器（请求数、取消数、错误数、各阶段大模型调用数等）、直方图（各阶段耗时）和仪表（线程数、内存占用）
+统一登记在全局的 metrics 上；响应缓存命中率、端点熔断状态等已有的统计通过 register_collector() 接入，
+读取时再调用，不需要各模块额外维护一份数据。
+
+设置界面的 /api/metrics 以 JSON 或 Prometheus 文本格式输出这里的内容，"stats" 命令会播报其中的延迟摘要。
+"""
+
+import re
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# 直方图保留的滚动样本数（用于计算分位数）
+HISTOGRAM_WINDOW = 500
+
+# Prometheus 直方图的桶上界（秒）
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_PREFIX = "maid_"
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key: tuple, extra: dict = None) -> str:
+    pairs = list(key) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    escaped = (f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for name, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _sanitize(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+class Histogram:
+    """累计的分桶计数（供 Prometheus 使用）+ 最近样本窗口（供计算分位数）"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, window: int = HISTOGRAM_WINDOW):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[index] += 1
+
+    def snapshot(self) -> dict:
+        samples = list(self.samples)
+        if samples:
+            p50, p95, p99 = (float(value) for value in np.percentile(samples, [50, 95, 99]))
+        else:
+            p50 = p95 = p99 = 0.0
+        return {"count": self.count, "sum": self.sum, "window": len(samples), "p50": p50, "p95": p95, "p99": p99}
+
+
+class MetricsRegistry:
+    """线程安全的指标登记表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}     # 名称 -> {标签: 值}
+        self._histograms = {}   # 名称 -> {标签: Histogram}
+        self._gauges = {}       # 名称 -> {标签: 值}
+        self._collectors = {}   # 名称 -> 无参函数，返回统计字典
+        self.started_at = time.time()
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """计数器加一（或加 amount）"""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        """向直方图记录一个样本"""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """设置仪表的当前值"""
+        key = _label_key(labels)
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = value
+
+    def register_collector(self, name: str, collector):
+        """登记一个统计来源，读取指标时调用 collector() 取得最新统计"""
+        with self._lock:
+            self._collectors[name] = collector
+
+    def get_histogram(self, name: str) -> dict:
+        """某个直方图各标签组合的快照，键为标签字典的元组形式"""
+        with self._lock:
+            series = dict(self._histograms.get(name, {}))
+            return {key: histogram.snapshot() for key, histogram in series.items()}
+
+    def _update_process_gauges(self):
+        self.set_gauge("threads", threading.active_count())
+        self.set_gauge("uptime_seconds", time.time() - self.started_at)
+        rss = _get_memory_rss()
+        if rss is not None:
+            self.set_gauge("memory_rss_bytes", rss)
+
+    def _collect(self) -> dict:
+        with self._lock:
+            collectors = dict(self._collectors)
+        results = {}
+        for name, collector in collectors.items():
+            try:
+                results[name] = collector()
+            except Exception as e:
+                results[name] = {"error": str(e)}
+        return results
+
+    def snapshot(self) -> dict:
+        """全部指标的 JSON 结构"""
+        self._update_process_gauges()
+        with self._lock:
+            counters = {name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                        for name, series in self._counters.items()}
+            gauges = {name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                      for name, series in self._gauges.items()}
+            histograms = {name: [{"labels": dict(key), **histogram.snapshot()} for key, histogram in series.items()]
+                          for name, series in self._histograms.items()}
+        return {
+            "timestamp": time.time(),
+            "counters": counters,
+            "gauges": gauges,
+            "histograms": histograms,
+            "collectors": self._collect(),
+        }
+
+    def to_prometheus(self) -> str:
+        """Prometheus 文本格式（collector 中的顶层数值作为仪表输出）"""
+        self._update_process_gauges()
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                metric = METRIC_PREFIX + _sanitize(name)
+                lines.append(f"# TYPE {metric} counter")
+                for key, value in series.items():
+                    lines.append(f"{metric}{_format_labels(key)} {value}")
+            for name, series in sorted(self._gauges.items()):
+                metric = METRIC_PREFIX + _sanitize(name)
+                lines.append(f"# TYPE {metric} gauge")
+                for key, value in series.items():
+                    lines.append(f"{metric}{_format_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                metric = METRIC_PREFIX + _sanitize(name)
+                lines.append(f"# TYPE {metric} histogram")
+                for key, histogram in series.items():
+                    for bound, count in zip(histogram.buckets, histogram.bucket_counts):
+                        lines.append(f"{metric}_bucket{_format_labels(key, {'le': bound})} {count}")
+                    lines.append(f"{metric}_bucket{_format_labels(key, {'le': '+Inf'})} {histogram.count}")
+                    lines.append(f"{metric}_sum{_format_labels(key)} {histogram.sum}")
+                    lines.append(f"{metric}_count{_format_labels(key)} {histogram.count}")
+
+        for collector_name, stats in sorted(self._collect().items()):
+            for field, value in sorted(stats.items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                metric = METRIC_PREFIX + _sanitize(f"{collector_name}_{field}")
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def format_latency_summary(self) -> str:
+        """一句话的延迟摘要（用于 stats 命令播报）"""
+        requests = self.get_histogram("stage_latency_seconds").get((("stage", "request"),))
+        if not requests or not requests["window"]:
+            return "还没有处理过请求，暂时没有延迟数据"
+        stages = {dict(key).get("stage"): stats for key, stats in self.get_histogram("stage_latency_seconds").items()}
+        stages.pop("request", None)
+        summary = (f"最近 {requests['window']} 次请求中位耗时 {requests['p50']:.1f} 秒，"
+                   f"p95 {requests['p95']:.1f} 秒")
+        if stages:
+            slowest, stats = max(stages.items(), key=lambda item: item[1]["p95"])
+            summary += f"，最慢的阶段是 {slowest}（p95 {stats['p95']:.1f} 秒）"
+        return summary
+
+
+def _get_memory_rss():
+    """进程常驻内存（字节）；优先使用 psutil，没有时在类 Unix 系统上退回 resource 模块"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    try:
+        import resource
+        import sys
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS 以字节为单位，Linux 以 KB 为单位（这里取的是峰值）
+        return rss if sys.platform == "darwin" else rss * 1024
+    except Exception:
+        return None
+
+
+# 全局指标实例
+metrics = MetricsRegistry()
@@ -0,0 +1,152 @@
+"""
+按阶段选择模型
+每个阶段可以在 performance_settings.model_routing 中单独配置模型、max_tokens、备用模型和 p95 延迟目标：
+判断、代码库匹配等小任务用快速便宜的模型，代码生成用能力更强的模型。
+
+路由器按 (阶段, 模型) 记录最近若干次调用的延迟（流式调用记首字延迟），某个阶段主模型的滚动 p95 超过目标时
+切换到备用模型；超时或出错的调用按 max(实际耗时, failure_penalty) 记一个样本，主模型持续失败也会触发切换。
+切换期间每隔 probe_interval 次仍然请求一次主模型，主模型恢复后自动切回。
+"""
+
+import threading
+from collections import deque
+
+import numpy as np
+
+from metrics import metrics
+
+# 未配置的阶段使用的 max_tokens
+DEFAULT_MAX_TOKENS = 2000
+
+# 各阶段默认的 max_tokens（模型和备用模型默认不配置，使用 api_config 中的模型）
+DEFAULT_STAGE_MAX_TOKENS = {
+    "judge": 100,
+    "detail": 500,
+    "route": 600,
+    "chat": 500,
+    "match": 500,
+    "final": 500,
+    "generate": 2000,
+    "analyze": 2000,
+}
+
+# 计算 p95 前至少需要的样本数，样本太少时不做切换
+MIN_SAMPLES = 5
+
+# 失败调用至少记为这么多秒（可用 model_routing.failure_penalty 覆盖）
+DEFAULT_FAILURE_PENALTY = 30.0
+
+
+class ModelRouter:
+    """按阶段选择模型，并根据滚动 p95 延迟切换到备用模型"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = {}        # (阶段, 模型) -> 最近的延迟样本
+        self._using_fallback = {}   # 阶段 -> 当前是否使用备用模型
+        self._fallback_calls = {}   # 阶段 -> 切换后经过的调用次数（用于定期探测主模型）
+        self.stats = {
+            "fallback_switches": 0,
+            "recoveries": 0,
+            "fallback_calls": 0,
+            "probe_calls": 0,
+            "failures": 0,
+        }
+
+    @staticmethod
+    def get_settings() -> dict:
+        """读取模型路由配置（performance_settings.model_routing）"""
+        from config_loader import get_performance_config
+        return get_performance_config().get("model_routing") or {}
+
+    def _window(self, settings: dict) -> int:
+        return settings.get("window", 50)
+
+    def _p95(self, stage: str, model: str):
+        samples = self._latencies.get((stage, model))
+        if not samples or len(samples) < MIN_SAMPLES:
+            return None
+        return float(np.percentile(list(samples), 95))
+
+    def select(self, stage: str, default_model: str) -> tuple[str, int]:
+        """
+        选择某个阶段这次调用使用的模型和 max_tokens
+
+        Returns:
+            (模型名称, max_tokens)
+        """
+        settings = self.get_settings()
+        stage_config = (settings.get("stages") or {}).get(stage, {})
+        primary = stage_config.get("model") or default_model
+        max_tokens = stage_config.get("max_tokens") or DEFAULT_STAGE_MAX_TOKENS.get(stage, DEFAULT_MAX_TOKENS)
+
+        fallback = stage_config.get("fallback")
+        target = stage_config.get("p95_target", settings.get("p95_target"))
+        if not settings.get("enabled", True) or not fallback or not target or fallback == primary:
+            return primary, max_tokens
+
+        with self._lock:
+            p95 = self._p95(stage, primary)
+            using_fallback = self._using_fallback.get(stage, False)
+
+            if not using_fallback and p95 is not None and p95 > target:
+                self._using_fallback[stage] = True
+                self._fallback_calls[stage] = 0
+                self.stats["fallback_switches"] += 1
+                print(f"⚠️ 阶段 {stage} 的模型 {primary} p95 延迟 {p95:.2f}s 超过目标 {target}s，切换到 {fallback}")
+                using_fallback = True
+            elif using_fallback and p95 is not None and p95 <= target:
+                self._using_fallback[stage] = False
+                self.stats["recoveries"] += 1
+                print(f"✅ 阶段 {stage} 的模型 {primary} p95 延迟恢复到 {p95:.2f}s，切回主模型")
+                using_fallback = False
+
+            if using_fallback:
+                self._fallback_calls[stage] += 1
+                # 定期请求一次主模型，刷新它的延迟样本
+                if self._fallback_calls[stage] % settings.get("probe_interval", 10) == 0:
+                    self.stats["probe_calls"] += 1
+                    return primary, max_tokens
+                self.stats["fallback_calls"] += 1
+                return fallback, stage_config.get("fallback_max_tokens") or max_tokens
+
+        return primary, max_tokens
+
+    def record_latency(self, stage: str, model: str, latency: float):
+        """记录一次成功调用的延迟（流式调用传首字延迟）"""
+        window = self._window(self.get_settings())
+        with self._lock:
+            key = (stage, model)
+            samples = self._latencies.get(key)
+            if samples is None or samples.maxlen != window:
+                samples = deque(samples or [], maxlen=window)
+                self._latencies[key] = samples
+            samples.append(latency)
+
+    def record_failure(self, stage: str, model: str, elapsed: float):
+        """记录一次超时或出错的调用，按 max(实际耗时, failure_penalty) 计入延迟样本"""
+        penalty = self.get_settings().get("failure_penalty", DEFAULT_FAILURE_PENALTY)
+        with self._lock:
+            self.stats["failures"] += 1
+        self.record_latency(stage, model, max(elapsed, penalty))
+
+    def get_stats(self) -> dict:
+        """获取各阶段各模型的滚动延迟、各阶段的当前选择和切换次数"""
+        with self._lock:
+            models = {
+                f"{stage}/{model}": {
+                    "samples": len(samples),
+                    "p50": float(np.percentile(list(samples), 50)) if samples else 0.0,
+                    "p95": float(np.percentile(list(samples), 95)) if samples else 0.0,
+                }
+                for (stage, model), samples in self._latencies.items()
+            }
+            stats = dict(self.stats)
+            stats["models"] = models
+            stats["stages_on_fallback"] = [stage for stage, flag in self._using_fallback.items() if flag]
+        return stats
+
+
+# 全局模型路由实例
+model_router = ModelRouter()
+metrics.register_collector("model_router", model_router.get_stats)
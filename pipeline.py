@@ -0,0 +1,216 @@
+"""
+可取消的请求流水线
+所有请求的各个阶段（路由、代码匹配、生成、执行、反馈、语音合成）都在同一个常驻的 asyncio 事件循环线程上调度，
+阻塞的调用交给线程池执行。每个请求带一个 CancelToken：
+
+- 新输入到来时取消旧请求，事件循环中的协程立即结束，后续阶段不会再执行
+- 取消时依次调用登记在令牌上的回调，关闭正在接收的 HTTP 流、停止正在播放的音频
+- 阻塞调用通过 current_token() 拿到当前请求的令牌，自行检查是否已取消
+
+用来替代以前直接 terminate() 工作线程的做法，避免连接、文件和上游请求被遗留。
+"""
+
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import span, use_trace
+
+
+class PipelineCancelled(Exception):
+    """请求已被取消"""
+
+
+class CancelToken:
+    """协作式取消令牌"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @property
+    def event(self) -> threading.Event:
+        return self._event
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        """取消请求，并立即执行所有登记的释放回调"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"⚠️ 取消回调执行失败: {e}")
+
+    def register(self, callback):
+        """
+        登记取消时要执行的回调（关闭连接、停止播放等）；令牌已取消时立即执行
+
+        Returns:
+            注销函数，资源正常释放后调用，避免重复关闭
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return functools.partial(self._unregister, callback)
+        callback()
+        return lambda: None
+
+    def _unregister(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def check(self):
+        """已取消时抛出 PipelineCancelled"""
+        if self._event.is_set():
+            raise PipelineCancelled()
+
+
+class CancelEvent(threading.Event):
+    """
+    可以登记回调的 Event：set 时立即执行登记的回调（关闭连接等）。
+    作为 cancel_event 传给流式调用时，取消会立即关闭 HTTP 流，而不是等到下一段数据到达时才发现
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def set(self):
+        with self._lock:
+            if self.is_set():
+                return
+            super().set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"⚠️ 取消回调执行失败: {e}")
+
+    def register(self, callback):
+        """登记 set 时要执行的回调，已经 set 时立即执行；返回注销函数"""
+        with self._lock:
+            if not self.is_set():
+                self._callbacks.append(callback)
+                return functools.partial(self._unregister, callback)
+        callback()
+        return lambda: None
+
+    def _unregister(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+_current_token = contextvars.ContextVar("cancel_token", default=None)
+
+
+def current_token() -> CancelToken:
+    """获取当前请求的取消令牌（不在流水线中运行时返回 None）"""
+    return _current_token.get()
+
+
+def is_cancelled() -> bool:
+    token = _current_token.get()
+    return token is not None and token.is_cancelled
+
+
+class StageRunner:
+    """常驻的事件循环线程，负责调度各请求的阶段"""
+
+    def __init__(self, max_workers: int = 8):
+        self._loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stage")
+        self._thread = threading.Thread(target=self._run_loop, name="stage-loop", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    async def run_stage(self, name: str, func, *args, **kwargs):
+        """
+        在线程池中执行一个阻塞阶段；开始前和结束后都会检查取消状态，
+        协程被取消时立即返回，不等待阻塞调用结束
+        """
+        token = current_token()
+        if token is not None:
+            token.check()
+        context = contextvars.copy_context()
+        with span(name):
+            result = await self._loop.run_in_executor(
+                self._executor, functools.partial(context.run, func, *args, **kwargs))
+        if token is not None:
+            token.check()
+        return result
+
+    def submit(self, coro_factory, token: CancelToken = None, trace=None):
+        """
+        在事件循环上启动一个请求
+
+        Args:
+            coro_factory: 无参函数，返回要执行的协程
+            token: 该请求的取消令牌
+            trace: 该请求的延迟追踪（tracing.Trace），各阶段的耗时记录在上面
+
+        Returns:
+            concurrent.futures.Future，取消它会同时取消事件循环中的任务
+        """
+        token = token or CancelToken()
+
+        async def runner():
+            _current_token.set(token)
+            if trace is not None:
+                use_trace(trace)
+            return await coro_factory()
+
+        return asyncio.run_coroutine_threadsafe(runner(), self._loop)
+
+    def run(self, coro_factory, token: CancelToken = None, trace=None):
+        """同步执行一个请求并等待结果（供命令行、批处理等非 GUI 场景使用）"""
+        return self.submit(coro_factory, token, trace).result()
+
+    def shutdown(self):
+        """停止事件循环和线程池"""
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class PipelineRequest:
+    """一个正在运行的请求：取消令牌 + 事件循环上的任务"""
+
+    def __init__(self, coro_factory, runner: StageRunner = None, trace=None):
+        self.token = CancelToken()
+        self.trace = trace
+        self.future = (runner or stage_runner).submit(coro_factory, self.token, trace)
+
+    def is_running(self) -> bool:
+        return not self.future.done()
+
+    def cancel(self):
+        """取消请求：先释放资源，再取消事件循环中的任务"""
+        start_time = time.perf_counter()
+        self.token.cancel()
+        self.future.cancel()
+        print(f"已取消请求，耗时 {(time.perf_counter() - start_time) * 1000:.1f} 毫秒")
+
+    def add_done_callback(self, callback):
+        self.future.add_done_callback(callback)
+
+
+# 全局阶段调度器实例
+stage_runner = StageRunner()
@@ -0,0 +1,228 @@
+"""
+可切换的变调引擎
+语音合成后的升调原来每次都启动一个 rubberband 子进程并通过临时 WAV 文件传递音频，短句和流式播放的每一块
+都要付出启动进程、读写文件的固定开销。这里提供几个可互换的引擎：
+
+- numpy：进程内实现，相位声码器（向量化的 STFT / 相位累加 / 重叠相加）把音频拉长，再重采样回原长度，没有进程开销
+- rubberband：rubberband 命令行（R2 引擎，原来的实现）
+- rubberband-r3：rubberband-r3 命令行（R3 引擎，音质更好，更慢）
+- librosa：librosa.effects.pitch_shift
+
+engine 为 auto 时按音频时长选择：短于 short_clip_seconds 秒的音频（短句、流式播放的分块）用 short_engine，
+其余用 long_engine；选中的引擎不可用或出错时退回 numpy。各引擎的调用次数和耗时记录在 metrics 中，
+benchmarks/pitch_benchmark.py 可以对比各引擎的速度和音高准确度。
+
+相关参数在 performance_settings.pitch_shift 中配置。
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from fractions import Fraction
+
+import numpy as np
+import soundfile as sf
+
+from metrics import metrics
+
+# 相位声码器的帧长和帧移（采样数）
+N_FFT = 1024
+HOP_LENGTH = 256
+
+
+def get_settings() -> dict:
+    """读取变调配置（performance_settings.pitch_shift）"""
+    try:
+        from config_loader import get_performance_config
+        return get_performance_config().get("pitch_shift") or {}
+    except Exception:
+        return {}
+
+
+def _frames_index(n_frames: int) -> np.ndarray:
+    return np.arange(N_FFT)[None, :] + HOP_LENGTH * np.arange(n_frames)[:, None]
+
+
+def _stft(y: np.ndarray, window: np.ndarray) -> np.ndarray:
+    y = np.pad(y, (N_FFT // 2, N_FFT // 2 + N_FFT))
+    n_frames = 1 + (len(y) - N_FFT) // HOP_LENGTH
+    return np.fft.rfft(y[_frames_index(n_frames)] * window, axis=1)
+
+
+def _istft(spectrum: np.ndarray, window: np.ndarray, length: int) -> np.ndarray:
+    frames = np.fft.irfft(spectrum, n=N_FFT, axis=1) * window
+    index = _frames_index(len(frames))
+    output = np.zeros(index[-1, -1] + 1)
+    norm = np.zeros_like(output)
+    np.add.at(output, index, frames)
+    np.add.at(norm, index, np.broadcast_to(window ** 2, frames.shape))
+    output /= np.where(norm > 1e-8, norm, 1.0)
+    output = output[N_FFT // 2:N_FFT // 2 + length]
+    return np.pad(output, (0, length - len(output)))
+
+
+def time_stretch(y: np.ndarray, factor: float) -> np.ndarray:
+    """相位声码器：把单声道音频拉长为 factor 倍（音高不变）"""
+    window = np.hanning(N_FFT + 1)[:-1]
+    spectrum = _stft(y, window)
+    n_frames = len(spectrum)
+    # 输出的每一帧对应输入中的一个（小数）帧位置
+    positions = np.arange(0, n_frames - 1, 1.0 / factor)
+    base = positions.astype(int)
+    frac = (positions - base)[:, None]
+    magnitude = (1 - frac) * np.abs(spectrum[base]) + frac * np.abs(spectrum[base + 1])
+
+    # 相邻两帧的相位差减去各频率的理论相位增量，折回 [-π, π) 得到频率偏差，累加出输出帧的相位
+    expected = 2 * np.pi * HOP_LENGTH * np.arange(spectrum.shape[1]) / N_FFT
+    delta = np.angle(spectrum[base + 1]) - np.angle(spectrum[base]) - expected
+    delta -= 2 * np.pi * np.round(delta / (2 * np.pi))
+    phase = np.angle(spectrum[0]) + np.concatenate([np.zeros((1, len(expected))),
+                                                    np.cumsum(expected + delta, axis=0)[:-1]])
+    return _istft(magnitude * np.exp(1j * phase), window, int(round(len(y) * factor)))
+
+
+def _resample(y: np.ndarray, length: int) -> np.ndarray:
+    """重采样到指定长度（有 scipy 时做带限的多相重采样，否则线性插值）"""
+    if len(y) == length:
+        return y
+    try:
+        from scipy.signal import resample_poly
+        ratio = Fraction(length, len(y)).limit_denominator(200)
+        resampled = resample_poly(y, ratio.numerator, ratio.denominator)
+    except ImportError:
+        resampled = np.interp(np.linspace(0, len(y) - 1, length), np.arange(len(y)), y)
+    if len(resampled) >= length:
+        return resampled[:length]
+    return np.pad(resampled, (0, length - len(resampled)))
+
+
+def _shift_numpy(y: np.ndarray, sr: int, n_steps: float) -> np.ndarray:
+    if len(y) == 0:
+        # 空的语音流、空回复：没有可处理的采样
+        return y
+    factor = 2.0 ** (n_steps / 12.0)
+    if y.ndim > 1:
+        return np.stack([_shift_numpy(channel, sr, n_steps) for channel in y.T], axis=1)
+    if len(y) < N_FFT:
+        # 太短的片段直接重采样（相当于加快播放，末尾补零到原长度）
+        shifted = _resample(y, max(1, int(round(len(y) / factor))))
+        return np.pad(shifted, (0, len(y) - len(shifted))).astype(y.dtype, copy=False)
+    return _resample(time_stretch(y, factor), len(y)).astype(y.dtype, copy=False)
+
+
+def _rubberband_command(executable: str) -> str:
+    """rubberband 命令行的路径：优先使用项目目录中附带的可执行文件"""
+    local = os.path.join(os.path.dirname(os.path.abspath(__file__)), f"{executable}.exe")
+    if os.name == "nt" and os.path.exists(local):
+        return local
+    return shutil.which(executable)
+
+
+def _shift_rubberband(executable: str):
+    def shift(y: np.ndarray, sr: int, n_steps: float) -> np.ndarray:
+        command = _rubberband_command(executable)
+        if command is None:
+            raise RuntimeError(f"找不到 {executable} 命令行")
+        with tempfile.TemporaryDirectory(prefix="pitch_") as directory:
+            infile = os.path.join(directory, "in.wav")
+            outfile = os.path.join(directory, "out.wav")
+            sf.write(infile, y, sr, subtype="FLOAT")
+            subprocess.run([command, "-q", "-p", str(n_steps), infile, outfile], check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                           creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0))
+            shifted, _ = sf.read(outfile)
+        return shifted.astype(y.dtype, copy=False) if y.dtype.kind == "f" else shifted
+
+    return shift
+
+
+def _shift_librosa(y: np.ndarray, sr: int, n_steps: float) -> np.ndarray:
+    import librosa
+    if y.ndim > 1:
+        return librosa.effects.pitch_shift(y.T, sr=sr, n_steps=n_steps).T
+    return librosa.effects.pitch_shift(y, sr=sr, n_steps=n_steps)
+
+
+ENGINES = {
+    "numpy": _shift_numpy,
+    "rubberband": _shift_rubberband("rubberband"),
+    "rubberband-r3": _shift_rubberband("rubberband-r3"),
+    "librosa": _shift_librosa,
+}
+
+
+def is_available(engine: str) -> bool:
+    """引擎在当前环境中是否可用"""
+    if engine == "numpy":
+        return True
+    if engine in ("rubberband", "rubberband-r3"):
+        return _rubberband_command(engine) is not None
+    if engine == "librosa":
+        try:
+            import librosa  # noqa: F401
+            return True
+        except ImportError:
+            return False
+    return False
+
+
+def available_engines() -> list:
+    return [engine for engine in ENGINES if is_available(engine)]
+
+
+def choose_engine(duration: float, engine: str = None, settings: dict = None) -> str:
+    """按配置和音频时长（秒）选择引擎，不可用时退回 numpy"""
+    settings = get_settings() if settings is None else settings
+    engine = engine or settings.get("engine", "auto")
+    if engine == "auto":
+        if duration < settings.get("short_clip_seconds", 3.0):
+            engine = settings.get("short_engine", "numpy")
+        else:
+            engine = settings.get("long_engine", "rubberband")
+    return engine if engine in ENGINES and is_available(engine) else "numpy"
+
+
+def engine_signature(settings: dict = None) -> str:
+    """引擎配置的描述（用于音频缓存的键）：auto 时包含时长阈值和两端的引擎"""
+    settings = get_settings() if settings is None else settings
+    engine = settings.get("engine", "auto")
+    if engine != "auto":
+        return engine
+    return (f"auto:{settings.get('short_engine', 'numpy')}<{settings.get('short_clip_seconds', 3.0)}"
+            f"<={settings.get('long_engine', 'rubberband')}")
+
+
+def get_pitch_steps() -> float:
+    """配置的升调半音数"""
+    return float(get_settings().get("n_steps", 4.1))
+
+
+def pitch_shift(y: np.ndarray, sr: int, n_steps: float = None, engine: str = None) -> np.ndarray:
+    """
+    变调（音长不变）
+
+    Args:
+        y: 音频，(采样数,) 或 (采样数, 声道数)
+        sr: 采样率
+        n_steps: 升调的半音数，不传则读取配置
+        engine: 指定引擎，不传则按配置（auto 时按时长）选择
+    """
+    if len(y) == 0:
+        return y
+    n_steps = get_pitch_steps() if n_steps is None else n_steps
+    name = choose_engine(len(y) / sr, engine)
+    start_time = time.perf_counter()
+    try:
+        shifted = ENGINES[name](y, sr, n_steps)
+    except Exception as e:
+        if name == "numpy":
+            raise
+        print(f"⚠️ 变调引擎 {name} 出错，改用 numpy: {e}")
+        metrics.inc("pitch_shift_fallbacks_total", engine=name)
+        name = "numpy"
+        shifted = _shift_numpy(y, sr, n_steps)
+    metrics.inc("pitch_shift_total", engine=name)
+    metrics.observe("pitch_shift_seconds", time.perf_counter() - start_time, engine=name)
+    return shifted
@@ -10,6 +10,7 @@ from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QObject, QThread, QRect, QUrl
 from PyQt5.QtGui import QPixmap, QImage, QPainter, QFont, QFontMetrics, QColor, QDragEnterEvent, QDropEvent
 from PIL import Image
 from call_ai import describe_image
+from tracing import mark, span
 
 
 def calculate_height(s):
@@ -295,17 +296,18 @@ class ImageLoader(QObject):
             self.images_loaded.emit([])
             return
 
-        for img_file in image_files:
-            try:
-                img_path = os.path.join(folder_path, img_file)
-                img = Image.open(img_path).convert("RGBA")
-                processed_img = self.resize_image(img)
-                qimg = QImage(processed_img.tobytes(), processed_img.width, processed_img.height,
-                              QImage.Format_RGBA8888)
-                pixmap = QPixmap.fromImage(qimg)
-                images.append({'pixmap': pixmap})
-            except Exception as e:
-                print(f"載入圖像 {img_file} 時出錯: {e}")
+        with span("load_animation", attach_latest=True, folder=inner_folder, frames=len(image_files)):
+            for img_file in image_files:
+                try:
+                    img_path = os.path.join(folder_path, img_file)
+                    img = Image.open(img_path).convert("RGBA")
+                    processed_img = self.resize_image(img)
+                    qimg = QImage(processed_img.tobytes(), processed_img.width, processed_img.height,
+                                  QImage.Format_RGBA8888)
+                    pixmap = QPixmap.fromImage(qimg)
+                    images.append({'pixmap': pixmap})
+                except Exception as e:
+                    print(f"載入圖像 {img_file} 時出錯: {e}")
 
         self.images_loaded.emit(images)
 
@@ -554,6 +556,8 @@ class PRImageProcessor(QObject):
             if self.images:
                 self.current_image_index = 0
                 self.display_current_image()
+                # 新动画的第一帧已经显示
+                mark("frame_switch", attach_latest=True, folder=self.current_folder)
 
                 if not self.window_shown:
                     self.root.show()
@@ -0,0 +1,311 @@
+"""
+上游请求的限流与并发控制
+聊天、语音合成、图片识别和试用程序的请求在发出前都要先从这里取得放行：每个端点一个令牌桶（每秒请求数 + 突发容量）
+和一个并发上限，同一端点上等待的请求按优先级排队，同优先级先到先得：
+
+- interactive：路由、回复、代码生成、语音合成等用户正在等待的请求
+- background：图片识别、连接预热等后台任务，只在没有交互请求等待时放行
+
+并发名额只限制"等待响应"的请求：流式请求收到响应（端点池的 claim()）后调用 release_current_slot() 提前归还，
+长时间接收回复或音频时不占用名额，推测执行的两路流、对冲和流式语音合成不会互相挤占。
+
+上游返回 429 时按 Retry-After（没有时按指数退避）暂停该端点的放行，再在同一端点上重试，
+避免各线程同时重试引发新一轮 429。排队等待时间和限流次数记录在 metrics 中。
+
+相关参数在 performance_settings.rate_limit 中配置，endpoints 中可以按端点名称覆盖。
+"""
+
+import contextvars
+import heapq
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+from metrics import metrics
+from pipeline import PipelineCancelled, current_token
+
+PRIORITY_LEVELS = {"interactive": 0, "normal": 1, "background": 2}
+
+# 请求类型（endpoint_pool 的 kind）默认的优先级
+DEFAULT_PRIORITIES = {
+    "complete": "interactive",
+    "stream": "interactive",
+    "tts": "interactive",
+    "image": "background",
+    "warmup": "background",
+}
+
+# 等待放行时检查取消状态的间隔（秒）
+WAIT_SLICE = 0.1
+
+# 当前上下文占用的放行名额（供 release_current_slot 提前归还）
+_current_slot = contextvars.ContextVar("rate_limit_slot", default=None)
+
+
+class RateLimitedError(Exception):
+    """上游返回 429"""
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(headers) -> float:
+    """解析 Retry-After（秒数或 HTTP 日期）和 retry-after-ms 响应头，没有时返回 None"""
+    if headers is None:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def raise_for_rate_limit(response):
+    """原始 HTTP 请求（语音合成、图片识别）收到 429 时抛出 RateLimitedError"""
+    if response.status_code == 429:
+        raise RateLimitedError("上游请求过于频繁 (429)", parse_retry_after(response.headers))
+
+
+def _rate_limit_delay(error: Exception):
+    """429 错误返回 (True, Retry-After 秒数或 None)，其他错误返回 (False, None)"""
+    if isinstance(error, RateLimitedError):
+        return True, error.retry_after
+    # openai.RateLimitError 等带状态码和响应的 SDK 异常
+    if getattr(error, "status_code", None) == 429:
+        response = getattr(error, "response", None)
+        return True, parse_retry_after(getattr(response, "headers", None))
+    return False, None
+
+
+class _Slot:
+    """一个已取得的并发名额，release 可以重复调用"""
+
+    def __init__(self, limiter):
+        self._limiter = limiter
+        self._lock = threading.Lock()
+        self.released = False
+
+    def release(self, early: bool = False):
+        with self._lock:
+            if self.released:
+                return
+            self.released = True
+        self._limiter.release(early)
+
+
+class EndpointLimiter:
+    """一个端点的令牌桶、并发计数和优先级等待队列"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._cond = threading.Condition()
+        self._tokens = None         # 首次使用时按突发容量填满
+        self._refilled_at = time.monotonic()
+        self._in_flight = 0
+        self._waiters = []          # (优先级, 序号) 小顶堆，堆顶是下一个放行的请求
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self.stats = {"acquired": 0, "delayed": 0, "rate_limited": 0, "retries": 0, "cancelled": 0,
+                      "early_releases": 0}
+
+    def _refill(self, rate: float, burst: float, now: float):
+        if self._tokens is None:
+            self._tokens = burst
+        elif rate > 0:
+            self._tokens = min(burst, self._tokens + (now - self._refilled_at) * rate)
+        else:
+            self._tokens = burst
+        self._refilled_at = now
+
+    def acquire(self, priority: int, settings: dict) -> float:
+        """
+        等待放行（令牌、并发名额都满足且前面没有更高优先级的请求）
+
+        Returns:
+            等待的秒数；当前请求在等待中被取消时抛出 PipelineCancelled
+        """
+        rate = float(settings.get("requests_per_second", 5.0))
+        burst = max(1.0, float(settings.get("burst", 5)))
+        max_concurrent = max(1, int(settings.get("max_concurrent", 4)))
+        token = current_token()
+        start_time = time.monotonic()
+
+        with self._cond:
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(rate, burst, now)
+                    if (self._waiters[0] == entry and now >= self._paused_until
+                            and self._in_flight < max_concurrent and self._tokens >= 1):
+                        break
+                    if token is not None and token.is_cancelled:
+                        self.stats["cancelled"] += 1
+                        raise PipelineCancelled()
+                    if now < self._paused_until:
+                        timeout = self._paused_until - now
+                    elif self._tokens < 1 and rate > 0:
+                        timeout = (1 - self._tokens) / rate
+                    else:
+                        # 等并发名额释放或排在前面的请求放行
+                        timeout = WAIT_SLICE
+                    self._cond.wait(min(timeout, WAIT_SLICE))
+            except BaseException:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+                raise
+
+            heapq.heappop(self._waiters)
+            self._tokens -= 1
+            self._in_flight += 1
+            self.stats["acquired"] += 1
+            waited = time.monotonic() - start_time
+            if waited > 0.001:
+                self.stats["delayed"] += 1
+            # 让下一个等待者检查自己是否可以放行
+            self._cond.notify_all()
+        return waited
+
+    def release(self, early: bool = False):
+        with self._cond:
+            self._in_flight -= 1
+            if early:
+                self.stats["early_releases"] += 1
+            self._cond.notify_all()
+
+    def pause(self, seconds: float):
+        """收到 429 后在 seconds 秒内暂停放行"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self.stats["rate_limited"] += 1
+            self._cond.notify_all()
+
+    def record_retry(self):
+        with self._cond:
+            self.stats["retries"] += 1
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                "in_flight": self._in_flight,
+                "waiting": len(self._waiters),
+                "tokens": round(self._tokens, 2) if self._tokens is not None else None,
+                "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 2),
+                **self.stats,
+            }
+
+
+class RateLimiter:
+    """所有端点的限流器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._limiters = {}
+
+    @staticmethod
+    def get_settings() -> dict:
+        """读取限流配置（performance_settings.rate_limit）"""
+        try:
+            from config_loader import get_performance_config
+            return get_performance_config().get("rate_limit") or {}
+        except Exception:
+            return {}
+
+    def _endpoint_settings(self, name: str) -> dict:
+        settings = self.get_settings()
+        return {**settings, **((settings.get("endpoints") or {}).get(name) or {})}
+
+    def get_limiter(self, name: str) -> EndpointLimiter:
+        with self._lock:
+            limiter = self._limiters.get(name)
+            if limiter is None:
+                limiter = self._limiters[name] = EndpointLimiter(name)
+            return limiter
+
+    @staticmethod
+    def priority_class(kind: str, settings: dict) -> str:
+        priorities = {**DEFAULT_PRIORITIES, **(settings.get("priorities") or {})}
+        priority = priorities.get(kind, "normal")
+        return priority if priority in PRIORITY_LEVELS else "normal"
+
+    @contextmanager
+    def slot(self, name: str, kind: str):
+        """在端点 name 上占用一个放行名额，kind 为请求类型（决定优先级）"""
+        settings = self._endpoint_settings(name)
+        if not settings.get("enabled", True):
+            yield
+            return
+        limiter = self.get_limiter(name)
+        priority = self.priority_class(kind, settings)
+        waited = limiter.acquire(PRIORITY_LEVELS[priority], settings)
+        metrics.observe("ratelimit_wait_seconds", waited, priority=priority)
+        current = _Slot(limiter)
+        reset = _current_slot.set(current)
+        try:
+            yield
+        finally:
+            _current_slot.reset(reset)
+            current.release()
+
+    @staticmethod
+    def release_current_slot():
+        """已经收到响应、接下来只是接收数据时，提前归还当前上下文占用的并发名额（令牌桶不受影响）"""
+        current = _current_slot.get()
+        if current is not None:
+            current.release(early=True)
+
+    def call(self, name: str, kind: str, func, *args, **kwargs):
+        """
+        取得放行后执行 func；上游返回 429 时暂停该端点的放行（Retry-After 或指数退避），再在同一端点重试，
+        超过 max_retries 次后抛出最后一次的错误（交给端点池故障转移）
+        """
+        settings = self._endpoint_settings(name)
+        max_retries = int(settings.get("max_retries", 2))
+        for retry in itertools.count():
+            with self.slot(name, kind):
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    rate_limited, retry_after = _rate_limit_delay(e)
+                    if not rate_limited:
+                        raise
+                    error = e
+            limiter = self.get_limiter(name)
+            metrics.inc("ratelimit_429_total", endpoint=name)
+            if retry_after is None:
+                # 没有 Retry-After 时指数退避，加一点抖动避免各线程同时醒来
+                retry_after = min(settings.get("backoff_max", 30.0),
+                                  settings.get("backoff_base", 1.0) * 2 ** retry) * random.uniform(0.8, 1.2)
+            limiter.pause(retry_after)
+            if retry >= max_retries:
+                raise error
+            limiter.record_retry()
+            print(f"⏳ API端点 {name} 返回 429，{retry_after:.1f} 秒后重试（第 {retry + 1} 次）")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {name: limiter.snapshot() for name, limiter in limiters.items()}
+
+
+# 全局限流器实例
+rate_limiter = RateLimiter()
+metrics.register_collector("rate_limits", rate_limiter.get_stats)
@@ -0,0 +1,176 @@
+"""
+LLM响应缓存
+以 (模型, temperature, 完整消息列表) 的哈希为键，把大模型的响应持久化到 SQLite，
+相同的请求（重复的代码库匹配、相同的执行结果反馈、反复出现的报错分析等）直接复用结果。
+
+每个阶段可以单独配置是否启用和 TTL；带历史记录的调用默认不走缓存。
+缓存按条数和总字节数限制大小，超出时按最近访问时间淘汰（LRU）。
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from metrics import metrics
+
+CACHE_FILE = "llm_cache.sqlite3"
+
+# 各阶段的默认缓存策略：enabled 是否启用，ttl 过期时间（秒），
+# json 为调用方按 JSON 解析结果的阶段，解析不了的响应不写入缓存（否则错误的输出会一直被重放到过期）
+DEFAULT_STAGE_POLICIES = {
+    "match": {"enabled": True, "ttl": 24 * 3600, "json": True},       # 代码库匹配
+    "final": {"enabled": True, "ttl": 24 * 3600, "json": True},       # 执行结果反馈
+    "analyze": {"enabled": True, "ttl": 7 * 24 * 3600},               # 代码错误分析（纯文本）
+    "generate": {"enabled": False, "ttl": 24 * 3600, "json": True},   # 代码生成（失败重试需要新结果，默认关闭）
+}
+
+
+class ResponseCache:
+    """基于 SQLite 的大模型响应缓存"""
+
+    def __init__(self, path: str = CACHE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "bypassed": 0,   # 未启用缓存的阶段或带历史记录的调用
+            "rejected": 0,   # 应为 JSON 但解析失败、没有写入的响应
+            "stores": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+
+    def _get_connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, stage TEXT, model TEXT, response TEXT, "
+                "size INTEGER, created_at REAL, expires_at REAL, last_access REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def make_key(model: str, temperature: float, messages: list) -> str:
+        """根据模型、temperature 和完整的消息列表计算缓存键"""
+        payload = json.dumps({"model": model, "temperature": temperature, "messages": messages},
+                             ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def get_settings() -> dict:
+        """读取缓存配置（performance_settings.response_cache）"""
+        from config_loader import get_performance_config
+        return get_performance_config().get("response_cache") or {}
+
+    def get_policy(self, stage: str, include_history: bool) -> dict:
+        """
+        获取某个阶段的缓存策略
+
+        Returns:
+            启用时返回 {"ttl": 秒数}，不启用时返回 None
+        """
+        settings = self.get_settings()
+        if not stage or not settings.get("enabled", True):
+            return None
+        if include_history and not settings.get("cache_history_calls", False):
+            return None
+
+        policy = dict(DEFAULT_STAGE_POLICIES.get(stage, {"enabled": False, "ttl": 3600}))
+        policy.update((settings.get("stages") or {}).get(stage, {}))
+        return policy if policy.get("enabled") else None
+
+    def get(self, key: str):
+        """查询缓存，命中返回响应文本，未命中或已过期返回 None"""
+        now = time.time()
+        with self._lock:
+            conn = self._get_connection()
+            row = conn.execute("SELECT response, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            response, expires_at = row
+            if expires_at is not None and expires_at < now:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                conn.commit()
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self.stats["hits"] += 1
+            return response
+
+    def put(self, key: str, response: str, stage: str, model: str, ttl: float = None):
+        """写入缓存，并按配置的上限淘汰最久未访问的条目"""
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        size = len(response.encode("utf-8"))
+        settings = self.get_settings()
+        max_entries = settings.get("max_entries", 2000)
+        max_bytes = settings.get("max_bytes", 20 * 1024 * 1024)
+
+        with self._lock:
+            conn = self._get_connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, stage, model, response, size, created_at, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, stage, model, response, size, now, expires_at, now)
+            )
+            self.stats["stores"] += 1
+            self._evict(conn, max_entries, max_bytes)
+            conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection, max_entries: int, max_bytes: int):
+        """按最近访问时间淘汰，直到条数和总字节数都在上限内"""
+        count, total_size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        while count > max_entries or total_size > max_bytes:
+            row = conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC LIMIT 1").fetchone()
+            if row is None:
+                break
+            conn.execute("DELETE FROM responses WHERE key = ?", (row[0],))
+            count -= 1
+            total_size -= row[1]
+            self.stats["evictions"] += 1
+
+    def record_bypass(self):
+        with self._lock:
+            self.stats["bypassed"] += 1
+
+    def record_rejected(self):
+        with self._lock:
+            self.stats["rejected"] += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            conn = self._get_connection()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+
+    def get_stats(self) -> dict:
+        """获取命中率、条目数和占用字节数"""
+        with self._lock:
+            stats = dict(self.stats)
+            try:
+                count, total_size = self._get_connection().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            except sqlite3.Error:
+                count, total_size = 0, 0
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["entries"] = count
+        stats["bytes"] = total_size
+        return stats
+
+
+# 全局响应缓存实例
+response_cache = ResponseCache()
+metrics.register_collector("response_cache", response_cache.get_stats)
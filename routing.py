@@ -0,0 +1,329 @@
+"""
+请求路由
+判断用户输入是闲聊（chat）还是需要执行代码（code），并给出闲聊回复或任务详情。
+
+支持的路由模式（performance_settings.routing_mode）：
+    two_stage:   先调用判断 prompt，再串行调用闲聊或任务详情 prompt（两次往返）
+    combined:    使用合并的路由 prompt，一次往返同时拿到判断结果和回复/任务详情
+    speculative: 同时发出判断、闲聊和任务详情三个请求，保留与判断结果一致的分支，
+                 取消另一个分支（用 token 换延迟）
+
+开启本地意图分类器（performance_settings.local_classifier）时，分类器置信度足够高的输入
+直接进入闲聊或任务详情阶段，不再请求远程判断。
+"""
+
+import contextvars
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import prompt
+from call_ai import build_messages, get_ai_response, get_ai_reply, get_ai_response_stream, prefetch_speech
+from config_loader import get_performance_config
+from intent_classifier import classify_intent
+from pipeline import CancelEvent
+from scheduler import stage_memo
+from token_estimator import estimate_messages_tokens, estimate_tokens
+from tracing import span
+
+DEFAULT_TONE = "Speak in a cheerful and positive tone."
+ROUTING_MODES = ("two_stage", "combined", "speculative")
+
+# 推测执行使用的线程池（每个请求占用三个线程）
+_speculative_executor = ThreadPoolExecutor(max_workers=6, thread_name_prefix="speculative")
+
+# 各路由模式的统计
+_routing_stats = {}
+_routing_stats_lock = threading.Lock()
+
+
+def _parse_json(result: str):
+    """解析AI返回的JSON对象，失败时返回 None"""
+    try:
+        with span("json_parse"):
+            result_dict = json.loads(result)
+    except json.JSONDecodeError:
+        return None
+    return result_dict if isinstance(result_dict, dict) else None
+
+
+def _is_null(value) -> bool:
+    return value is None or value == "null" or value == ""
+
+
+def _record_stats(mode: str, latency: float = None, wasted_tokens: int = 0, latency_saved: float = 0.0,
+                  local_hits: int = 0, local_fallbacks: int = 0):
+    with _routing_stats_lock:
+        stats = _routing_stats.setdefault(mode, {
+            "requests": 0,
+            "total_latency": 0.0,
+            "wasted_tokens": 0,
+            "latency_saved": 0.0,
+            "local_hits": 0,         # 本地分类器直接给出结果的次数
+            "local_fallbacks": 0,    # 本地分类器置信度不足、交给大模型判断的次数
+        })
+        if latency is not None:
+            stats["requests"] += 1
+            stats["total_latency"] += latency
+        stats["wasted_tokens"] += wasted_tokens
+        stats["latency_saved"] += latency_saved
+        stats["local_hits"] += local_hits
+        stats["local_fallbacks"] += local_fallbacks
+
+
+def get_routing_stats() -> dict:
+    """获取各路由模式的请求数、平均延迟、浪费的 token 估算值和节省的延迟（秒）"""
+    with _routing_stats_lock:
+        result = {}
+        for mode, stats in _routing_stats.items():
+            requests = stats["requests"]
+            result[mode] = dict(stats)
+            result[mode]["avg_latency"] = stats["total_latency"] / requests if requests else None
+        return result
+
+
+def run_judge_stage(user_input: str):
+    """判断阶段：返回 "chat" / "code"，解析失败返回 None；被取消的请求已经得到的判断结果会被复用"""
+    return stage_memo.run("judge", user_input, _run_judge, user_input)
+
+
+def _run_judge(user_input: str):
+    judge_prompt = prompt.CODE_EXECUTION_JUDGEMENT_PROMPT.format(user_input=user_input)
+    judge_result = get_ai_response(judge_prompt, "code_execution", include_history=True, save_to_history=False,
+                                   stage="judge")
+    judge_dict = _parse_json(judge_result)
+    if judge_dict is None:
+        return None
+    return "chat" if judge_dict.get("a") == "chat" else "code"
+
+
+def _chat_route_from_result(chat_result: str):
+    result_dict = _parse_json(chat_result)
+    if result_dict is None or "reply" not in result_dict:
+        return None
+    return {
+        "a": "chat",
+        "reply": result_dict["reply"],
+        "tone": result_dict.get("tone", DEFAULT_TONE),
+    }
+
+
+def _detail_route_from_result(detail_result: str):
+    detail_dict = _parse_json(detail_result)
+    if detail_dict is None:
+        return None
+    return {
+        "a": "code",
+        "task_summary": detail_dict.get("task_summary"),
+        "need_additional_data": detail_dict.get("need_additional_data"),
+    }
+
+
+def run_chat_stage(user_input: str, on_partial=None, stream: bool = None):
+    """闲聊阶段：返回 {"a": "chat", "reply", "tone"}，解析失败返回 None"""
+    chat_prompt = prompt.SMALL_TALK_PROMPT.format(user_input=user_input)
+    chat_result = get_ai_reply(chat_prompt, "reply", on_partial, stream=stream, conversation_type="chat",
+                               include_history=True, save_to_history=False,
+                               current_prompt_template=prompt.SMALL_TALK_PROMPT, stage="chat")
+    print(chat_result)
+    return _chat_route_from_result(chat_result)
+
+
+def run_detail_stage(user_input: str):
+    """任务详情阶段：返回 {"a": "code", "task_summary", "need_additional_data"}，解析失败返回 None"""
+    detail_prompt = prompt.CODE_DETAIL_PROMPT.format(user_input=user_input)
+    detail_result = get_ai_response(detail_prompt, "code_execution", include_history=True, save_to_history=False,
+                                    stage="detail")
+    return _detail_route_from_result(detail_result)
+
+
+def route_two_stage(user_input: str, on_partial=None, stream: bool = None):
+    """原有流程：判断后再串行请求闲聊或任务详情"""
+    verdict = run_judge_stage(user_input)
+    if verdict is None:
+        return None
+    if verdict == "chat":
+        return run_chat_stage(user_input, on_partial, stream)
+    return run_detail_stage(user_input)
+
+
+def route_combined(user_input: str, on_partial=None, stream: bool = None):
+    """合并流程：一次请求同时返回判断结果和对应内容"""
+    route_prompt = prompt.CODE_ROUTING_PROMPT.format(user_input=user_input)
+    route_result = get_ai_reply(route_prompt, "reply", on_partial, stream=stream, conversation_type="chat",
+                                include_history=True, save_to_history=False,
+                                current_prompt_template=prompt.CODE_ROUTING_PROMPT, stage="route")
+
+    route_dict = _parse_json(route_result)
+    if route_dict is None:
+        return None
+
+    if route_dict.get("a") == "chat":
+        if _is_null(route_dict.get("reply")):
+            # 模型漏填了回复，退回单独的闲聊请求
+            return run_chat_stage(user_input, on_partial, stream)
+        tone = route_dict.get("tone")
+        return {
+            "a": "chat",
+            "reply": route_dict["reply"],
+            "tone": DEFAULT_TONE if _is_null(tone) else tone,
+        }
+
+    if _is_null(route_dict.get("task_summary")) and _is_null(route_dict.get("need_additional_data")):
+        # 模型漏填了任务详情，退回单独的详情请求
+        return run_detail_stage(user_input)
+    return {
+        "a": "code",
+        "task_summary": route_dict.get("task_summary"),
+        "need_additional_data": route_dict.get("need_additional_data"),
+    }
+
+
+def _estimate_call_tokens(prompt_text: str, response_text: str, stage: str = None) -> int:
+    """估算一次带历史记录的调用消耗的 token（输入 + 已收到的输出）"""
+    prompt_tokens = estimate_messages_tokens(build_messages(prompt_text, include_history=True, stage=stage))
+    return prompt_tokens + estimate_tokens(response_text)
+
+
+def route_speculative(user_input: str, on_partial=None, stream: bool = None):
+    """
+    推测执行流程：判断、闲聊、任务详情三个请求同时发出，
+    判断结果到达后取消不需要的分支。闲聊的部分回复在判断确认为 chat 之前不会显示。
+    """
+    start_time = time.perf_counter()
+    if stream is None:
+        stream = get_performance_config().get("stream_responses", True)
+
+    # set 时立即关闭对应分支的 HTTP 流，释放连接和限流名额
+    cancel_events = {"chat": CancelEvent(), "code": CancelEvent()}
+    partial_lock = threading.Lock()
+    partial_state = {"verdict": None, "text": None}
+
+    def handle_chat_partial(field, text):
+        with partial_lock:
+            partial_state["text"] = text
+            if partial_state["verdict"] == "chat" and stream and on_partial and text:
+                on_partial(text)
+
+    def handle_chat_complete(field, text):
+        if not cancel_events["chat"].is_set():
+            prefetch_speech(text)
+
+    chat_prompt = prompt.SMALL_TALK_PROMPT.format(user_input=user_input)
+    detail_prompt = prompt.CODE_DETAIL_PROMPT.format(user_input=user_input)
+
+    def run_chat_branch():
+        branch_start = time.perf_counter()
+        chat_result = get_ai_response_stream(chat_prompt, fields=("reply",), on_partial=handle_chat_partial,
+                                             on_field_complete=handle_chat_complete, conversation_type="chat",
+                                             include_history=True, save_to_history=False,
+                                             current_prompt_template=prompt.SMALL_TALK_PROMPT,
+                                             cancel_event=cancel_events["chat"], stage="chat")
+        return chat_result, time.perf_counter() - branch_start
+
+    def run_detail_branch():
+        branch_start = time.perf_counter()
+        detail_result = get_ai_response_stream(detail_prompt, fields=(), conversation_type="code_execution",
+                                               include_history=True, save_to_history=False,
+                                               cancel_event=cancel_events["code"], stage="detail")
+        return detail_result, time.perf_counter() - branch_start
+
+    def run_judge_branch():
+        branch_start = time.perf_counter()
+        return run_judge_stage(user_input), time.perf_counter() - branch_start
+
+    # 复制当前上下文，让并行分支的 token 用量计入调用方的统计
+    judge_future = _speculative_executor.submit(contextvars.copy_context().run, run_judge_branch)
+    chat_future = _speculative_executor.submit(contextvars.copy_context().run, run_chat_branch)
+    detail_future = _speculative_executor.submit(contextvars.copy_context().run, run_detail_branch)
+    branch_prompts = {"chat": chat_prompt, "code": detail_prompt}
+    branch_futures = {"chat": chat_future, "code": detail_future}
+    branch_stages = {"chat": "chat", "code": "detail"}
+
+    def record_waste(branch):
+        """分支结束后估算被丢弃的 token"""
+        def callback(future):
+            try:
+                result_text, _ = future.result()
+            except Exception:
+                result_text = ""
+            wasted = _estimate_call_tokens(branch_prompts[branch], result_text, branch_stages[branch])
+            _record_stats("speculative", wasted_tokens=wasted)
+        return callback
+
+    verdict, judge_time = judge_future.result()
+    if verdict is None:
+        for branch in ("chat", "code"):
+            cancel_events[branch].set()
+            branch_futures[branch].add_done_callback(record_waste(branch))
+        _record_stats("speculative", latency=time.perf_counter() - start_time)
+        return None
+
+    loser = "code" if verdict == "chat" else "chat"
+    cancel_events[loser].set()
+    branch_futures[loser].add_done_callback(record_waste(loser))
+
+    # 判断确认是闲聊后，先把已经生成的部分回复显示出来
+    with partial_lock:
+        partial_state["verdict"] = verdict
+        if verdict == "chat" and stream and on_partial and partial_state["text"]:
+            on_partial(partial_state["text"])
+
+    winner_result, winner_time = branch_futures[verdict].result()
+    elapsed = time.perf_counter() - start_time
+    # 串行执行时需要 判断耗时 + 分支耗时，节省的部分即为两者之和减去实际耗时
+    _record_stats("speculative", latency=elapsed, latency_saved=max(0.0, judge_time + winner_time - elapsed))
+
+    if verdict == "chat":
+        print(winner_result)
+        return _chat_route_from_result(winner_result)
+    return _detail_route_from_result(winner_result)
+
+
+def route_user_input(user_input: str, on_partial=None, mode: str = None, stream: bool = None):
+    """
+    按配置的路由模式处理用户输入
+
+    Args:
+        user_input: 用户输入
+        on_partial: 流式模式下闲聊回复的部分文本回调
+        mode: 路由模式，不传则读取配置
+        stream: 是否流式接收回复，不传则读取配置
+
+    Returns:
+        chat: {"a": "chat", "reply", "tone"}
+        code: {"a": "code", "task_summary", "need_additional_data"}
+        解析失败: None
+    """
+    performance_config = get_performance_config()
+    if mode is None:
+        mode = performance_config.get("routing_mode", "two_stage")
+
+    if performance_config.get("local_classifier", True):
+        start_time = time.perf_counter()
+        threshold = performance_config.get("local_classifier_threshold", 0.9)
+        verdict = classify_intent(user_input, threshold)
+        if verdict is not None:
+            print(f"本地意图分类: {verdict}")
+            if verdict == "chat":
+                route = run_chat_stage(user_input, on_partial, stream)
+            else:
+                route = run_detail_stage(user_input)
+            _record_stats("local", latency=time.perf_counter() - start_time)
+            _record_stats(mode, local_hits=1)
+            return route
+        _record_stats(mode, local_fallbacks=1)
+
+    if mode == "speculative":
+        # 推测执行模式自行统计延迟
+        return route_speculative(user_input, on_partial, stream)
+
+    start_time = time.perf_counter()
+    if mode == "combined":
+        route = route_combined(user_input, on_partial, stream)
+    else:
+        mode = "two_stage"
+        route = route_two_stage(user_input, on_partial, stream)
+    _record_stats(mode, latency=time.perf_counter() - start_time)
+    return route
@@ -39,11 +39,11 @@ if not exist "main.py" (
 
 :: Check if dependencies are installed
 echo Checking dependencies...
-%PYTHON_CMD% -c "import sounddevice, librosa, soundfile, pyrubberband, requests, openai, translate" >nul 2>&1
+%PYTHON_CMD% -c "import sounddevice, librosa, soundfile, requests, openai, translate" >nul 2>&1
 if %errorlevel% equ 1 (
     echo Dependencies not fully installed
     echo Attempting to auto-install dependencies...
-    %PYTHON_CMD% -m pip install sounddevice librosa soundfile pyrubberband requests openai translate
+    %PYTHON_CMD% -m pip install sounddevice librosa soundfile requests openai translate
     if %errorlevel% equ 1 (
         echo Auto-installation failed, please run setup.bat first
         pause
@@ -0,0 +1,231 @@
+"""
+输入请求调度
+上一条输入还没处理完时又来了新输入，按 performance_settings.scheduler.policy 处理：
+
+- preempt：取消正在处理的请求（包括正在播放的语音），立即处理新输入（原有行为）
+- queue：排队，等当前请求和语音都结束后依次处理；队列满时丢弃最早的一条
+- merge：排队，但排队中的多条输入合并为一条后续请求，连续输入多条时只多处理一次
+
+与正在处理或排队中的输入完全相同的重复输入直接忽略。
+
+被取消的请求已经完成的阶段（判断阶段、整个路由结果）保存在 stage_memo 中，键里带有聊天历史的版本号，
+历史没有变化时同样的输入再次到来直接复用，不再请求大模型。代码库匹配、结果反馈等不带历史的调用由 response_cache 复用。
+
+排队等待时间、各种处理方式的次数和阶段复用次数记录在 metrics 中，队列深度通过使用方登记的统计来源输出。
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+from metrics import metrics
+
+POLICIES = ("preempt", "queue", "merge")
+
+
+def get_settings() -> dict:
+    """读取调度配置（performance_settings.scheduler）"""
+    try:
+        from config_loader import get_performance_config
+        return get_performance_config().get("scheduler") or {}
+    except Exception:
+        return {}
+
+
+class StageMemo:
+    """
+    短期的阶段结果缓存，只在内存中保存
+
+    键为 (阶段, 输入, 聊天历史版本号)：对话完成后历史版本号变化，之前的结果自然失效，
+    所以只有被取消、还没写入历史的请求的结果会被复用
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.stats = {"hits": 0, "stores": 0}
+
+    @staticmethod
+    def _key(stage: str, key: str) -> tuple:
+        from chat_history import chat_history
+        return stage, key, chat_history.revision
+
+    def get(self, stage: str, key: str):
+        """取出未过期的结果，没有时返回 None"""
+        ttl = get_settings().get("reuse_ttl", 300.0)
+        memo_key = self._key(stage, key)
+        with self._lock:
+            entry = self._entries.get(memo_key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.time() - stored_at > ttl:
+                del self._entries[memo_key]
+                return None
+            self._entries.move_to_end(memo_key)
+            self.stats["hits"] += 1
+        metrics.inc("stage_reuse_total", stage=stage)
+        print(f"♻️ 复用已完成的 {stage} 阶段结果")
+        return value
+
+    def put(self, stage: str, key: str, value):
+        memo_key = self._key(stage, key)
+        with self._lock:
+            self._entries[memo_key] = (time.time(), value)
+            self._entries.move_to_end(memo_key)
+            self.stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def run(self, stage: str, key: str, func, *args, **kwargs):
+        """
+        有可复用的结果时直接返回，否则执行 func 并保存结果（None 表示失败，不保存）
+
+        在阶段内部调用（阻塞），关闭 stage_reuse 时直接执行 func
+        """
+        if not get_settings().get("stage_reuse", True):
+            return func(*args, **kwargs)
+        value = self.get(stage, key)
+        if value is not None:
+            return value
+        value = func(*args, **kwargs)
+        if value is not None:
+            self.put(stage, key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {**self.stats, "entries": len(self._entries)}
+
+
+class RequestScheduler:
+    """
+    按策略决定新输入是立即处理、抢占、排队还是合并
+
+    不依赖 Qt，桌面程序和服务模式的每个会话各用一个：
+
+    Args:
+        start: start(user_input, request_ids) 开始处理一条输入；request_ids 是提交时带上的 id 列表
+               （合并后的输入包含每条被合并输入的 id，没有提交 id 的输入不在其中）
+        is_busy: is_busy() 当前是否还有请求或语音在进行
+        cancel: cancel() 取消当前的请求和语音
+        policy: 调度策略，不传则读取配置
+        on_drop: on_drop(request_ids) 排队的输入被放弃（抢占、队列已满、clear）时调用，可选
+    """
+
+    def __init__(self, start, is_busy, cancel, policy: str = None, on_drop=None):
+        self._start = start
+        self._is_busy = is_busy
+        self._cancel = cancel
+        self._policy = policy
+        self._on_drop = on_drop
+        # 可重入：请求在 start 中同步结束时，完成回调会在同一线程里调用 on_idle
+        self._lock = threading.RLock()
+        self._queue = deque()   # [{"text", "submitted_at", "ids"}]
+        self.current_input = None
+        self.stats = {"started": 0, "preempted": 0, "queued": 0, "merged": 0, "duplicates": 0, "dropped": 0}
+
+    @property
+    def policy(self) -> str:
+        policy = self._policy or get_settings().get("policy", "preempt")
+        return policy if policy in POLICIES else "preempt"
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def submit(self, user_input: str, request_id=None) -> str:
+        """
+        提交一条新输入
+
+        Args:
+            request_id: 调用方用来对应结果的 id，随输入一起排队，开始处理时传给 start
+
+        Returns:
+            处理方式："started" / "preempted" / "queued" / "merged" / "duplicate"
+        """
+        with self._lock:
+            busy = self._is_busy()
+            if busy and (user_input == self.current_input
+                         or (self._queue and self._queue[-1]["text"] == user_input)):
+                return self._count("duplicate")
+
+            policy = self.policy
+            ids = [] if request_id is None else [request_id]
+            if not busy and not self._queue:
+                self._start_input(user_input, time.perf_counter(), ids)
+                return self._count("started")
+
+            if policy == "preempt":
+                # 排队中的旧输入一并放弃，只处理最新的输入
+                self.clear()
+                self._cancel()
+                self._start_input(user_input, time.perf_counter(), ids)
+                return self._count("preempted")
+
+            if policy == "merge" and self._queue:
+                self._queue[-1]["text"] = f"{self._queue[-1]['text']}\n{user_input}"
+                self._queue[-1]["ids"].extend(ids)
+                return self._count("merged")
+
+            max_queue = max(1, int(get_settings().get("max_queue", 5)))
+            if len(self._queue) >= max_queue:
+                dropped = self._queue.popleft()
+                self._count("dropped")
+                print(f"⚠️ 排队的输入过多，丢弃最早的一条: {dropped['text']}")
+                self._dropped([dropped])
+            self._queue.append({"text": user_input, "submitted_at": time.perf_counter(), "ids": ids})
+            if not busy:
+                started = len(self._queue) == 1
+                self.on_idle()
+                if started:
+                    return self._count("started")
+            return self._count("queued")
+
+    def on_idle(self):
+        """当前的请求和语音结束时调用：开始处理下一条排队的输入"""
+        with self._lock:
+            if self._is_busy():
+                return
+            if not self._queue:
+                self.current_input = None
+                return
+            item = self._queue.popleft()
+            self._start_input(item["text"], item["submitted_at"], item["ids"])
+
+    def clear(self):
+        """清空排队中的输入（退出、取消时调用）"""
+        with self._lock:
+            dropped = list(self._queue)
+            self._queue.clear()
+        self._dropped(dropped)
+
+    def _dropped(self, items: list):
+        ids = [request_id for item in items for request_id in item["ids"]]
+        if ids and self._on_drop is not None:
+            self._on_drop(ids)
+
+    def _start_input(self, user_input: str, submitted_at: float, request_ids: list):
+        metrics.observe("scheduler_wait_seconds", time.perf_counter() - submitted_at)
+        self.current_input = user_input
+        self._start(user_input, request_ids)
+
+    def _count(self, action: str) -> str:
+        key = {"duplicate": "duplicates"}.get(action, action)
+        self.stats[key] += 1
+        metrics.inc("scheduler_inputs_total", action=action)
+        return action
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"policy": self.policy, "queue_depth": len(self._queue), **self.stats}
+
+
+# 全局阶段结果缓存实例
+stage_memo = StageMemo()
+metrics.register_collector("stage_memo", stage_memo.get_stats)
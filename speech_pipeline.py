@@ -0,0 +1,126 @@
+"""
+按句合成语音的流水线
+较长的回复先按句切分，每句依次经过翻译、下载、变调几个阶段，最后按顺序播放。每个阶段一个线程，
+阶段之间用容量为 lookahead 的队列连接：播放第 N 句时后面的句子已经在准备，但最多提前准备有限的几句，
+请求被取消时不会白白合成整段回复。
+
+每句的音频单独写入音频缓存（见 audio_variants），回复中重复出现的句子（问候语、固定结尾等）直接命中缓存。
+
+相关参数在 performance_settings.tts_pipeline 中配置。
+"""
+
+import contextvars
+import queue
+import re
+import threading
+
+# 句末标点（切分后标点留在句子末尾）
+SENTENCE_END = re.compile(r"(?<=[。！？!?…～~\n])")
+# 等待队列时检查是否已停止的间隔（秒）
+WAIT_SLICE = 0.1
+
+_END = object()
+
+
+def get_settings() -> dict:
+    """读取按句合成配置（performance_settings.tts_pipeline）"""
+    try:
+        from config_loader import get_performance_config
+        return get_performance_config().get("tts_pipeline") or {}
+    except Exception:
+        return {}
+
+
+def split_sentences(text: str, min_chars: int = 8) -> list:
+    """
+    按句末标点切分文本，不足 min_chars 个字的片段并入下一句（避免为一两个字单独请求一次合成）
+
+    Returns:
+        句子列表，拼接起来（去掉首尾空白后）与原文相同
+    """
+    sentences = []
+    current = ""
+    for piece in SENTENCE_END.split(text):
+        current += piece
+        if len(current.strip()) >= min_chars:
+            sentences.append(current.strip())
+            current = ""
+    if current.strip():
+        if sentences and len(current.strip()) < min_chars:
+            sentences[-1] += current.rstrip()
+        else:
+            sentences.append(current.strip())
+    return sentences
+
+
+class _Failure:
+    """某个阶段抛出的异常，沿着队列传给使用方"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def run_pipeline(items, stages: list, lookahead: int = 1, is_cancelled=None):
+    """
+    让 items 依次经过 stages 中的各个函数，每个阶段在单独的线程中运行（带调用方的上下文，追踪和取消照常生效）
+
+    Args:
+        items: 输入序列
+        stages: [func(item) -> result, ...]，前一个阶段的结果是后一个阶段的输入
+        lookahead: 阶段之间队列的容量，决定最多提前准备几项
+        is_cancelled: 返回 True 时停止（不再产出结果，各阶段线程尽快退出）
+
+    Yields:
+        最后一个阶段的结果（按输入顺序）；任一阶段抛出异常时在这里重新抛出
+    """
+    stop = threading.Event()
+    outputs = [queue.Queue(maxsize=max(1, lookahead)) for _ in stages]
+
+    def put(target: queue.Queue, item) -> bool:
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=WAIT_SLICE)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(source: queue.Queue):
+        while not stop.is_set():
+            if is_cancelled is not None and is_cancelled():
+                break
+            try:
+                return source.get(timeout=WAIT_SLICE)
+            except queue.Empty:
+                continue
+        return _END
+
+    def worker(index: int, func):
+        source = iter(items) if index == 0 else None
+        while True:
+            item = next(source, _END) if index == 0 else get(outputs[index - 1])
+            if item is _END or isinstance(item, _Failure):
+                put(outputs[index], item)
+                return
+            try:
+                result = func(item)
+            except BaseException as e:
+                put(outputs[index], _Failure(e))
+                return
+            if not put(outputs[index], result):
+                return
+
+    for index, func in enumerate(stages):
+        # 每个线程各用一份上下文副本（同一个 Context 不能同时在多个线程中进入）
+        threading.Thread(target=contextvars.copy_context().run, args=(worker, index, func),
+                         daemon=True, name=f"speech-stage-{index}").start()
+    try:
+        while True:
+            item = get(outputs[-1])
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
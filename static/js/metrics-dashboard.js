@@ -0,0 +1,175 @@
+// 运行指标面板
+
+const METRICS_REFRESH_INTERVAL = 5000;
+const TREND_POINTS = 60;
+const LATENCY_COLORS = { p50: '#667eea', p95: '#f6a04d', p99: '#e55353' };
+
+const requestTrend = [];
+
+function formatBytes(bytes) {
+    if (bytes === undefined || bytes === null) return '-';
+    const units = ['B', 'KB', 'MB', 'GB'];
+    let value = bytes;
+    let unit = 0;
+    while (value >= 1024 && unit < units.length - 1) {
+        value /= 1024;
+        unit++;
+    }
+    return `${value.toFixed(1)} ${units[unit]}`;
+}
+
+function formatPercent(value) {
+    return value === undefined || value === null ? '-' : `${(value * 100).toFixed(1)}%`;
+}
+
+// 取某个指标（计数器或仪表）所有标签组合的合计值
+function sumSeries(series) {
+    return (series || []).reduce((total, item) => total + item.value, 0);
+}
+
+// 准备画布：按设备像素比缩放，返回绘图上下文和 CSS 尺寸
+function prepareCanvas(canvas) {
+    const ratio = window.devicePixelRatio || 1;
+    const width = canvas.clientWidth;
+    const height = canvas.height / (canvas.dataset.ratio || 1);
+    canvas.dataset.ratio = ratio;
+    canvas.width = width * ratio;
+    canvas.height = height * ratio;
+    canvas.style.height = `${height}px`;
+    const ctx = canvas.getContext('2d');
+    ctx.scale(ratio, ratio);
+    ctx.clearRect(0, 0, width, height);
+    ctx.font = '12px sans-serif';
+    return { ctx, width, height };
+}
+
+function drawLegend(ctx, width, keys) {
+    let x = width - keys.length * 60;
+    keys.forEach(key => {
+        ctx.fillStyle = LATENCY_COLORS[key];
+        ctx.fillRect(x, 4, 10, 10);
+        ctx.fillStyle = '#333';
+        ctx.fillText(key, x + 14, 13);
+        x += 60;
+    });
+}
+
+// 各阶段的 p50 / p95 / p99 横向分组柱状图
+function drawStageChart(stages) {
+    const canvas = document.getElementById('stageLatencyChart');
+    const rowHeight = 36;
+    canvas.height = Math.max(120, stages.length * rowHeight + 30) * (canvas.dataset.ratio || 1);
+    const { ctx, width } = prepareCanvas(canvas);
+    drawLegend(ctx, width, ['p50', 'p95', 'p99']);
+
+    const labelWidth = 140;
+    const chartWidth = width - labelWidth - 60;
+    const maxValue = Math.max(0.001, ...stages.map(stage => stage.p99));
+
+    stages.forEach((stage, index) => {
+        const y = 24 + index * rowHeight;
+        ctx.fillStyle = '#333';
+        ctx.fillText(stage.name, 0, y + 16);
+        ['p50', 'p95', 'p99'].forEach((key, barIndex) => {
+            const barWidth = (stage[key] / maxValue) * chartWidth;
+            ctx.fillStyle = LATENCY_COLORS[key];
+            ctx.fillRect(labelWidth, y + barIndex * 10, barWidth, 8);
+        });
+        ctx.fillStyle = '#666';
+        ctx.fillText(stage.p95.toFixed(2), labelWidth + (stage.p99 / maxValue) * chartWidth + 6, y + 16);
+    });
+}
+
+// 请求总耗时的 p50 / p95 折线图
+function drawTrendChart() {
+    const canvas = document.getElementById('requestTrendChart');
+    const { ctx, width, height } = prepareCanvas(canvas);
+    drawLegend(ctx, width, ['p50', 'p95']);
+    if (requestTrend.length < 2) return;
+
+    const top = 20;
+    const bottom = height - 20;
+    const maxValue = Math.max(0.001, ...requestTrend.map(point => point.p95));
+    ctx.fillStyle = '#999';
+    ctx.fillText(maxValue.toFixed(2), 0, top + 10);
+    ctx.fillText('0', 0, bottom);
+
+    ['p50', 'p95'].forEach(key => {
+        ctx.strokeStyle = LATENCY_COLORS[key];
+        ctx.lineWidth = 2;
+        ctx.beginPath();
+        requestTrend.forEach((point, index) => {
+            const x = 40 + (index / (TREND_POINTS - 1)) * (width - 50);
+            const y = bottom - (point[key] / maxValue) * (bottom - top);
+            if (index === 0) ctx.moveTo(x, y);
+            else ctx.lineTo(x, y);
+        });
+        ctx.stroke();
+    });
+}
+
+function renderCards(metrics) {
+    const gauges = metrics.gauges || {};
+    const counters = metrics.counters || {};
+    const collectors = metrics.collectors || {};
+    const cache = collectors.response_cache || {};
+    const endpoints = collectors.endpoints || {};
+    const scheduler = collectors.scheduler || {};
+    const stageMemo = collectors.stage_memo || {};
+
+    const cards = [
+        ['请求数', sumSeries(counters.requests_total)],
+        ['已取消', sumSeries(counters.requests_cancelled_total)],
+        ['出错', sumSeries(counters.request_errors_total)],
+        ['大模型调用', sumSeries(counters.llm_calls_total)],
+        ['响应缓存命中率', formatPercent(cache.hit_rate)],
+        ['对冲 / 故障转移', `${endpoints.hedges_fired ?? '-'} / ${endpoints.failovers ?? '-'}`],
+        ['排队中 / 阶段复用', `${scheduler.queue_depth ?? '-'} / ${stageMemo.hits ?? '-'}`],
+        ['线程数', sumSeries(gauges.threads)],
+        ['内存占用', formatBytes(gauges.memory_rss_bytes ? sumSeries(gauges.memory_rss_bytes) : null)],
+    ];
+
+    document.getElementById('metricsCards').innerHTML = cards.map(([label, value]) => `
+        <div class="metrics-card">
+            <div class="metrics-label">${label}</div>
+            <div class="metrics-value">${value}</div>
+        </div>
+    `).join('');
+}
+
+async function refreshMetrics() {
+    try {
+        const response = await fetch('/api/metrics');
+        const result = await response.json();
+        if (!result.success) {
+            document.getElementById('metricsNotice').textContent = result.message;
+            return;
+        }
+
+        const metrics = result.metrics;
+        renderCards(metrics);
+
+        const stages = ((metrics.histograms || {}).stage_latency_seconds || [])
+            .map(item => ({ name: item.labels.stage, p50: item.p50, p95: item.p95, p99: item.p99 }))
+            .sort((a, b) => b.p95 - a.p95);
+        drawStageChart(stages);
+
+        const request = stages.find(stage => stage.name === 'request');
+        if (request) {
+            requestTrend.push({ p50: request.p50, p95: request.p95 });
+            if (requestTrend.length > TREND_POINTS) requestTrend.shift();
+        }
+        drawTrendChart();
+
+        document.getElementById('metricsNotice').textContent = stages.length
+            ? `更新于 ${new Date(metrics.timestamp * 1000).toLocaleTimeString()}`
+            : '暂无请求数据（单独运行 app.py 时只有进程指标，请通过女仆主程序打开设置界面）';
+    } catch (error) {
+        document.getElementById('metricsNotice').textContent = `获取运行指标失败：${error.message}`;
+    }
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    refreshMetrics();
+    setInterval(refreshMetrics, METRICS_REFRESH_INTERVAL);
+});
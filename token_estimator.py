@@ -0,0 +1,35 @@
+"""
+Token 数量估算
+不依赖具体模型的分词器，按字符类型粗略估算 token 数，
+用于统计浪费的 token、控制上下文预算等不需要精确值的场合
+"""
+
+import re
+
+# 中日韩字符大约 1 字 1 token，其余字符大约 4 个字符 1 token
+_CJK_PATTERN = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿＀-￯]')
+
+# 每条消息的固定开销（角色标记等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """估算一段文本的 token 数"""
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + 3) // 4
+
+
+def estimate_message_tokens(message: dict) -> int:
+    """估算单条消息的 token 数（支持图片消息中的文本部分）"""
+    content = message.get("content", "")
+    if isinstance(content, list):
+        content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def estimate_messages_tokens(messages: list) -> int:
+    """估算消息列表的总 token 数"""
+    return sum(estimate_message_tokens(message) for message in messages)
@@ -0,0 +1,211 @@
+"""
+请求级延迟追踪
+每次请求创建一个 Trace，各阶段用 span() 记录开始时间和耗时（判断、任务详情、代码匹配、代码生成、预检查、执行、
+结果反馈、翻译、TTS 下载、变调、首个音频采样、动画切换等），请求结束后可导出为 Chrome trace JSON，
+在 chrome://tracing 或 https://ui.perfetto.dev 中打开查看。
+
+无论是否处于请求中，span() 的耗时都会计入 metrics 中按阶段的直方图 stage_latency_seconds，用于查看 p50 / p95 / p99。
+
+事件记在当前上下文（contextvars）绑定的追踪上，派发到线程池的代码需要用 copy_context() 带上调用方的上下文。
+服务模式和批处理中多个请求同时进行，不能按"最近一次请求"归属事件；只有桌面端单请求的追踪（attachable=True）
+允许 GUI 线程中不在请求上下文的代码通过 attach_latest 记到它上面。
+"""
+
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from metrics import metrics
+
+TRACE_DIR = "traces"
+STAGE_HISTOGRAM = "stage_latency_seconds"
+
+_trace_ids = itertools.count(1)
+
+
+class Trace:
+    """一次请求的追踪记录"""
+
+    def __init__(self, name: str, **args):
+        self.id = next(_trace_ids)
+        self.name = name
+        self.args = args
+        self.start = time.perf_counter()
+        self.wall_start = datetime.now()
+        self.finished = False
+        self._lock = threading.Lock()
+        self._events = []
+
+    def _timestamp_us(self, perf_time: float) -> float:
+        return (perf_time - self.start) * 1e6
+
+    def add_span(self, name: str, start: float, end: float, args: dict = None):
+        with self._lock:
+            self._events.append({
+                "name": name, "ph": "X", "pid": 1, "tid": threading.get_ident(),
+                "ts": self._timestamp_us(start), "dur": (end - start) * 1e6, "args": args or {},
+            })
+
+    def add_mark(self, name: str, args: dict = None):
+        with self._lock:
+            self._events.append({
+                "name": name, "ph": "i", "s": "t", "pid": 1, "tid": threading.get_ident(),
+                "ts": self._timestamp_us(time.perf_counter()), "args": args or {},
+            })
+
+    @property
+    def duration(self) -> float:
+        return time.perf_counter() - self.start
+
+    def to_chrome_trace(self) -> dict:
+        """导出为 Chrome trace 格式"""
+        with self._lock:
+            events = list(self._events)
+        thread_ids = sorted({event["tid"] for event in events})
+        metadata = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": f"thread-{index}"}}
+                    for index, tid in enumerate(thread_ids)]
+        return {
+            "traceEvents": metadata + sorted(events, key=lambda event: event["ts"]),
+            "displayTimeUnit": "ms",
+            "otherData": {"request": self.name, "started_at": self.wall_start.isoformat(), **self.args},
+        }
+
+    def summary(self) -> dict:
+        """各阶段的总耗时（秒）"""
+        totals = {}
+        with self._lock:
+            for event in self._events:
+                if event["ph"] == "X":
+                    totals[event["name"]] = totals.get(event["name"], 0.0) + event["dur"] / 1e6
+        return totals
+
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+# 最近一次 attachable 的追踪（桌面端同一时间只有一个请求）
+_latest_trace = None
+
+
+def get_settings() -> dict:
+    """读取追踪配置（performance_settings.tracing）"""
+    try:
+        from config_loader import get_performance_config
+        return get_performance_config().get("tracing") or {}
+    except Exception:
+        return {}
+
+
+def start_trace(name: str = "request", attachable: bool = False, **args) -> Trace:
+    """
+    创建一次请求的追踪（需要在请求的上下文中调用 use_trace 才会生效）
+
+    Args:
+        attachable: 允许不在请求上下文中的 GUI 代码通过 attach_latest 记到这次追踪上，
+                    只用于同一时间只有一个请求的桌面端
+    """
+    global _latest_trace
+    trace = Trace(name, **args)
+    if attachable:
+        _latest_trace = trace
+    return trace
+
+
+def _attached_trace(attach_latest: bool):
+    trace = _current_trace.get()
+    if trace is None and attach_latest and _latest_trace is not None and not _latest_trace.finished:
+        trace = _latest_trace
+    return trace
+
+
+def use_trace(trace: Trace):
+    """把 trace 设为当前上下文的追踪"""
+    _current_trace.set(trace)
+
+
+def current_trace() -> Trace:
+    return _current_trace.get()
+
+
+def _record_sample(name: str, duration: float):
+    metrics.observe(STAGE_HISTOGRAM, duration, stage=name)
+
+
+@contextmanager
+def span(name: str, attach_latest: bool = False, **args):
+    """
+    记录一个阶段的耗时
+
+    Args:
+        name: 阶段名称
+        attach_latest: 当前上下文没有追踪时，记到桌面端未结束的请求上（用于 GUI、加载线程等不在请求上下文中的代码）
+    """
+    trace = _attached_trace(attach_latest)
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        end_time = time.perf_counter()
+        _record_sample(name, end_time - start_time)
+        if trace is not None:
+            trace.add_span(name, start_time, end_time, args)
+
+
+def mark(name: str, attach_latest: bool = False, **args):
+    """记录一个瞬时事件（首个音频采样、动画切换等），并把距请求开始的时间计入统计；attach_latest 同 span"""
+    trace = _attached_trace(attach_latest)
+    if trace is None:
+        return
+    trace.add_mark(name, args)
+    _record_sample(name, trace.duration)
+
+
+def finish_trace(trace: Trace):
+    """结束一次请求的追踪：记录总耗时，按配置导出 Chrome trace 文件"""
+    if trace is None or trace.finished:
+        return
+    trace.finished = True
+    _record_sample(trace.name, trace.duration)
+
+    settings = get_settings()
+    if not settings.get("export", False):
+        return
+    trace_dir = settings.get("directory", TRACE_DIR)
+    try:
+        os.makedirs(trace_dir, exist_ok=True)
+        path = os.path.join(trace_dir, f"{trace.wall_start:%Y%m%d_%H%M%S}_{trace.id}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(trace.to_chrome_trace(), f, ensure_ascii=False)
+        _prune_trace_files(trace_dir, settings.get("max_files", 50))
+        print(f"请求追踪已导出: {path}（总耗时 {trace.duration:.3f} 秒）")
+    except Exception as e:
+        print(f"⚠️ 导出请求追踪失败: {e}")
+
+
+def _prune_trace_files(trace_dir: str, max_files: int):
+    """只保留最新的 max_files 个追踪文件"""
+    files = sorted(name for name in os.listdir(trace_dir) if name.endswith(".json"))
+    for name in files[:-max_files] if max_files else []:
+        try:
+            os.remove(os.path.join(trace_dir, name))
+        except OSError:
+            pass
+
+
+def get_stage_percentiles() -> dict:
+    """各阶段耗时的样本数和 p50 / p95 / p99（秒）"""
+    return {
+        dict(key)["stage"]: {"count": stats["window"], "p50": stats["p50"], "p95": stats["p95"], "p99": stats["p99"]}
+        for key, stats in metrics.get_histogram(STAGE_HISTOGRAM).items()
+    }
+
+
+def format_stage_report() -> str:
+    """把各阶段的耗时分位数格式化为表格文本"""
+    lines = [f"{'阶段':<20}{'次数':>8}{'p50(s)':>10}{'p95(s)':>10}{'p99(s)':>10}"]
+    for name, stats in sorted(get_stage_percentiles().items()):
+        lines.append(f"{name:<20}{stats['count']:>8}{stats['p50']:>10.3f}{stats['p95']:>10.3f}{stats['p99']:>10.3f}")
+    return "\n".join(lines)
@@ -63,8 +63,45 @@
 # if __name__ == '__main__':
 #     print(connect(input()))
 
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import translators as ts
 
-def connect(text):
+from tracing import span
+
+# 预翻译：回复文本一生成完就提前开始翻译，语音合成时直接取结果
+_MAX_PENDING = 32
+_executor = ThreadPoolExecutor(max_workers=2)
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def _translate(text):
     translated_text = ts.translate_text(text, to_language='ja',from_language='zh',translator="alibaba")
-    return translated_text
\ No newline at end of file
+    return translated_text
+
+
+def prefetch(text):
+    """在后台提前翻译文本，供随后的 connect 调用直接使用"""
+    if not text:
+        return
+    with _pending_lock:
+        if text in _pending:
+            return
+        if len(_pending) >= _MAX_PENDING:
+            # 丢弃最早的预翻译，避免未被使用的结果无限堆积
+            _pending.pop(next(iter(_pending)))
+        _pending[text] = _executor.submit(_translate, text)
+
+
+def connect(text):
+    with _pending_lock:
+        future = _pending.pop(text, None)
+    with span("translate", prefetched=future is not None):
+        if future is not None:
+            try:
+                return future.result()
+            except Exception as e:
+                print(f"预翻译失败，重新翻译: {e}")
+        return _translate(text)
\ No newline at end of file
@@ -0,0 +1,206 @@
+"""
+连接与配置预热
+按下 Alt+D 到输入完成通常有好几秒，利用这段时间在后台做好第一个请求要用到的准备：
+
+- 重新读取配置文件，刷新端点列表和代码库函数列表
+- 加载本地意图分类器（没有保存的模型时现场训练）
+- 解析各端点的域名，并通过共享连接池向每个端点发一个很小的请求，提前完成 TCP / TLS 握手；
+  ping 为 true 时请求 GET /models（顺带确认密钥可用），否则只发 HEAD 建立连接。聊天和语音合成共用这些连接
+
+空闲保活：连接池的空闲连接 120 秒后过期，距离上一次上游请求超过 keepalive_interval 秒时自动预热一次，
+长时间空闲后的第一个请求也不必重新握手。用户最后一次活动（输入或按下快捷键）超过 keepalive_max_idle 秒后不再保活，
+人不在时不一直发请求。
+
+预热请求经过 rate_limiter（后台优先级），不影响用户请求。相关参数在 performance_settings.warmup 中配置。
+"""
+
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+from metrics import metrics
+
+
+def get_settings() -> dict:
+    """读取预热配置（performance_settings.warmup）"""
+    try:
+        from config_loader import get_performance_config
+        return get_performance_config().get("warmup") or {}
+    except Exception:
+        return {}
+
+
+class Warmup:
+    """后台预热和空闲保活"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = False
+        self._last_run = 0.0         # 上一次预热开始的时间（monotonic）
+        self._last_activity = time.monotonic()
+        self._keepalive_thread = None
+        self._stop_event = threading.Event()
+        self.stats = {"runs": 0, "skipped": 0, "keepalive_runs": 0, "pings": 0, "errors": 0,
+                      "last_duration": 0.0}
+
+    def touch(self):
+        """记录一次用户活动（按下快捷键、提交输入）"""
+        self._last_activity = time.monotonic()
+
+    def trigger(self, reason: str = "hotkey") -> bool:
+        """
+        在后台线程中开始一次预热（不阻塞调用方）
+
+        正在预热或距离上一次预热不足 min_interval 秒时跳过
+
+        Returns:
+            是否开始了预热
+        """
+        settings = get_settings()
+        if reason != "keepalive":
+            self.touch()
+        if not settings.get("enabled", True):
+            return False
+        with self._lock:
+            now = time.monotonic()
+            if self._running or now - self._last_run < settings.get("min_interval", 15.0):
+                self.stats["skipped"] += 1
+                return False
+            self._running = True
+            self._last_run = now
+        threading.Thread(target=self._run, args=(reason,), daemon=True, name="warmup").start()
+        return True
+
+    def _run(self, reason: str):
+        start_time = time.perf_counter()
+        try:
+            self.run(reason)
+        finally:
+            duration = time.perf_counter() - start_time
+            with self._lock:
+                self._running = False
+                self.stats["runs"] += 1
+                self.stats["last_duration"] = round(duration, 3)
+                if reason == "keepalive":
+                    self.stats["keepalive_runs"] += 1
+            metrics.inc("warmup_total", reason=reason)
+            metrics.observe("warmup_seconds", duration)
+
+    def run(self, reason: str = "manual"):
+        """执行一次预热（阻塞），各步骤的失败只记录，不抛出"""
+        settings = get_settings()
+        if reason != "keepalive":
+            self._refresh_local_state()
+
+        # 回放录制的流量时不连接网络，没有连接需要预热
+        from http_recorder import get_settings as get_traffic_settings
+        if get_traffic_settings().get("mode", "off") == "replay":
+            return
+
+        from endpoint_pool import endpoint_pool
+        try:
+            endpoints = endpoint_pool.get_endpoints()
+        except Exception as e:
+            self._record_error(f"读取端点列表失败: {e}")
+            return
+        for endpoint in endpoints:
+            self._warm_endpoint(endpoint, settings)
+
+    def _refresh_local_state(self):
+        """重新读取配置、代码库函数列表，加载意图分类器，按需重新派生缓存音频"""
+        try:
+            from config_loader import get_performance_config, invalidate_config_cache
+            invalidate_config_cache()
+            performance_config = get_performance_config()
+        except Exception as e:
+            self._record_error(f"刷新配置失败: {e}")
+            return
+        try:
+            from maid_core import get_function_list
+            get_function_list()
+        except Exception as e:
+            self._record_error(f"读取代码库函数列表失败: {e}")
+        if performance_config.get("local_classifier", True):
+            try:
+                from intent_classifier import get_classifier
+                get_classifier()
+            except Exception as e:
+                self._record_error(f"加载意图分类器失败: {e}")
+        try:
+            # 变调参数改过时，在后台从缓存的原始语音重新派生
+            from audio_variants import rederiver
+            rederiver.refresh()
+        except Exception as e:
+            self._record_error(f"重新派生缓存音频失败: {e}")
+
+    def _warm_endpoint(self, endpoint, settings: dict):
+        """解析端点域名，经共享连接池发一个小请求建立（或保持）连接"""
+        from llm_client import client_manager
+        from rate_limiter import rate_limiter
+
+        parts = urlsplit(endpoint.base_url)
+        try:
+            if parts.hostname:
+                socket.getaddrinfo(parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+            # 预热请求不算作用户请求，空闲保活按用户请求的时间计算
+            extensions = {"warmup": True}
+            timeout = settings.get("timeout", 10.0)
+            with rate_limiter.slot(endpoint.name, "warmup"):
+                if settings.get("ping", True):
+                    client_manager.http_client.get(f"{endpoint.base_url}/models", timeout=timeout,
+                                                   headers={"Authorization": f"Bearer {endpoint.api_key}"},
+                                                   extensions=extensions)
+                else:
+                    client_manager.http_client.head(endpoint.base_url, timeout=timeout, extensions=extensions)
+            with self._lock:
+                self.stats["pings"] += 1
+        except Exception as e:
+            self._record_error(f"预热端点 {endpoint.name} 失败: {e}")
+
+    def _record_error(self, message: str):
+        with self._lock:
+            self.stats["errors"] += 1
+        print(f"⚠️ {message}")
+
+    def start_keepalive(self):
+        """启动空闲保活线程（keepalive_interval 为 0 时不启动）"""
+        if get_settings().get("keepalive_interval", 60.0) <= 0:
+            return
+        with self._lock:
+            if self._keepalive_thread is not None:
+                return
+            self._stop_event.clear()
+            self._keepalive_thread = threading.Thread(target=self._keepalive_loop, daemon=True, name="keepalive")
+            self._keepalive_thread.start()
+
+    def _keepalive_loop(self):
+        while True:
+            settings = get_settings()
+            interval = settings.get("keepalive_interval", 60.0)
+            if interval <= 0 or self._stop_event.wait(min(interval / 2, 30.0)):
+                break
+            if not settings.get("enabled", True):
+                continue
+            from llm_client import client_manager
+            now = time.monotonic()
+            last_request = max(client_manager.last_request_at, self._last_run)
+            last_activity = max(client_manager.last_request_at, self._last_activity)
+            if now - last_request >= interval and now - last_activity <= settings.get("keepalive_max_idle", 1800.0):
+                self.trigger("keepalive")
+        with self._lock:
+            self._keepalive_thread = None
+
+    def stop(self):
+        """停止空闲保活线程"""
+        self._stop_event.set()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {**self.stats, "keepalive": self._keepalive_thread is not None,
+                    "idle_seconds": round(time.monotonic() - self._last_activity, 1)}
+
+
+# 全局预热实例
+warmup = Warmup()
+metrics.register_collector("warmup", warmup.get_stats)